@@ -0,0 +1,127 @@
+# db.py — acesso ao rpg.db compartilhado por main.py, item_popup.py e skill_popup.py
+#  - um writer por processo (@st.cache_resource), com lock de transação
+#  - pool de leitores somente-leitura (`?mode=ro`): com WAL não esperam o writer
+
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import streamlit as st
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DB_PATH = os.path.join(BASE_DIR, "rpg.db")
+READER_POOL_SIZE = 4
+CACHED_STATEMENTS = 256
+
+
+class _LockedConnection(sqlite3.Connection):
+    """
+    Conexão compartilhada entre as sessões: o bloco de transação
+    (`with conn:`) segura um lock, para duas sessões não misturarem
+    statements na mesma transação.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._tx_lock = threading.RLock()
+
+    def __enter__(self):
+        self._tx_lock.acquire()
+        return super().__enter__()
+
+    def __exit__(self, *exc):
+        try:
+            return super().__exit__(*exc)
+        finally:
+            self._tx_lock.release()
+
+
+def _apply_pragmas(conn, cache_kib):
+    """PRAGMAs por conexão (valem para o writer e para os leitores)."""
+    conn.execute("PRAGMA busy_timeout=30000")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute(f"PRAGMA cache_size=-{cache_kib}")
+    conn.execute("PRAGMA mmap_size=268435456")
+    # garante que ON DELETE CASCADE funciona
+    conn.execute("PRAGMA foreign_keys=ON")
+
+
+@st.cache_resource
+def _shared_conn():
+    conn = sqlite3.connect(
+        DB_PATH,
+        check_same_thread=False,
+        factory=_LockedConnection,
+        cached_statements=CACHED_STATEMENTS,
+    )
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    _apply_pragmas(conn, 64000)
+    # atualiza as estatísticas do planner só onde estiverem desatualizadas
+    conn.execute("PRAGMA optimize")
+    return conn
+
+
+def get_conn():
+    # uma conexão por processo: sobrevive aos reruns (cada um roda numa thread nova),
+    # então não reabre o arquivo nem repete os PRAGMAs e o cache de páginas fica quente
+    return _shared_conn()
+
+
+class ReaderPool:
+    """
+    Conexões somente-leitura (`?mode=ro`). Com WAL, leitores não esperam
+    o writer, então as sessões leem em paralelo.
+    """
+
+    def __init__(self, size: int):
+        uri = Path(DB_PATH).resolve().as_uri() + "?mode=ro"
+        self._q = queue.Queue(maxsize=size)
+        for _ in range(size):
+            conn = sqlite3.connect(
+                uri, uri=True, check_same_thread=False, cached_statements=CACHED_STATEMENTS
+            )
+            conn.row_factory = sqlite3.Row
+            _apply_pragmas(conn, 16000)
+            self._q.put(conn)
+
+    def get(self):
+        return self._q.get()
+
+    def put(self, conn):
+        self._q.put(conn)
+
+
+@st.cache_resource
+def _reader_pool():
+    # o writer abre primeiro: é ele que cria o arquivo e coloca o banco em WAL
+    _shared_conn()
+    return ReaderPool(READER_POOL_SIZE)
+
+
+@contextmanager
+def reader():
+    pool = _reader_pool()
+    conn = pool.get()
+    try:
+        yield conn
+    finally:
+        pool.put(conn)
+
+
+@contextmanager
+def writer():
+    # BEGIN IMMEDIATE pega o lock de escrita já no início (sem SQLITE_BUSY no meio)
+    conn = _shared_conn()
+    with conn._tx_lock:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
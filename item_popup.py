@@ -1,1047 +1,1354 @@
-# item_popup.py
-"""
-Item Popup feature (modular)
-- Tabela com campos específicos de ITEM + bordas customizáveis
-- Editor em sidebar dentro de expander (admin) com preview (renderizado via components.html)
-- Render via components.html com altura dinâmica (evita corte)
-- Resiliência: erros no editor aparecem no sidebar (traceback) em vez de quebrar app
-"""
-
-import os
-import sqlite3
-import base64
-from datetime import datetime
-from contextlib import contextmanager
-import traceback
-
-import streamlit as st
-
-DB_PATH = os.path.join(os.path.dirname(__file__), "rpg.db")
-
-
-def _now_iso():
-    return datetime.utcnow().isoformat()
-
-
-def get_conn():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-
-SCHEMA_POPUP_BASE = """
-CREATE TABLE IF NOT EXISTS item_popup (
-  id INTEGER PRIMARY KEY AUTOINCREMENT,
-  owner_user_id INTEGER,
-  target_item_id INTEGER,
-  target_user_id INTEGER,
-  title TEXT DEFAULT '',
-  icon_filename TEXT DEFAULT '',
-  icon_blob BLOB,
-  rank TEXT DEFAULT '',
-  classificacao TEXT DEFAULT '',
-  tipo TEXT DEFAULT '',
-  usos TEXT DEFAULT '',
-  requisitos TEXT DEFAULT '',
-  efeito_passivo TEXT DEFAULT '',
-  bonus_equipamento TEXT DEFAULT '',
-  descricao TEXT NOT NULL DEFAULT '',
-  card_border_type TEXT DEFAULT 'none',
-  card_border_color1 TEXT DEFAULT '#ffffff',
-  card_border_color2 TEXT DEFAULT '#000000',
-  card_border_speed REAL DEFAULT 1.0,
-  image_border_type TEXT DEFAULT 'none',
-  image_border_color1 TEXT DEFAULT '#ffffff',
-  image_border_color2 TEXT DEFAULT '#000000',
-  image_border_speed REAL DEFAULT 1.0,
-  created_at TEXT NOT NULL,
-  updated_at TEXT NOT NULL,
-  UNIQUE(target_item_id, target_user_id)
-);
-"""
-
-
-def bootstrap():
-    """Garante tabela item_popup com todas as colunas necessárias."""
-    conn = get_conn()
-    with conn:
-        conn.executescript(SCHEMA_POPUP_BASE)
-        try:
-            existing_cols = {
-                r["name"]
-                for r in conn.execute("PRAGMA table_info(item_popup)").fetchall()
-            }
-        except Exception:
-            existing_cols = set()
-
-        desired_cols = {
-            "icon_filename",
-            "icon_blob",
-            "rank",
-            "classificacao",
-            "tipo",
-            "usos",
-            "requisitos",
-            "efeito_passivo",
-            "bonus_equipamento",
-            "descricao",
-            "card_border_type",
-            "card_border_color1",
-            "card_border_color2",
-            "card_border_speed",
-            "image_border_type",
-            "image_border_color1",
-            "image_border_color2",
-            "image_border_speed",
-            "created_at",
-            "updated_at",
-        }
-
-        for col in desired_cols:
-            if col not in existing_cols:
-                try:
-                    if col in {"icon_blob"}:
-                        conn.execute(f"ALTER TABLE item_popup ADD COLUMN {col} BLOB")
-                    elif col.endswith("_speed"):
-                        conn.execute(
-                            f"ALTER TABLE item_popup "
-                            f"ADD COLUMN {col} REAL DEFAULT 1.0"
-                        )
-                    elif col in {"created_at", "updated_at"}:
-                        conn.execute(
-                            f"ALTER TABLE item_popup "
-                            f"ADD COLUMN {col} TEXT NOT NULL DEFAULT ''"
-                        )
-                    else:
-                        conn.execute(
-                            f"ALTER TABLE item_popup "
-                            f"ADD COLUMN {col} TEXT DEFAULT ''"
-                        )
-                except Exception:
-                    # em migração, erros em ALTER TABLE são ignorados
-                    pass
-
-
-@contextmanager
-def safe_modal(title: str):
-    if hasattr(st, "modal"):
-        with st.modal(title):
-            yield
-    else:
-        st.markdown(f"### {title}")
-        with st.container():
-            yield
-
-
-def row_field(row, key, default=""):
-    """Acessa sqlite3.Row ou dict de forma segura."""
-    try:
-        if row is None:
-            return default
-        if hasattr(row, "keys"):
-            return row[key] if key in row.keys() and row[key] is not None else default
-        return row.get(key, default)
-    except Exception:
-        return default
-
-
-def upsert_popup(
-    owner_user_id,
-    target_item_id,
-    target_user_id,
-    title,
-    icon_filename,
-    icon_blob,
-    rank,
-    classificacao,
-    tipo,
-    usos,
-    requisitos,
-    efeito_passivo,
-    bonus_equipamento,
-    descricao,
-    card_border_type="none",
-    card_border_color1="#ffffff",
-    card_border_color2="#000000",
-    card_border_speed=1.0,
-    image_border_type="none",
-    image_border_color1="#ffffff",
-    image_border_color2="#000000",
-    image_border_speed=1.0,
-):
-    now = _now_iso()
-    conn = get_conn()
-    with conn:
-        cur = conn.execute(
-            "SELECT id FROM item_popup "
-            "WHERE target_item_id IS ? AND target_user_id IS ?",
-            (target_item_id, target_user_id),
-        )
-        row = cur.fetchone()
-        if row:
-            conn.execute(
-                """
-                UPDATE item_popup SET
-                    owner_user_id=?,
-                    title=?,
-                    icon_filename=?,
-                    icon_blob=?,
-                    rank=?,
-                    classificacao=?,
-                    tipo=?,
-                    usos=?,
-                    requisitos=?,
-                    efeito_passivo=?,
-                    bonus_equipamento=?,
-                    descricao=?,
-                    card_border_type=?,
-                    card_border_color1=?,
-                    card_border_color2=?,
-                    card_border_speed=?,
-                    image_border_type=?,
-                    image_border_color1=?,
-                    image_border_color2=?,
-                    image_border_speed=?,
-                    updated_at=?
-                WHERE id=?
-            """,
-                (
-                    owner_user_id,
-                    title,
-                    icon_filename,
-                    icon_blob,
-                    rank,
-                    classificacao,
-                    tipo,
-                    usos,
-                    requisitos,
-                    efeito_passivo,
-                    bonus_equipamento,
-                    descricao,
-                    card_border_type,
-                    card_border_color1,
-                    card_border_color2,
-                    float(card_border_speed),
-                    image_border_type,
-                    image_border_color1,
-                    image_border_color2,
-                    float(image_border_speed),
-                    now,
-                    row["id"],
-                ),
-            )
-            return row["id"]
-        else:
-            cur = conn.execute(
-                """
-                INSERT INTO item_popup(
-                  owner_user_id, target_item_id, target_user_id,
-                  title, icon_filename, icon_blob,
-                  rank, classificacao, tipo, usos, requisitos,
-                  efeito_passivo, bonus_equipamento, descricao,
-                  card_border_type, card_border_color1, card_border_color2, card_border_speed,
-                  image_border_type, image_border_color1, image_border_color2, image_border_speed,
-                  created_at, updated_at
-                ) VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-            """,
-                (
-                    owner_user_id,
-                    target_item_id,
-                    target_user_id,
-                    title,
-                    icon_filename,
-                    icon_blob,
-                    rank,
-                    classificacao,
-                    tipo,
-                    usos,
-                    requisitos,
-                    efeito_passivo,
-                    bonus_equipamento,
-                    descricao,
-                    card_border_type,
-                    card_border_color1,
-                    card_border_color2,
-                    float(card_border_speed),
-                    image_border_type,
-                    image_border_color1,
-                    image_border_color2,
-                    float(image_border_speed),
-                    now,
-                    now,
-                ),
-            )
-            return cur.lastrowid
-
-
-def delete_popup(popup_id):
-    conn = get_conn()
-    with conn:
-        conn.execute("DELETE FROM item_popup WHERE id=?", (popup_id,))
-
-
-def get_popup_for(item_id=None, user_id=None):
-    """Busca popup com prioridade: (item+user) > (item global) > (user global) > global."""
-    with get_conn() as conn:
-        if item_id is not None and user_id is not None:
-            r = conn.execute(
-                "SELECT * FROM item_popup "
-                "WHERE target_item_id=? AND target_user_id=? LIMIT 1",
-                (item_id, user_id),
-            ).fetchone()
-            if r:
-                return r
-        if item_id is not None:
-            r = conn.execute(
-                "SELECT * FROM item_popup "
-                "WHERE target_item_id=? AND target_user_id IS NULL LIMIT 1",
-                (item_id,),
-            ).fetchone()
-            if r:
-                return r
-        if user_id is not None:
-            r = conn.execute(
-                "SELECT * FROM item_popup "
-                "WHERE target_item_id IS NULL AND target_user_id=? LIMIT 1",
-                (user_id,),
-            ).fetchone()
-            if r:
-                return r
-        r = conn.execute(
-            "SELECT * FROM item_popup "
-            "WHERE target_item_id IS NULL AND target_user_id IS NULL LIMIT 1"
-        ).fetchone()
-        return r
-
-
-def _css_for_border(prefix, btype, c1, c2, speed, uid):
-    """
-    Produz CSS para borda que *não* cobre o interior (usa border/border-image).
-    Retorna (inline_css, extra_css, class_name)
-
-    Implementação idêntica à versão estável do skill_popup,
-    com animação FLOW usando conic-gradient + variável CSS,
-    para que APENAS as cores "girem" e não o card inteiro.
-    """
-    safe = lambda s: s.replace('"', "'")
-    cls = f"{prefix}_border_{uid}"
-    inline = ""
-    extra = ""
-
-    if not btype or btype == "none":
-        inline = "border: none; border-radius:12px;"
-    elif btype == "solid":
-        inline = f"border: 4px solid {safe(c1)}; border-radius:12px;"
-    elif btype == "gradient":
-        inline = (
-            "border: 6px solid transparent; border-radius:14px;"
-            f"-webkit-border-image: linear-gradient(90deg,{safe(c1)},{safe(c2)}) 1;"
-            f"border-image: linear-gradient(90deg,{safe(c1)},{safe(c2)}) 1;"
-        )
-    elif btype == "flow":
-        # anima apenas o ÂNGULO do gradiente, não o card
-        dur = max(0.6, 4.0 / float(max(0.1, speed)))
-        extra = f"""
-        @keyframes flow_{uid} {{
-           0%   {{ --pos: 0deg;   }}
-           100% {{ --pos: 360deg; }}
-        }}
-        .{cls} {{
-           border: 6px solid transparent;
-           border-radius:14px;
-           --pos: 0deg;
-           -webkit-border-image: conic-gradient(from var(--pos), {safe(c1)}, {safe(c2)}, {safe(c1)}) 1;
-           border-image: conic-gradient(from var(--pos), {safe(c1)}, {safe(c2)}, {safe(c1)}) 1;
-           animation: flow_{uid} {dur}s linear infinite;
-        }}
-        """
-        inline = ""
-    elif btype == "pulse":
-        dur = max(0.6, 2.0 / float(max(0.1, speed)))
-        inline = f"border: 4px solid {safe(c1)}; border-radius:14px;"
-        extra = f"""
-        @keyframes pulse_border_{uid} {{
-           0%   {{ box-shadow: 0 0 0 0 rgba(0,0,0,0); }}
-           50%  {{ box-shadow: 0 0 24px 8px {safe(c1)}66; }}
-           100% {{ box-shadow: 0 0 0 0 rgba(0,0,0,0); }}
-        }}
-        .{cls} {{
-           animation: pulse_border_{uid} {dur}s ease-in-out infinite;
-        }}
-        """
-    elif btype == "changing":
-        dur = max(0.6, 3.0 / float(max(0.1, speed)))
-        inline = f"border: 6px solid {safe(c1)}; border-radius:14px;"
-        extra = f"""
-        @keyframes changing_border_{uid} {{
-           0%   {{ border-color: {safe(c1)}; }}
-           50%  {{ border-color: {safe(c2)}; }}
-           100% {{ border-color: {safe(c1)}; }}
-        }}
-        .{cls} {{
-           animation: changing_border_{uid} {dur}s linear infinite;
-        }}
-        """
-    else:
-        inline = f"border: 3px solid {safe(c1)}; border-radius:12px;"
-
-    inline = "position:relative; box-sizing:border-box; " + inline
-    return inline, extra, cls
-
-
-def sidebar_item_popup_editor(current_user):
-    """
-    Editor de item popups (apenas admin). Só mostra itens da ficha selecionada.
-    """
-    try:
-        if not current_user or not current_user.get("is_admin"):
-            return
-
-        cid = st.session_state.get("cid")
-        if not cid:
-            st.sidebar.info(
-                "Selecione uma ficha antes de editar popups de item "
-                "(use o seletor à esquerda)."
-            )
-            return
-
-        with st.sidebar.expander("📦 Editor de Item Popups (Admin)", expanded=True):
-            st.markdown(f"**Editando popups de ITEM para a ficha #{cid}**")
-
-            # Lista apenas itens da ficha atual (inventory + items)
-            with get_conn() as conn:
-                try:
-                    rows = conn.execute(
-                        """
-                        SELECT i.id, i.name
-                        FROM inventory inv
-                        JOIN items i ON i.id = inv.item_id
-                        WHERE inv.character_id = ?
-                        ORDER BY i.name
-                        """,
-                        (cid,),
-                    ).fetchall()
-                except Exception:
-                    rows = []
-
-            if not rows:
-                st.info("Esta ficha não possui itens no inventário.")
-                return
-
-            options = [("— QUALQUER ITEM —", None)] + [
-                (r["name"], r["id"]) for r in rows
-            ]
-            labels = [o[0] for o in options]
-
-            sel_label = st.selectbox(
-                "Escolha o item (alvo do popup)",
-                labels,
-                index=0,
-                key=f"item_popup_select_item_{cid}",
-            )
-            sel_item_id = next(
-                (o[1] for o in options if o[0] == sel_label), None
-            )
-
-            with get_conn() as conn:
-                existing = conn.execute(
-                    "SELECT * FROM item_popup "
-                    "WHERE target_item_id IS ? AND target_user_id IS ?",
-                    (sel_item_id, cid),
-                ).fetchone()
-
-            # -------- CAMPOS DO POPUP --------
-            title = st.text_input(
-                "Título (ex: <TESOURO DE [?]>)",
-                value=row_field(existing, "title", ""),
-                key=f"item_popup_title_{cid}_{sel_item_id}",
-            )
-
-            st.caption("Ícone (opcional)")
-            upload_key = f"item_popup_icon_upload_{cid}_{sel_item_id}"
-            uploaded = st.file_uploader(
-                "Upload do ícone",
-                type=["png", "jpg", "jpeg", "webp", "gif"],
-                key=upload_key,
-            )
-            icon_blob = row_field(existing, "icon_blob", None)
-            icon_filename = row_field(existing, "icon_filename", "")
-            if uploaded:
-                try:
-                    icon_blob = uploaded.getvalue()
-                    icon_filename = (
-                        getattr(uploaded, "name", None)
-                        or icon_filename
-                        or "icon.png"
-                    )
-                    st.success("Ícone carregado (salvar para persistir).")
-                except Exception as e:
-                    st.error(f"Erro ao ler ícone: {e}")
-
-            st.markdown("**Metadados (lado direito)**")
-            cA, cB = st.columns(2)
-            with cA:
-                rank = st.text_input(
-                    "Rank",
-                    value=row_field(existing, "rank", "A"),
-                    key=f"item_popup_rank_{cid}_{sel_item_id}",
-                )
-                classificacao = st.text_input(
-                    "Classificação",
-                    value=row_field(existing, "classificacao", "EQUIPAMENTO"),
-                    key=f"item_popup_class_{cid}_{sel_item_id}",
-                )
-                tipo = st.text_input(
-                    "Tipo",
-                    value=row_field(existing, "tipo", "COLAR"),
-                    key=f"item_popup_tipo_{cid}_{sel_item_id}",
-                )
-            with cB:
-                usos = st.text_input(
-                    "Usos",
-                    value=row_field(existing, "usos", "1/1"),
-                    key=f"item_popup_usos_{cid}_{sel_item_id}",
-                )
-                requisitos = st.text_input(
-                    "Requisitos",
-                    value=row_field(existing, "requisitos", "N/A"),
-                    key=f"item_popup_req_{cid}_{sel_item_id}",
-                )
-
-            st.markdown("**EFEITO PASSIVO**")
-            efeito_passivo = st.text_area(
-                "Efeito passivo (uma linha por efeito)",
-                value=row_field(existing, "efeito_passivo", ""),
-                height=80,
-                key=f"item_popup_eff_{cid}_{sel_item_id}",
-            )
-
-            st.markdown("**BÔNUS DE EQUIPAMENTO**")
-            bonus_equip = st.text_area(
-                "Bônus de equipamento (uma linha por bônus)",
-                value=row_field(existing, "bonus_equipamento", ""),
-                height=80,
-                key=f"item_popup_bonus_{cid}_{sel_item_id}",
-            )
-
-            st.markdown("**DESCRIÇÃO**")
-            descricao = st.text_area(
-                "Descrição",
-                value=row_field(existing, "descricao", ""),
-                height=180,
-                key=f"item_popup_desc_{cid}_{sel_item_id}",
-            )
-
-            st.markdown("---")
-            st.markdown("### Bordas / Aparência")
-
-            CARD_TYPES = ["none", "solid", "gradient", "flow", "pulse", "changing"]
-            cur_card_type = row_field(existing, "card_border_type", "none")
-            card_border_type = st.selectbox(
-                "Tipo (card)",
-                CARD_TYPES,
-                index=(
-                    CARD_TYPES.index(cur_card_type)
-                    if cur_card_type in CARD_TYPES
-                    else 0
-                ),
-                key=f"item_popup_card_type_{cid}_{sel_item_id}",
-            )
-            card_color1 = st.color_picker(
-                "Cor primária (card)",
-                value=row_field(existing, "card_border_color1", "#ffffff"),
-                key=f"item_popup_card_color1_{cid}_{sel_item_id}",
-            )
-            card_color2 = st.color_picker(
-                "Cor secundária (card)",
-                value=row_field(existing, "card_border_color2", "#000000"),
-                key=f"item_popup_card_color2_{cid}_{sel_item_id}",
-            )
-            card_speed = st.slider(
-                "Velocidade / intensidade (card)",
-                0.2,
-                5.0,
-                float(row_field(existing, "card_border_speed", 1.0)),
-                0.1,
-                key=f"item_popup_card_speed_{cid}_{sel_item_id}",
-            )
-
-            IMG_TYPES = ["none", "solid", "gradient", "flow", "pulse", "changing"]
-            cur_img_type = row_field(existing, "image_border_type", "none")
-            image_border_type = st.selectbox(
-                "Tipo (imagem)",
-                IMG_TYPES,
-                index=(
-                    IMG_TYPES.index(cur_img_type)
-                    if cur_img_type in IMG_TYPES
-                    else 0
-                ),
-                key=f"item_popup_img_type_{cid}_{sel_item_id}",
-            )
-            image_color1 = st.color_picker(
-                "Cor primária (imagem)",
-                value=row_field(existing, "image_border_color1", "#ffffff"),
-                key=f"item_popup_img_color1_{cid}_{sel_item_id}",
-            )
-            image_color2 = st.color_picker(
-                "Cor secundária (imagem)",
-                value=row_field(existing, "image_border_color2", "#000000"),
-                key=f"item_popup_img_color2_{cid}_{sel_item_id}",
-            )
-            image_speed = st.slider(
-                "Velocidade / intensidade (imagem)",
-                0.2,
-                5.0,
-                float(row_field(existing, "image_border_speed", 1.0)),
-                0.1,
-                key=f"item_popup_img_speed_{cid}_{sel_item_id}",
-            )
-
-            # -------- PREVIEWS --------
-            import streamlit.components.v1 as components
-
-            preview_card_css, preview_card_extra, preview_card_cls = _css_for_border(
-                "preview_card",
-                card_border_type,
-                card_color1,
-                card_color2,
-                card_speed,
-                f"item_cv{cid}",
-            )
-            preview_card_html = f"""
-            <html><head><meta charset="utf-8"><style>
-              .preview_card_box {{
-                 width: 360px; height: 160px;
-                 border-radius:16px;
-                 background: linear-gradient(180deg,#2ca0ff,#005bd1);
-                 position:relative; color:#eaf6ff;
-                 padding:10px; box-shadow:0 10px 24px rgba(0,0,0,0.35);
-                 box-sizing:border-box;
-              }}
-              .preview_card_box .inner {{ padding:6px; }}
-              .{preview_card_cls} {{ {preview_card_css} }}
-              {preview_card_extra}
-            </style></head>
-            <body>
-              <div class="preview_card_box {preview_card_cls}">
-                <div class="inner">Preview Card</div>
-              </div>
-            </body></html>
-            """
-            components.html(preview_card_html, height=190, scrolling=False)
-
-            preview_img_css, preview_img_extra, preview_img_cls = _css_for_border(
-                "preview_img",
-                image_border_type,
-                image_color1,
-                image_color2,
-                image_speed,
-                f"item_iv{cid}",
-            )
-            preview_img_html = f"""
-            <html><head><meta charset="utf-8"><style>
-              .preview_img_box {{
-                width: 96px; height:96px;
-                border-radius:8px; background:#1b6de0;
-                display:inline-block; vertical-align:middle;
-                box-sizing:border-box;
-              }}
-              .{preview_img_cls} {{ {preview_img_css} }}
-              {preview_img_extra}
-            </style></head>
-            <body>
-              <div class="{preview_img_cls}" style="display:inline-block;padding:6px;border-radius:10px;">
-                <div class="preview_img_box"></div>
-              </div>
-            </body></html>
-            """
-            components.html(preview_img_html, height=150, scrolling=False)
-
-            # -------- AÇÕES --------
-            st.markdown("---")
-            c1, c2 = st.columns(2)
-            if c1.button(
-                "Salvar Popup",
-                key=f"item_popup_save_{cid}_{sel_item_id}",
-            ):
-                try:
-                    upsert_popup(
-                        current_user["id"],
-                        sel_item_id,
-                        cid,
-                        title,
-                        icon_filename,
-                        icon_blob,
-                        rank or "",
-                        classificacao or "",
-                        tipo or "",
-                        usos or "",
-                        requisitos or "",
-                        efeito_passivo or "",
-                        bonus_equip or "",
-                        descricao or "",
-                        card_border_type=card_border_type,
-                        card_border_color1=card_color1,
-                        card_border_color2=card_color2,
-                        card_border_speed=float(card_speed),
-                        image_border_type=image_border_type,
-                        image_border_color1=image_color1,
-                        image_border_color2=image_color2,
-                        image_border_speed=float(image_speed),
-                    )
-                    st.success("Popup de item salvo para esta ficha.")
-                except Exception:
-                    st.error("Erro ao salvar popup (veja traceback abaixo).")
-                    st.code(traceback.format_exc())
-
-            if c2.button(
-                "Excluir Popup",
-                key=f"item_popup_del_{cid}_{sel_item_id}",
-            ):
-                if existing and "id" in existing.keys():
-                    try:
-                        delete_popup(existing["id"])
-                        st.success("Popup de item excluído.")
-                    except Exception:
-                        st.error("Erro ao excluir popup (veja traceback abaixo).")
-                        st.code(traceback.format_exc())
-                else:
-                    st.warning(
-                        "Nenhum popup existente para excluir "
-                        "nesta combinação ficha/item."
-                    )
-    except Exception:
-        tb = traceback.format_exc()
-        try:
-            st.sidebar.error(
-                "Erro ao inicializar/mostrar editor de popups de item (veja traceback)."
-            )
-            st.sidebar.code(tb)
-        except Exception:
-            print("item_popup sidebar error:\n", tb)
-
-
-def render_item_button(item_row, character_id, current_user):
-    """
-    Botão 🔍 para cada item do inventário.
-    Usa a tabela item_popup para renderizar card customizado.
-    """
-    def _get(r, k, default=""):
-        try:
-            return r[k] if k in r.keys() else default
-        except Exception:
-            try:
-                return r.get(k, default)
-            except Exception:
-                return default
-
-    item_id = _get(item_row, "item_id", _get(item_row, "id", None))
-    item_name = _get(item_row, "name", "Item")
-    item_desc = _get(item_row, "description", "")
-
-    btn_key = f"item_popup_btn_{item_id}_{character_id}"
-    open_key = f"item_popup_open_{item_id}_{character_id}"
-    if open_key not in st.session_state:
-        st.session_state[open_key] = False
-
-    if st.button(f"🔍 {item_name}", key=btn_key):
-        st.session_state[open_key] = not st.session_state[open_key]
-
-    if st.session_state.get(open_key):
-        popup = get_popup_for(item_id=item_id, user_id=character_id)
-        if popup:
-            _render_item_template_popup(
-                popup, item_name, item_desc, character_id, current_user
-            )
-        else:
-            with safe_modal(item_name):
-                st.markdown("**Descrição do catálogo:**")
-                st.write(item_desc or "_(sem descrição)_")
-
-
-def _render_item_template_popup(
-    popup_row, item_name, item_desc, character_id, current_user
-):
-    import html as _html
-    import textwrap
-    import streamlit.components.v1 as components
-
-    def _g(k):
-        return row_field(popup_row, k, "")
-
-    title = _g("title") or item_name
-    icon_blob = _g("icon_blob")
-    icon_filename = (_g("icon_filename") or "").strip()
-    rank = _g("rank") or ""
-    classificacao = _g("classificacao") or ""
-    tipo = _g("tipo") or ""
-    usos = _g("usos") or ""
-    requisitos = _g("requisitos") or ""
-    efeito_passivo = _g("efeito_passivo") or ""
-    bonus_equip = _g("bonus_equipamento") or ""
-    descricao = _g("descricao") or ""
-
-    card_border_type = _g("card_border_type") or "none"
-    card_border_color1 = _g("card_border_color1") or "#ffffff"
-    card_border_color2 = _g("card_border_color2") or "#000000"
-    try:
-        card_border_speed = float(_g("card_border_speed") or 1.0)
-    except Exception:
-        card_border_speed = 1.0
-
-    image_border_type = _g("image_border_type") or "none"
-    image_border_color1 = _g("image_border_color1") or "#ffffff"
-    image_border_color2 = _g("image_border_color2") or "#000000"
-    try:
-        image_border_speed = float(_g("image_border_speed") or 1.0)
-    except Exception:
-        image_border_speed = 1.0
-
-    uid = f"{row_field(popup_row, 'id','x')}_{character_id}"
-
-    # Ícone
-    if icon_blob:
-        try:
-            b64 = base64.b64encode(icon_blob).decode()
-            mime = "image/png"
-            if icon_filename.lower().endswith((".jpg", ".jpeg")):
-                mime = "image/jpeg"
-            elif icon_filename.lower().endswith(".gif"):
-                mime = "image/gif"
-            elif icon_filename.lower().endswith(".webp"):
-                mime = "image/webp"
-            data_uri = f"data:{mime};base64,{b64}"
-            icon_html_inner = (
-                f'<img src="{data_uri}" '
-                'style="width:160px;height:160px;object-fit:cover;'
-                'border-radius:6px;display:block" />'
-            )
-        except Exception:
-            icon_html_inner = (
-                '<div style="width:160px;height:160px;border-radius:6px;'
-                'background:rgba(0,0,0,0.25);display:flex;align-items:center;'
-                'justify-content:center;color:#dff4ff;">ICON</div>'
-            )
-    else:
-        icon_html_inner = (
-            '<div style="width:160px;height:160px;border-radius:6px;'
-            'background:rgba(0,0,0,0.25);display:flex;align-items:center;'
-            'justify-content:center;color:#dff4ff;">ICON</div>'
-        )
-
-    # Bordas
-    card_css_inline, card_extra, card_cls = _css_for_border(
-        "card", card_border_type, card_border_color1, card_border_color2,
-        card_border_speed, uid
-    )
-    img_css_inline, img_extra, img_cls = _css_for_border(
-        "img", image_border_type, image_border_color1, image_border_color2,
-        image_border_speed, uid
-    )
-
-    def esc_lines(text):
-        if not text:
-            return ""
-        return "<br>".join(_html.escape(l) for l in str(text).splitlines())
-
-    desc_esc = esc_lines(descricao or item_desc)
-    efeito_esc = esc_lines(efeito_passivo)
-    bonus_esc = esc_lines(bonus_equip)
-
-    html = textwrap.dedent(
-        f"""
-    <!doctype html>
-    <html>
-    <head>
-      <meta charset="utf-8">
-      <meta name="viewport" content="width=device-width,initial-scale=1">
-      <style>
-        :root {{
-          --bg1: #2ea8ff;
-          --bg2: #0056d3;
-          --headline: #ffffff;
-          --body-text: #e4f4ff;
-          font-family: "Segoe UI", Roboto, Arial, sans-serif;
-        }}
-        body {{
-          margin:0;
-          background: transparent;
-          -webkit-font-smoothing:antialiased;
-        }}
-        .outer {{
-          width:100%;
-          display:flex;
-          justify-content:center;
-          padding:8px 14px;
-          box-sizing:border-box;
-        }}
-        .card {{
-          width:960px;
-          border-radius:20px;
-          padding:20px;
-          color:var(--body-text);
-          position:relative;
-          overflow:visible;
-          box-sizing:border-box;
-        }}
-        .card-inner {{
-          background: linear-gradient(180deg, var(--bg1) 0%, var(--bg2) 100%);
-          border-radius:16px;
-          padding:18px 26px 24px;
-          box-sizing:border-box;
-        }}
-        .title-bar {{
-          text-align:center;
-          font-size:24px;
-          font-weight:800;
-          letter-spacing:1px;
-          color:var(--headline);
-          text-shadow:0 0 8px rgba(0,0,0,0.65);
-          margin-bottom:12px;
-        }}
-        .top-icons {{
-          position:absolute;
-          right:32px; top:22px;
-          display:flex;
-          gap:4px;
-        }}
-        .top-icon-box {{
-          width:18px; height:18px;
-          border-radius:3px;
-          border:1px solid rgba(255,255,255,0.75);
-          background:rgba(0,0,0,0.12);
-        }}
-        .content-row {{
-          display:flex;
-          gap:22px;
-          align-items:flex-start;
-        }}
-        .icon-col {{
-          width:210px;
-          flex:0 0 210px;
-          text-align:center;
-          position:relative;
-        }}
-        .icon-wrapper {{
-          display:inline-block;
-          padding:8px;
-          border-radius:14px;
-          box-sizing:border-box;
-        }}
-        .text-col {{
-          flex:1;
-          min-width:0;
-          position:relative;
-          color:var(--body-text);
-        }}
-        .item-name {{
-          font-size:22px;
-          font-weight:800;
-          color:#ffffff;
-          margin-bottom:4px;
-          text-shadow:0 0 8px rgba(0,0,0,0.6);
-        }}
-        .meta-block {{
-          font-size:14px;
-          margin-bottom:10px;
-          line-height:1.4;
-        }}
-        .meta-block div {{
-          margin-bottom:2px;
-        }}
-        .section-title {{
-          font-size:16px;
-          font-weight:800;
-          color:#ffffff;
-          margin-top:10px;
-          margin-bottom:4px;
-        }}
-        .section-text {{
-          font-size:14px;
-          line-height:1.4;
-        }}
-        .desc-block {{
-          margin-top:12px;
-          font-size:14px;
-          line-height:1.45;
-        }}
-        .desc-label {{
-          font-weight:800;
-          margin-bottom:4px;
-        }}
-        .desc-box {{
-          background:rgba(0,0,0,0.16);
-          border-radius:10px;
-          padding:10px;
-        }}
-        @media (max-width:980px) {{
-          .card {{ width:100%; padding:16px; }}
-          .content-row {{ flex-direction:column; }}
-          .icon-col {{ width:100%; flex:unset; text-align:center; margin-bottom:14px; }}
-        }}
-        .card-inner.{card_cls} {{ {card_css_inline} }}
-        .{img_cls} {{ {img_css_inline} }}
-        {card_extra}
-        {img_extra}
-      </style>
-    </head>
-    <body>
-      <div class="outer">
-        <div class="card">
-          <div class="card-inner {card_cls}">
-            <div class="title-bar">&lt;INFORMAÇÕES DO ITEM&gt;</div>
-            <div class="top-icons">
-              <div class="top-icon-box"></div>
-              <div class="top-icon-box"></div>
-              <div class="top-icon-box"></div>
-            </div>
-            <div class="content-row">
-              <div class="icon-col">
-                <div class="icon-wrapper {img_cls}">
-                  {icon_html_inner}
-                </div>
-              </div>
-              <div class="text-col">
-                <div class="item-name">&lt;{_html.escape(title)}&gt;</div>
-                <div class="meta-block">
-                  <div>[RANK: {_html.escape(rank)}]</div>
-                  <div>[CLASSIFICAÇÃO: {_html.escape(classificacao)}]</div>
-                  <div>[TIPO: {_html.escape(tipo)}] [USOS: {_html.escape(usos)}]</div>
-                  <div>[REQUISITOS: {_html.escape(requisitos)}]</div>
-                </div>
-
-                <div class="section">
-                  <div class="section-title">EFEITO PASSIVO:</div>
-                  <div class="section-text">{efeito_esc}</div>
-                </div>
-
-                <div class="section">
-                  <div class="section-title">BONUS DE EQUIPAMENTO:</div>
-                  <div class="section-text">{bonus_esc}</div>
-                </div>
-
-                <div class="desc-block">
-                  <div class="desc-label">DESCRIÇÃO:</div>
-                  <div class="desc-box">{desc_esc}</div>
-                </div>
-              </div>
-            </div>
-          </div>
-        </div>
-      </div>
-    </body>
-    </html>
-    """
-    ).lstrip()
-
-    # Altura dinâmica – base alta para evitar corte + ajuste por linhas
-    num_lines = (
-        (descricao or item_desc or "").count("\n")
-        + efeito_passivo.count("\n")
-        + bonus_equip.count("\n")
-        + 6
-    )
-    approx_height = 720 + num_lines * 18
-    approx_height = max(820, min(approx_height, 1400))
-
-    components.html(html, height=approx_height, scrolling=False)
+# item_popup.py
+"""
+Item Popup feature (modular)
+- Tabela com campos específicos de ITEM + bordas customizáveis
+- Editor em sidebar dentro de expander (admin) com preview (renderizado via components.html)
+- Render via components.html com altura dinâmica (evita corte)
+- Resiliência: erros no editor aparecem no sidebar (traceback) em vez de quebrar app
+"""
+
+import os
+import io
+import re
+import sys
+import sqlite3
+import base64
+import zlib
+from datetime import datetime
+from contextlib import contextmanager
+from functools import lru_cache
+import traceback
+import textwrap
+from string import Template
+
+import streamlit as st
+import streamlit.components.v1 as components
+
+from db import get_conn
+
+
+def _now_iso():
+    return datetime.utcnow().isoformat()
+
+
+SCHEMA_POPUP_BASE = """
+CREATE TABLE IF NOT EXISTS item_popup (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  owner_user_id INTEGER,
+  target_item_id INTEGER,
+  target_user_id INTEGER,
+  title TEXT DEFAULT '',
+  icon_filename TEXT DEFAULT '',
+  icon_blob BLOB,
+  rank TEXT DEFAULT '',
+  classificacao TEXT DEFAULT '',
+  tipo TEXT DEFAULT '',
+  usos TEXT DEFAULT '',
+  requisitos TEXT DEFAULT '',
+  efeito_passivo TEXT DEFAULT '',
+  bonus_equipamento TEXT DEFAULT '',
+  descricao TEXT NOT NULL DEFAULT '',
+  card_border_type TEXT DEFAULT 'none',
+  card_border_color1 TEXT DEFAULT '#ffffff',
+  card_border_color2 TEXT DEFAULT '#000000',
+  card_border_speed REAL DEFAULT 1.0,
+  image_border_type TEXT DEFAULT 'none',
+  image_border_color1 TEXT DEFAULT '#ffffff',
+  image_border_color2 TEXT DEFAULT '#000000',
+  image_border_speed REAL DEFAULT 1.0,
+  created_at TEXT NOT NULL,
+  updated_at TEXT NOT NULL,
+  UNIQUE(target_item_id, target_user_id)
+);
+
+-- ícone fora da linha principal: salvar metadados não reescreve o blob
+CREATE TABLE IF NOT EXISTS item_popup_icon (
+  popup_id INTEGER PRIMARY KEY,
+  blob BLOB NOT NULL,
+  data_uri TEXT DEFAULT ''
+);
+"""
+
+
+DESIRED_COLS = (
+    "icon_filename",
+    "icon_blob",
+    "rank",
+    "classificacao",
+    "tipo",
+    "usos",
+    "requisitos",
+    "efeito_passivo",
+    "bonus_equipamento",
+    "descricao",
+    "card_border_type",
+    "card_border_color1",
+    "card_border_color2",
+    "card_border_speed",
+    "image_border_type",
+    "image_border_color1",
+    "image_border_color2",
+    "image_border_speed",
+    "created_at",
+    "updated_at",
+)
+
+
+def _col_ddl(col):
+    if col in {"icon_blob"}:
+        return f"ALTER TABLE item_popup ADD COLUMN {col} BLOB"
+    if col.endswith("_speed"):
+        return f"ALTER TABLE item_popup ADD COLUMN {col} REAL DEFAULT 1.0"
+    if col in {"created_at", "updated_at"}:
+        return f"ALTER TABLE item_popup ADD COLUMN {col} TEXT NOT NULL DEFAULT ''"
+    return f"ALTER TABLE item_popup ADD COLUMN {col} TEXT DEFAULT ''"
+
+
+def _table_cols(conn, table):
+    return {r["name"] for r in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def bootstrap():
+    """Garante tabela item_popup com todas as colunas necessárias."""
+    _bootstrap_once()
+
+
+@st.cache_resource
+def _bootstrap_once():
+    # cache_resource: uma vez por processo, sem corrida entre as threads das sessões
+    conn = get_conn()
+    # executescript faz COMMIT do que estiver pendente: segura o lock de transação
+    # para não fechar no meio a escrita de outra sessão
+    with conn._tx_lock:
+        _bootstrap_schema(conn)
+    return True
+
+
+def _bootstrap_schema(conn):
+    # sonda antes do DDL: tabela ainda inexistente já nasce completa no CREATE
+    try:
+        existing_cols = _table_cols(conn, "item_popup")
+        icon_cols = _table_cols(conn, "item_popup_icon")
+    except Exception:
+        existing_cols, icon_cols = set(), set()
+    ddl = []
+    if existing_cols:
+        ddl += [_col_ddl(c) for c in DESIRED_COLS if c not in existing_cols]
+    if icon_cols and "data_uri" not in icon_cols:
+        ddl.append("ALTER TABLE item_popup_icon ADD COLUMN data_uri TEXT DEFAULT ''")
+
+    if not existing_cols or not icon_cols or ddl:
+        # CREATEs + ALTERs num único script/transação (um lock, um bump de schema)
+        try:
+            conn.executescript(
+                "BEGIN;\n"
+                + SCHEMA_POPUP_BASE
+                + "".join(f"{stmt};\n" for stmt in ddl)
+                + "COMMIT;"
+            )
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.executescript(SCHEMA_POPUP_BASE)
+            for stmt in ddl:
+                try:
+                    with conn:
+                        conn.execute(stmt)
+                except Exception:
+                    # em migração, erros em ALTER TABLE são ignorados
+                    pass
+
+
+@contextmanager
+def safe_modal(title: str):
+    if hasattr(st, "modal"):
+        with st.modal(title):
+            yield
+    else:
+        st.markdown(f"### {title}")
+        with st.container():
+            yield
+
+
+# SQL fixo em constantes: o cache de statements do sqlite3 reaproveita o plano
+# campos editáveis do popup e seus defaults (mesmos da tabela)
+_POPUP_FIELDS = {
+    "title": "",
+    "icon_filename": "",
+    "rank": "",
+    "classificacao": "",
+    "tipo": "",
+    "usos": "",
+    "requisitos": "",
+    "efeito_passivo": "",
+    "bonus_equipamento": "",
+    "descricao": "",
+    "card_border_type": "none",
+    "card_border_color1": "#ffffff",
+    "card_border_color2": "#000000",
+    "card_border_speed": 1.0,
+    "image_border_type": "none",
+    "image_border_color1": "#ffffff",
+    "image_border_color2": "#000000",
+    "image_border_speed": 1.0,
+}
+
+# UNIQUE(target_item_id, target_user_id) não conflita com NULL ("qualquer item"),
+# então ON CONFLICT não serve: UPDATE ... RETURNING e INSERT só se não havia linha
+_SQL_UPDATE = (
+    "UPDATE item_popup SET owner_user_id=:owner_user_id, "
+    + ", ".join(f"{c}=:{c}" for c in _POPUP_FIELDS)
+    + ", updated_at=:now "
+    "WHERE target_item_id IS :target_item_id AND target_user_id IS :target_user_id "
+    "RETURNING id"
+)
+
+_SQL_INSERT = (
+    "INSERT INTO item_popup(owner_user_id, target_item_id, target_user_id, "
+    + ", ".join(_POPUP_FIELDS)
+    + ", created_at, updated_at) "
+    "VALUES(:owner_user_id, :target_item_id, :target_user_id, "
+    + ", ".join(f":{c}" for c in _POPUP_FIELDS)
+    + ", :now, :now)"
+)
+
+_SQL_DELETE = "DELETE FROM item_popup WHERE id=?"
+_SQL_DELETE_ICON = "DELETE FROM item_popup_icon WHERE popup_id=?"
+
+_SQL_ICON_RESERVE = (
+    "INSERT OR REPLACE INTO item_popup_icon(popup_id, blob, data_uri) "
+    "VALUES(?, zeroblob(?), ?)"
+)
+_SQL_ICON_CLEAR_LEGACY = (
+    "UPDATE item_popup SET icon_blob=NULL WHERE id=? AND icon_blob IS NOT NULL"
+)
+_SQL_GET_DATA_URI = "SELECT data_uri FROM item_popup_icon WHERE popup_id=?"
+_SQL_GET_ICON = """
+SELECT COALESCE(
+    (SELECT blob FROM item_popup_icon WHERE popup_id = :id),
+    (SELECT icon_blob FROM item_popup WHERE id = :id)
+)
+"""
+
+# uma única busca: a linha mais específica vence (item+user > item > user > global)
+_SQL_GET_BEST = """
+SELECT * FROM item_popup
+WHERE (target_item_id = :item OR target_item_id IS NULL)
+  AND (target_user_id = :user OR target_user_id IS NULL)
+ORDER BY CASE
+    WHEN target_item_id = :item AND target_user_id = :user THEN 4
+    WHEN target_item_id = :item THEN 3
+    WHEN target_user_id = :user THEN 2
+    ELSE 1
+END DESC
+LIMIT 1
+"""
+
+
+# textos longos vão comprimidos (zlib) na própria coluna, com prefixo mágico
+_Z_FIELDS = ("descricao", "efeito_passivo", "bonus_equipamento")
+_Z_MIN = 512
+_Z_MAGIC = b"ZL1:"
+
+
+def _pack_text(text):
+    raw = text.encode("utf-8")
+    if len(raw) <= _Z_MIN:
+        return text
+    return _Z_MAGIC + zlib.compress(raw, 6)
+
+
+def _unpack_text(value):
+    if isinstance(value, bytes) and value.startswith(_Z_MAGIC):
+        return zlib.decompress(value[len(_Z_MAGIC) :]).decode("utf-8")
+    return value
+
+
+def _row_dict(row):
+    """sqlite3.Row -> dict, sem as colunas NULL (o .get cai no default)."""
+    if row is None:
+        return {}
+    d = {k: row[k] for k in row.keys() if row[k] is not None}
+    for k in _Z_FIELDS:
+        if k in d:
+            d[k] = _unpack_text(d[k])
+    return d
+
+
+def upsert_popup(
+    owner_user_id, target_item_id, target_user_id, icon_blob=None, **fields
+):
+    """
+    Cria/atualiza o popup do alvo (item, ficha). Campos em **fields
+    (ver _POPUP_FIELDS); os omitidos ficam com o default.
+    icon_blob=None mantém o ícone atual.
+    """
+    unknown = set(fields) - set(_POPUP_FIELDS)
+    if unknown:
+        raise TypeError(f"campos desconhecidos: {sorted(unknown)}")
+    params = {**_POPUP_FIELDS, **fields}
+    params["card_border_speed"] = float(params["card_border_speed"])
+    params["image_border_speed"] = float(params["image_border_speed"])
+    for k in _Z_FIELDS:
+        params[k] = _pack_text(params[k] or "")
+    params.update(
+        owner_user_id=owner_user_id,
+        target_item_id=target_item_id,
+        target_user_id=target_user_id,
+        now=_now_iso(),
+    )
+    if icon_blob is not None:
+        icon_blob, params["icon_filename"] = _shrink_icon(
+            icon_blob, params["icon_filename"]
+        )
+    conn = get_conn()
+    with conn:
+        row = conn.execute(_SQL_UPDATE, params).fetchone()
+        if row:
+            popup_id = row["id"]
+        else:
+            popup_id = conn.execute(_SQL_INSERT, params).lastrowid
+        if icon_blob is not None:
+            _write_icon(conn, popup_id, icon_blob, params["icon_filename"])
+        return popup_id
+
+
+_ICON_CHUNK = 64 * 1024
+ICON_PX = 160  # tamanho fixo do ícone no card
+
+
+def _shrink_icon(icon_blob, icon_filename):
+    """
+    Reduz o ícone para ICON_PX e regrava em WebP. Animados (GIF/WebP) e
+    qualquer falha do Pillow mantêm o arquivo original.
+    """
+    try:
+        from PIL import Image  # lazy: só quem salva ícone paga o import
+
+        im = Image.open(io.BytesIO(icon_blob))
+        if getattr(im, "is_animated", False):
+            return icon_blob, icon_filename
+        im.thumbnail((ICON_PX, ICON_PX))
+        if im.mode not in ("RGB", "RGBA"):
+            im = im.convert("RGBA")
+        buf = io.BytesIO()
+        im.save(buf, format="WEBP", quality=82)
+        out = buf.getvalue()
+    except Exception:
+        return icon_blob, icon_filename
+    if len(out) >= len(icon_blob):
+        return icon_blob, icon_filename
+    stem = os.path.splitext(icon_filename or "icon")[0]
+    return out, stem + ".webp"
+
+
+def _write_icon(conn, popup_id, icon_blob, icon_filename=""):
+    """
+    Grava o ícone na tabela lateral via I/O incremental de BLOB, junto com
+    o data URI já codificado (a renderização só lê o texto pronto).
+    """
+    data = memoryview(bytes(icon_blob))
+    data_uri = _data_uri(data, icon_filename)
+    if not hasattr(conn, "blobopen"):
+        # Python < 3.11: sem blobopen, grava com bind direto
+        conn.execute(
+            "INSERT OR REPLACE INTO item_popup_icon(popup_id, blob, data_uri) "
+            "VALUES(?, ?, ?)",
+            (popup_id, sqlite3.Binary(data), data_uri),
+        )
+    else:
+        conn.execute(_SQL_ICON_RESERVE, (popup_id, len(data), data_uri))
+        with conn.blobopen("item_popup_icon", "blob", popup_id) as blob:
+            for i in range(0, len(data), _ICON_CHUNK):
+                blob.write(data[i : i + _ICON_CHUNK])
+    conn.execute(_SQL_ICON_CLEAR_LEGACY, (popup_id,))
+
+
+def get_icon_blob(popup_id):
+    """Ícone do popup (tabela lateral, com fallback para a coluna antiga)."""
+    if popup_id is None:
+        return None
+    with get_conn() as conn:
+        r = conn.execute(_SQL_GET_ICON, {"id": popup_id}).fetchone()
+    return r[0] if r else None
+
+
+_MIME_BY_EXT = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".gif": "image/gif",
+    ".webp": "image/webp",
+}
+
+
+def _data_uri(icon_blob, icon_filename):
+    b64 = base64.b64encode(icon_blob).decode()
+    mime = _MIME_BY_EXT.get(os.path.splitext(icon_filename)[1].lower(), "image/png")
+    return f"data:{mime};base64,{b64}"
+
+
+@lru_cache(maxsize=128)
+def _icon_data_uri(popup_id, updated_at, icon_filename):
+    """
+    data URI do ícone; (id, updated_at) muda a cada salvamento do popup.
+    lru_cache devolve sempre o mesmo objeto: sem pickle a cada rerun e o hash da
+    string (chave do cache do HTML) é calculado uma vez só.
+    """
+    if popup_id is None:
+        return ""
+    with get_conn() as conn:
+        r = conn.execute(_SQL_GET_DATA_URI, (popup_id,)).fetchone()
+    if r and r["data_uri"]:
+        return r["data_uri"]
+    # linhas antigas: ícone ainda sem data URI gravado
+    icon_blob = get_icon_blob(popup_id)
+    if not icon_blob:
+        return ""
+    return _data_uri(icon_blob, icon_filename)
+
+
+def delete_popup(popup_id):
+    conn = get_conn()
+    with conn:
+        conn.execute(_SQL_DELETE_ICON, (popup_id,))
+        conn.execute(_SQL_DELETE, (popup_id,))
+
+
+def get_popup_for(item_id=None, user_id=None):
+    """Busca popup com prioridade: (item+user) > (item global) > (user global) > global."""
+    with get_conn() as conn:
+        return conn.execute(
+            _SQL_GET_BEST, {"item": item_id, "user": user_id}
+        ).fetchone()
+
+
+# Um renderer por tipo de borda: (c1, c2, speed, uid, cls) -> (inline, extra)
+# c1/c2 já chegam com aspas duplas trocadas por simples.
+def _border_none(c1, c2, speed, uid, cls):
+    return "border: none; border-radius:12px;", ""
+
+
+def _border_solid(c1, c2, speed, uid, cls):
+    return f"border: 4px solid {c1}; border-radius:12px;", ""
+
+
+def _border_gradient(c1, c2, speed, uid, cls):
+    inline = (
+        "border: 6px solid transparent; border-radius:14px;"
+        f"-webkit-border-image: linear-gradient(90deg,{c1},{c2}) 1;"
+        f"border-image: linear-gradient(90deg,{c1},{c2}) 1;"
+    )
+    return inline, ""
+
+
+def _border_flow(c1, c2, speed, uid, cls):
+    # anima apenas o ÂNGULO do gradiente, não o card
+    dur = max(0.6, 4.0 / float(max(0.1, speed)))
+    extra = f"""
+        @keyframes flow_{uid} {{
+           0%   {{ --pos: 0deg;   }}
+           100% {{ --pos: 360deg; }}
+        }}
+        .{cls} {{
+           border: 6px solid transparent;
+           border-radius:14px;
+           --pos: 0deg;
+           -webkit-border-image: conic-gradient(from var(--pos), {c1}, {c2}, {c1}) 1;
+           border-image: conic-gradient(from var(--pos), {c1}, {c2}, {c1}) 1;
+           animation: flow_{uid} {dur}s linear infinite;
+        }}
+        """
+    return "", extra
+
+
+def _border_pulse(c1, c2, speed, uid, cls):
+    dur = max(0.6, 2.0 / float(max(0.1, speed)))
+    inline = f"border: 4px solid {c1}; border-radius:14px;"
+    extra = f"""
+        @keyframes pulse_border_{uid} {{
+           0%   {{ box-shadow: 0 0 0 0 rgba(0,0,0,0); }}
+           50%  {{ box-shadow: 0 0 24px 8px {c1}66; }}
+           100% {{ box-shadow: 0 0 0 0 rgba(0,0,0,0); }}
+        }}
+        .{cls} {{
+           animation: pulse_border_{uid} {dur}s ease-in-out infinite;
+        }}
+        """
+    return inline, extra
+
+
+def _border_changing(c1, c2, speed, uid, cls):
+    dur = max(0.6, 3.0 / float(max(0.1, speed)))
+    inline = f"border: 6px solid {c1}; border-radius:14px;"
+    extra = f"""
+        @keyframes changing_border_{uid} {{
+           0%   {{ border-color: {c1}; }}
+           50%  {{ border-color: {c2}; }}
+           100% {{ border-color: {c1}; }}
+        }}
+        .{cls} {{
+           animation: changing_border_{uid} {dur}s linear infinite;
+        }}
+        """
+    return inline, extra
+
+
+def _border_default(c1, c2, speed, uid, cls):
+    return f"border: 3px solid {c1}; border-radius:12px;", ""
+
+
+_BORDER_RENDERERS = {
+    "": _border_none,
+    "none": _border_none,
+    "solid": _border_solid,
+    "gradient": _border_gradient,
+    "flow": _border_flow,
+    "pulse": _border_pulse,
+    "changing": _border_changing,
+}
+
+
+_UID = "\x00uid\x00"  # marcador trocado pelo uid real fora do cache
+
+
+@lru_cache(maxsize=512)
+def _border_css_body(prefix, btype, c1, c2, speed):
+    """CSS da borda com _UID no lugar do uid (cacheável entre cards)."""
+    cls = f"{prefix}_border_{_UID}"
+    render = _BORDER_RENDERERS.get(btype or "", _border_default)
+    inline, extra = render(
+        c1.replace('"', "'"), c2.replace('"', "'"), speed, _UID, cls
+    )
+    inline = "position:relative; box-sizing:border-box; " + inline
+    return inline, extra, cls
+
+
+def _css_for_border(prefix, btype, c1, c2, speed, uid):
+    """
+    Produz CSS para borda que *não* cobre o interior (usa border/border-image).
+    Retorna (inline_css, extra_css, class_name)
+
+    Implementação idêntica à versão estável do skill_popup,
+    com animação FLOW usando conic-gradient + variável CSS,
+    para que APENAS as cores "girem" e não o card inteiro.
+    """
+    inline, extra, cls = _border_css_body(prefix, btype, c1, c2, speed)
+    uid = str(uid)
+    return (
+        inline.replace(_UID, uid),
+        extra.replace(_UID, uid),
+        # nome de classe se repete no template e entre reruns
+        sys.intern(cls.replace(_UID, uid)),
+    )
+
+
+# preview do editor (card + ícone num único iframe), compilado uma vez
+_PREVIEW_TMPL = Template("""\
+<html><head><meta charset="utf-8"><style>
+  .preview_card_box {
+     width: 360px; height: 160px;
+     border-radius:16px;
+     background: linear-gradient(180deg,#2ca0ff,#005bd1);
+     position:relative; color:#eaf6ff;
+     padding:10px; box-shadow:0 10px 24px rgba(0,0,0,0.35);
+     box-sizing:border-box;
+  }
+  .preview_card_box .inner { padding:6px; }
+  .${card_cls} { ${card_css} }
+  ${card_extra}
+  .preview_img_box {
+    width: 96px; height:96px;
+    border-radius:8px; background:#1b6de0;
+    display:inline-block; vertical-align:middle;
+    box-sizing:border-box;
+  }
+  .${img_cls} { ${img_css} }
+  ${img_extra}
+</style></head>
+<body>
+  <div class="preview_card_box ${card_cls}">
+    <div class="inner">Preview Card</div>
+  </div>
+  <div style="height:30px"></div>
+  <div class="${img_cls}" style="display:inline-block;padding:6px;border-radius:10px;">
+    <div class="preview_img_box"></div>
+  </div>
+</body></html>
+""")
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _inventory_items(cid):
+    """(id, name) dos itens da ficha. A PK de inventory já cobre o JOIN."""
+    with get_conn() as conn:
+        rows = conn.execute(
+            """
+            SELECT i.id, i.name
+            FROM inventory inv
+            JOIN items i ON i.id = inv.item_id
+            WHERE inv.character_id = ?
+            ORDER BY i.name
+            """,
+            (cid,),
+        ).fetchall()
+    return [(r["id"], r["name"]) for r in rows]
+
+
+def clear_inventory_cache():
+    """Chamado por quem altera o inventário (main.set_inv_qty)."""
+    _inventory_items.clear()
+
+
+def sidebar_item_popup_editor(current_user):
+    """
+    Editor de item popups (apenas admin). Só mostra itens da ficha selecionada.
+    Chamar dentro de `with st.sidebar:`.
+    """
+    try:
+        if not current_user or not current_user.get("is_admin"):
+            return
+
+        # fechado (caso comum) não consulta o banco nem monta previews
+        if not st.toggle(
+            "📦 Editor de Item Popups (Admin)", key="_item_popup_open"
+        ):
+            return
+
+        cid = st.session_state.get("cid")
+        if not cid:
+            st.info(
+                "Selecione uma ficha antes de editar popups de item "
+                "(use o seletor à esquerda)."
+            )
+            return
+
+        with st.container(border=True):
+            st.markdown(f"**Editando popups de ITEM para a ficha #{cid}**")
+
+            # Lista apenas itens da ficha atual (inventory + items)
+            try:
+                rows = _inventory_items(cid)
+            except Exception:
+                rows = []
+
+            if not rows:
+                st.info("Esta ficha não possui itens no inventário.")
+                return
+
+            options = [("— QUALQUER ITEM —", None)] + [
+                (name, item_id) for item_id, name in rows
+            ]
+            labels = [o[0] for o in options]
+
+            sel_label = st.selectbox(
+                "Escolha o item (alvo do popup)",
+                labels,
+                index=0,
+                key=f"item_popup_select_item_{cid}",
+            )
+            sel_item_id = next(
+                (o[1] for o in options if o[0] == sel_label), None
+            )
+            # sufixo comum das keys dos widgets deste (ficha, item)
+            sfx = f"{cid}_{sel_item_id}"
+
+            with get_conn() as conn:
+                existing = _row_dict(
+                    conn.execute(
+                        "SELECT * FROM item_popup "
+                        "WHERE target_item_id IS ? AND target_user_id IS ?",
+                        (sel_item_id, cid),
+                    ).fetchone()
+                )
+
+            # -------- CAMPOS DO POPUP --------
+            title = st.text_input(
+                "Título (ex: <TESOURO DE [?]>)",
+                value=existing.get("title", ""),
+                key="item_popup_title_" + sfx,
+            )
+
+            st.caption("Ícone (opcional)")
+            upload_key = "item_popup_icon_upload_" + sfx
+            uploaded = st.file_uploader(
+                "Upload do ícone",
+                type=["png", "jpg", "jpeg", "webp", "gif"],
+                key=upload_key,
+            )
+            icon_blob = None  # None mantém o ícone já salvo
+            icon_filename = existing.get("icon_filename", "")
+            if uploaded:
+                try:
+                    icon_blob = uploaded.getvalue()
+                    icon_filename = (
+                        getattr(uploaded, "name", None)
+                        or icon_filename
+                        or "icon.png"
+                    )
+                    st.success("Ícone carregado (salvar para persistir).")
+                except Exception as e:
+                    st.error(f"Erro ao ler ícone: {e}")
+
+            st.markdown("**Metadados (lado direito)**")
+            cA, cB = st.columns(2)
+            with cA:
+                rank = st.text_input(
+                    "Rank",
+                    value=existing.get("rank", "A"),
+                    key="item_popup_rank_" + sfx,
+                )
+                classificacao = st.text_input(
+                    "Classificação",
+                    value=existing.get("classificacao", "EQUIPAMENTO"),
+                    key="item_popup_class_" + sfx,
+                )
+                tipo = st.text_input(
+                    "Tipo",
+                    value=existing.get("tipo", "COLAR"),
+                    key="item_popup_tipo_" + sfx,
+                )
+            with cB:
+                usos = st.text_input(
+                    "Usos",
+                    value=existing.get("usos", "1/1"),
+                    key="item_popup_usos_" + sfx,
+                )
+                requisitos = st.text_input(
+                    "Requisitos",
+                    value=existing.get("requisitos", "N/A"),
+                    key="item_popup_req_" + sfx,
+                )
+
+            st.markdown("**EFEITO PASSIVO**")
+            efeito_passivo = st.text_area(
+                "Efeito passivo (uma linha por efeito)",
+                value=existing.get("efeito_passivo", ""),
+                height=80,
+                key="item_popup_eff_" + sfx,
+            )
+
+            st.markdown("**BÔNUS DE EQUIPAMENTO**")
+            bonus_equip = st.text_area(
+                "Bônus de equipamento (uma linha por bônus)",
+                value=existing.get("bonus_equipamento", ""),
+                height=80,
+                key="item_popup_bonus_" + sfx,
+            )
+
+            st.markdown("**DESCRIÇÃO**")
+            descricao = st.text_area(
+                "Descrição",
+                value=existing.get("descricao", ""),
+                height=180,
+                key="item_popup_desc_" + sfx,
+            )
+
+            st.markdown("---")
+            st.markdown("### Bordas / Aparência")
+
+            CARD_TYPES = ["none", "solid", "gradient", "flow", "pulse", "changing"]
+            cur_card_type = existing.get("card_border_type", "none")
+            card_border_type = st.selectbox(
+                "Tipo (card)",
+                CARD_TYPES,
+                index=(
+                    CARD_TYPES.index(cur_card_type)
+                    if cur_card_type in CARD_TYPES
+                    else 0
+                ),
+                key="item_popup_card_type_" + sfx,
+            )
+            card_color1 = st.color_picker(
+                "Cor primária (card)",
+                value=existing.get("card_border_color1", "#ffffff"),
+                key="item_popup_card_color1_" + sfx,
+            )
+            card_color2 = st.color_picker(
+                "Cor secundária (card)",
+                value=existing.get("card_border_color2", "#000000"),
+                key="item_popup_card_color2_" + sfx,
+            )
+            card_speed = st.slider(
+                "Velocidade / intensidade (card)",
+                0.2,
+                5.0,
+                float(existing.get("card_border_speed", 1.0)),
+                0.1,
+                key="item_popup_card_speed_" + sfx,
+            )
+
+            IMG_TYPES = ["none", "solid", "gradient", "flow", "pulse", "changing"]
+            cur_img_type = existing.get("image_border_type", "none")
+            image_border_type = st.selectbox(
+                "Tipo (imagem)",
+                IMG_TYPES,
+                index=(
+                    IMG_TYPES.index(cur_img_type)
+                    if cur_img_type in IMG_TYPES
+                    else 0
+                ),
+                key="item_popup_img_type_" + sfx,
+            )
+            image_color1 = st.color_picker(
+                "Cor primária (imagem)",
+                value=existing.get("image_border_color1", "#ffffff"),
+                key="item_popup_img_color1_" + sfx,
+            )
+            image_color2 = st.color_picker(
+                "Cor secundária (imagem)",
+                value=existing.get("image_border_color2", "#000000"),
+                key="item_popup_img_color2_" + sfx,
+            )
+            image_speed = st.slider(
+                "Velocidade / intensidade (imagem)",
+                0.2,
+                5.0,
+                float(existing.get("image_border_speed", 1.0)),
+                0.1,
+                key="item_popup_img_speed_" + sfx,
+            )
+
+            # -------- PREVIEWS --------
+            preview_card_css, preview_card_extra, preview_card_cls = _css_for_border(
+                "preview_card",
+                card_border_type,
+                card_color1,
+                card_color2,
+                card_speed,
+                f"item_cv{cid}",
+            )
+            preview_img_css, preview_img_extra, preview_img_cls = _css_for_border(
+                "preview_img",
+                image_border_type,
+                image_color1,
+                image_color2,
+                image_speed,
+                f"item_iv{cid}",
+            )
+            preview_html = _PREVIEW_TMPL.substitute(
+                card_cls=preview_card_cls,
+                card_css=preview_card_css,
+                card_extra=preview_card_extra,
+                img_cls=preview_img_cls,
+                img_css=preview_img_css,
+                img_extra=preview_img_extra,
+            )
+            components.html(preview_html, height=340, scrolling=False)
+
+            # -------- AÇÕES --------
+            st.markdown("---")
+            c1, c2 = st.columns(2)
+            if c1.button(
+                "Salvar Popup",
+                key="item_popup_save_" + sfx,
+            ):
+                try:
+                    upsert_popup(
+                        current_user["id"],
+                        sel_item_id,
+                        cid,
+                        icon_blob=icon_blob,
+                        title=title,
+                        icon_filename=icon_filename,
+                        rank=rank or "",
+                        classificacao=classificacao or "",
+                        tipo=tipo or "",
+                        usos=usos or "",
+                        requisitos=requisitos or "",
+                        efeito_passivo=efeito_passivo or "",
+                        bonus_equipamento=bonus_equip or "",
+                        descricao=descricao or "",
+                        card_border_type=card_border_type,
+                        card_border_color1=card_color1,
+                        card_border_color2=card_color2,
+                        card_border_speed=float(card_speed),
+                        image_border_type=image_border_type,
+                        image_border_color1=image_color1,
+                        image_border_color2=image_color2,
+                        image_border_speed=float(image_speed),
+                    )
+                    st.success("Popup de item salvo para esta ficha.")
+                except Exception:
+                    st.error("Erro ao salvar popup (veja traceback abaixo).")
+                    st.code(traceback.format_exc())
+
+            if c2.button(
+                "Excluir Popup",
+                key="item_popup_del_" + sfx,
+            ):
+                if "id" in existing:
+                    try:
+                        delete_popup(existing["id"])
+                        st.success("Popup de item excluído.")
+                    except Exception:
+                        st.error("Erro ao excluir popup (veja traceback abaixo).")
+                        st.code(traceback.format_exc())
+                else:
+                    st.warning(
+                        "Nenhum popup existente para excluir "
+                        "nesta combinação ficha/item."
+                    )
+    except Exception:
+        tb = traceback.format_exc()
+        try:
+            st.error(
+                "Erro ao inicializar/mostrar editor de popups de item (veja traceback)."
+            )
+            st.code(tb)
+        except Exception:
+            print("item_popup sidebar error:\n", tb)
+
+
+def render_item_button(item_row, character_id, current_user):
+    """
+    Botão 🔍 para cada item do inventário.
+    Usa a tabela item_popup para renderizar card customizado.
+    """
+    def _get(r, k, default=""):
+        try:
+            return r[k] if k in r.keys() else default
+        except Exception:
+            try:
+                return r.get(k, default)
+            except Exception:
+                return default
+
+    item_id = _get(item_row, "item_id", _get(item_row, "id", None))
+    item_name = _get(item_row, "name", "Item")
+    item_desc = _get(item_row, "description", "")
+
+    btn_key = f"item_popup_btn_{item_id}_{character_id}"
+    open_key = f"item_popup_open_{item_id}_{character_id}"
+    if open_key not in st.session_state:
+        st.session_state[open_key] = False
+
+    if st.button(f"🔍 {item_name}", key=btn_key):
+        st.session_state[open_key] = not st.session_state[open_key]
+
+    if st.session_state.get(open_key):
+        popup = get_popup_for(item_id=item_id, user_id=character_id)
+        if popup:
+            _render_item_template_popup(
+                popup, item_name, item_desc, character_id, current_user
+            )
+        else:
+            with safe_modal(item_name):
+                st.markdown("**Descrição do catálogo:**")
+                st.write(item_desc or "_(sem descrição)_")
+
+
+# Template do popup, montado uma vez no import. O começo (doctype + CSS fixo,
+# minificado) é texto puro, sem format; só o resto recebe os campos.
+_ITEM_POPUP_CSS = textwrap.dedent(
+    """\
+        :root {
+          --bg1: #2ea8ff;
+          --bg2: #0056d3;
+          --headline: #ffffff;
+          --body-text: #e4f4ff;
+          font-family: "Segoe UI", Roboto, Arial, sans-serif;
+        }
+        body {
+          margin:0;
+          background: transparent;
+          -webkit-font-smoothing:antialiased;
+        }
+        .outer {
+          width:100%;
+          display:flex;
+          justify-content:center;
+          padding:8px 14px;
+          box-sizing:border-box;
+        }
+        .card {
+          width:960px;
+          border-radius:20px;
+          padding:20px;
+          color:var(--body-text);
+          position:relative;
+          overflow:visible;
+          box-sizing:border-box;
+        }
+        .card-inner {
+          background: linear-gradient(180deg, var(--bg1) 0%, var(--bg2) 100%);
+          border-radius:16px;
+          padding:18px 26px 24px;
+          box-sizing:border-box;
+        }
+        .title-bar {
+          text-align:center;
+          font-size:24px;
+          font-weight:800;
+          letter-spacing:1px;
+          color:var(--headline);
+          text-shadow:0 0 8px rgba(0,0,0,0.65);
+          margin-bottom:12px;
+        }
+        .top-icons {
+          position:absolute;
+          right:32px; top:22px;
+          display:flex;
+          gap:4px;
+        }
+        .top-icon-box {
+          width:18px; height:18px;
+          border-radius:3px;
+          border:1px solid rgba(255,255,255,0.75);
+          background:rgba(0,0,0,0.12);
+        }
+        .content-row {
+          display:flex;
+          gap:22px;
+          align-items:flex-start;
+        }
+        .icon-col {
+          width:210px;
+          flex:0 0 210px;
+          text-align:center;
+          position:relative;
+        }
+        .icon-wrapper {
+          display:inline-block;
+          padding:8px;
+          border-radius:14px;
+          box-sizing:border-box;
+        }
+        .text-col {
+          flex:1;
+          min-width:0;
+          position:relative;
+          color:var(--body-text);
+        }
+        .item-name {
+          font-size:22px;
+          font-weight:800;
+          color:#ffffff;
+          margin-bottom:4px;
+          text-shadow:0 0 8px rgba(0,0,0,0.6);
+        }
+        .meta-block {
+          font-size:14px;
+          margin-bottom:10px;
+          line-height:1.4;
+        }
+        .meta-block div {
+          margin-bottom:2px;
+        }
+        .section-title {
+          font-size:16px;
+          font-weight:800;
+          color:#ffffff;
+          margin-top:10px;
+          margin-bottom:4px;
+        }
+        .section-text {
+          font-size:14px;
+          line-height:1.4;
+        }
+        .desc-block {
+          margin-top:12px;
+          font-size:14px;
+          line-height:1.45;
+        }
+        .desc-label {
+          font-weight:800;
+          margin-bottom:4px;
+        }
+        .desc-box {
+          background:rgba(0,0,0,0.16);
+          border-radius:10px;
+          padding:10px;
+        }
+        @media (max-width:980px) {
+          .card { width:100%; padding:16px; }
+          .content-row { flex-direction:column; }
+          .icon-col { width:100%; flex:unset; text-align:center; margin-bottom:14px; }
+        }
+"""
+)
+
+
+def _minify_css(css):
+    """Remove comentários e espaços supérfluos (roda só no import)."""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", css)
+    # só o espaço DEPOIS de ":" sai; antes dele pode ser seletor (".a :hover")
+    return re.sub(r":\s+", ":", css).strip()
+
+
+_ITEM_POPUP_PRELUDE = (
+    "<!doctype html>\n"
+    "<html>\n"
+    "<head>\n"
+    '  <meta charset="utf-8">\n'
+    '  <meta name="viewport" content="width=device-width,initial-scale=1">\n'
+    "  <style>\n" + _minify_css(_ITEM_POPUP_CSS) + "\n"
+)
+
+
+@lru_cache(maxsize=256)
+def _style_tail(
+    card_cls, card_css_inline, img_cls, img_css_inline, card_extra, img_extra
+):
+    """Fim do <style>: CSS das bordas (repete muito entre popups)."""
+    return (
+        f"    .card-inner.{card_cls} {{ {card_css_inline} }}\n"
+        f"    .{img_cls} {{ {img_css_inline} }}\n"
+        f"    {card_extra}\n"
+        f"    {img_extra}\n"
+    )
+
+
+# corpo do card (depois do CSS)
+_ITEM_POPUP_BODY = textwrap.dedent(
+    """\
+      </style>
+    </head>
+    <body>
+      <div class="outer">
+        <div class="card">
+          <div class="card-inner {card_cls}">
+            <div class="title-bar">&lt;INFORMAÇÕES DO ITEM&gt;</div>
+            <div class="top-icons">
+              <div class="top-icon-box"></div>
+              <div class="top-icon-box"></div>
+              <div class="top-icon-box"></div>
+            </div>
+            <div class="content-row">
+              <div class="icon-col">
+                <div class="icon-wrapper {img_cls}">
+                  {icon_html_inner}
+                </div>
+              </div>
+              <div class="text-col">
+                <div class="item-name">&lt;{title}&gt;</div>
+                <div class="meta-block">
+                  <div>[RANK: {rank}]</div>
+                  <div>[CLASSIFICAÇÃO: {classificacao}]</div>
+                  <div>[TIPO: {tipo}] [USOS: {usos}]</div>
+                  <div>[REQUISITOS: {requisitos}]</div>
+                </div>
+"""
+)
+
+# blocos opcionais: só entram no HTML quando o campo tem texto
+_ITEM_POPUP_SECTION = (
+    "\n"
+    '            <div class="section">\n'
+    '              <div class="section-title">{label}</div>\n'
+    '              <div class="section-text">{text}</div>\n'
+    "            </div>\n"
+)
+_ITEM_POPUP_DESC = (
+    "\n"
+    '            <div class="desc-block">\n'
+    '              <div class="desc-label">DESCRIÇÃO:</div>\n'
+    '              <div class="desc-box">{text}</div>\n'
+    "            </div>\n"
+)
+_ITEM_POPUP_END = textwrap.dedent(
+    """\
+              </div>
+            </div>
+          </div>
+        </div>
+      </div>
+    </body>
+    </html>
+"""
+)
+_SECTION_PX = 40  # altura aproximada de cada bloco opcional
+
+
+# texto sem &<>"' (o caso comum) volta como está, sem passar pelo escape
+_NEEDS_ESCAPE = re.compile(r"[&<>\"']").search
+
+
+# mesmo resultado de html.escape, mas numa única passada em C
+_ESC_TABLE = str.maketrans(
+    {"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#x27;"}
+)
+
+
+# escape + quebra de linha -> <br> (\r some) numa única passada
+_ESC_LINES_TABLE = {**_ESC_TABLE, ord("\n"): "<br>", ord("\r"): None}
+
+
+def _fast_escape(text):
+    return text if _NEEDS_ESCAPE(text) is None else text.translate(_ESC_TABLE)
+
+
+_ICON_PLACEHOLDER_HTML = (
+    '<div style="width:160px;height:160px;border-radius:6px;'
+    'background:rgba(0,0,0,0.25);display:flex;align-items:center;'
+    'justify-content:center;color:#dff4ff;">ICON</div>'
+)
+
+
+# maxsize baixo: a chave inclui icon_html_inner, que carrega o data URI do ícone
+@lru_cache(maxsize=64)
+def _build_item_popup_html(
+    title,
+    rank,
+    classificacao,
+    tipo,
+    usos,
+    requisitos,
+    efeito_passivo,
+    bonus_equip,
+    descricao,
+    card_border_type,
+    card_border_color1,
+    card_border_color2,
+    card_border_speed,
+    image_border_type,
+    image_border_color1,
+    image_border_color2,
+    image_border_speed,
+    uid,
+    icon_html_inner,
+):
+    """Monta (html, altura) do popup; função pura de argumentos hasheáveis."""
+    # Bordas
+    card_css_inline, card_extra, card_cls = _css_for_border(
+        "card", card_border_type, card_border_color1, card_border_color2,
+        card_border_speed, uid
+    )
+    img_css_inline, img_extra, img_cls = _css_for_border(
+        "img", image_border_type, image_border_color1, image_border_color2,
+        image_border_speed, uid
+    )
+
+    def esc_lines(text):
+        """(html com <br>, nº de quebras de linha) numa passada só."""
+        if not text:
+            return "", 0
+        text = str(text)
+        return text.translate(_ESC_LINES_TABLE), text.count("\n")
+
+    desc_esc, desc_lines = esc_lines(descricao)
+    efeito_esc, efeito_lines = esc_lines(efeito_passivo)
+    bonus_esc, bonus_lines = esc_lines(bonus_equip)
+
+    raw = {
+        "title": title,
+        "rank": rank,
+        "classificacao": classificacao,
+        "tipo": tipo,
+        "usos": usos,
+        "requisitos": requisitos,
+    }
+    ctx = {k: _fast_escape(v) for k, v in raw.items()}
+    ctx["card_cls"] = card_cls
+    ctx["img_cls"] = img_cls
+    ctx["icon_html_inner"] = icon_html_inner
+    parts = [
+        _ITEM_POPUP_PRELUDE,
+        _style_tail(
+            card_cls, card_css_inline, img_cls, img_css_inline, card_extra, img_extra
+        ),
+        _ITEM_POPUP_BODY.format_map(ctx),
+    ]
+    skipped = 0
+    for label, text in (
+        ("EFEITO PASSIVO:", efeito_esc),
+        ("BONUS DE EQUIPAMENTO:", bonus_esc),
+    ):
+        if text:
+            parts.append(_ITEM_POPUP_SECTION.format(label=label, text=text))
+        else:
+            skipped += 1
+    if desc_esc:
+        parts.append(_ITEM_POPUP_DESC.format(text=desc_esc))
+    else:
+        skipped += 1
+    parts.append(_ITEM_POPUP_END)
+    html = "".join(parts)
+
+    # Altura dinâmica – base alta para evitar corte + ajuste por linhas
+    num_lines = desc_lines + efeito_lines + bonus_lines + 6
+    approx_height = 720 + num_lines * 18 - skipped * _SECTION_PX
+    approx_height = max(820 - skipped * _SECTION_PX, min(approx_height, 1400))
+    return html, approx_height
+
+
+def _render_item_template_popup(
+    popup_row, item_name, item_desc, character_id, current_user
+):
+    popup_row = _row_dict(popup_row)
+
+    def _g(k):
+        return popup_row.get(k, "")
+
+    title = _g("title") or item_name
+    icon_filename = (_g("icon_filename") or "").strip()
+    rank = _g("rank") or ""
+    classificacao = _g("classificacao") or ""
+    tipo = _g("tipo") or ""
+    usos = _g("usos") or ""
+    requisitos = _g("requisitos") or ""
+    efeito_passivo = _g("efeito_passivo") or ""
+    bonus_equip = _g("bonus_equipamento") or ""
+    descricao = _g("descricao") or ""
+
+    card_border_type = _g("card_border_type") or "none"
+    card_border_color1 = _g("card_border_color1") or "#ffffff"
+    card_border_color2 = _g("card_border_color2") or "#000000"
+    try:
+        card_border_speed = float(_g("card_border_speed") or 1.0)
+    except Exception:
+        card_border_speed = 1.0
+
+    image_border_type = _g("image_border_type") or "none"
+    image_border_color1 = _g("image_border_color1") or "#ffffff"
+    image_border_color2 = _g("image_border_color2") or "#000000"
+    try:
+        image_border_speed = float(_g("image_border_speed") or 1.0)
+    except Exception:
+        image_border_speed = 1.0
+
+    uid = f"{popup_row.get('id', 'x')}_{character_id}"
+
+    # Ícone
+    try:
+        data_uri = _icon_data_uri(
+            popup_row.get("id"), _g("updated_at"), icon_filename
+        )
+    except Exception:
+        data_uri = ""
+    if data_uri:
+        icon_html_inner = (
+            f'<img src="{data_uri}" '
+            'style="width:160px;height:160px;object-fit:cover;'
+            'border-radius:6px;display:block" />'
+        )
+    else:
+        icon_html_inner = _ICON_PLACEHOLDER_HTML
+
+    html, approx_height = _build_item_popup_html(
+        title,
+        rank,
+        classificacao,
+        tipo,
+        usos,
+        requisitos,
+        efeito_passivo,
+        bonus_equip,
+        descricao or item_desc or "",
+        card_border_type,
+        card_border_color1,
+        card_border_color2,
+        card_border_speed,
+        image_border_type,
+        image_border_color1,
+        image_border_color2,
+        image_border_speed,
+        uid,
+        icon_html_inner,
+    )
+    # Precisa ser emitido em todo rerun: elemento não emitido some da página.
+    # Como o HTML é determinístico (e vem do cache), o frontend recebe o mesmo
+    # srcdoc e não recarrega o iframe.
+    components.html(html, height=approx_height, scrolling=False)
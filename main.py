@@ -4,34 +4,50 @@
 #  - feature item_popup (editor admin na sidebar e popups por item/usuário, usada no inventário)
 #  - botão para deletar ficha (com deleção em cascata das entidades relacionadas)
 
-import sqlite3, os, base64, inspect, traceback
-from datetime import datetime
+import sqlite3, os, base64, hashlib, threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import groupby
+from operator import itemgetter
 import streamlit as st
-import bcrypt
+
+from db import BASE_DIR, get_conn, reader, writer
 
 # ===== módulos de features (devem existir na mesma pasta) =====
 import skill_popup
 
-try:
-    print("skill_popup module file:", inspect.getsourcefile(skill_popup))
-except Exception:
-    pass
+# diagnóstico de qual arquivo foi carregado: só com ORV_DEBUG=1
+ORV_DEBUG = bool(os.environ.get("ORV_DEBUG"))
+
+if ORV_DEBUG:
+    import inspect
 
-# item_popup é modular/opcional: se o arquivo ainda não existir, o app continua funcionando
-try:
-    import item_popup
     try:
-        print("item_popup module file:", inspect.getsourcefile(item_popup))
+        print("skill_popup module file:", inspect.getsourcefile(skill_popup))
     except Exception:
         pass
+
+# item_popup é modular/opcional: se o arquivo ainda não existir, o app continua funcionando
+try:
+    import item_popup
+    if ORV_DEBUG:
+        try:
+            print("item_popup module file:", inspect.getsourcefile(item_popup))
+        except Exception:
+            pass
 except Exception:
     item_popup = None
 
-DB_PATH = "rpg.db"
+# ancorado na pasta do app; user_images.path guarda o caminho relativo a BASE_DIR
+UPLOAD_DIR = os.path.join(BASE_DIR, "uploads")
 CATEGORIES = ["Arma", "Equipamento", "Utilitários", "Materiais"]
+CATEGORY_INDEX = {c: i for i, c in enumerate(CATEGORIES)}
 IMAGE_TYPES = ["png", "jpg", "jpeg", "webp", "gif"]
+# custo do bcrypt p/ hashes novos (12 é o padrão; hashes antigos continuam válidos)
+BCRYPT_ROUNDS = 10
 
 # ================== ESTILO ORV ==================
+@st.cache_data(show_spinner=False)
 def _image_to_base64(path):
     try:
         with open(path, "rb") as f:
@@ -40,8 +56,9 @@ def _image_to_base64(path):
         return None
 
 
-def apply_orv_theme():
-    st.set_page_config(page_title="Ficha ORV — Multiusuário", layout="wide")
+@st.cache_data(show_spinner=False)
+def _theme_css():
+    # o <style> inteiro (com o fundo em base64) é montado uma vez por processo
     b64 = _image_to_base64("BOMBA STATUS.png")
     if b64:
         bg_css = f"url('data:image/png;base64,{b64}')"
@@ -52,8 +69,7 @@ def apply_orv_theme():
         bg_size = "auto"
         bg_pos = "center"
 
-    st.markdown(
-        f"""
+    return f"""
     <style>
       .stApp {{ background: {bg_css}; background-size: {bg_size}; background-position: {bg_pos}; }}
       .block-container {{
@@ -87,9 +103,15 @@ def apply_orv_theme():
         max-width: 280px;
       }}
     </style>
-    """,
-        unsafe_allow_html=True,
-    )
+    """
+
+
+def apply_orv_theme():
+    # Roda em todo rerun de propósito: o front reseta o título da aba a cada
+    # execução e o <style> é um elemento (o que não é reenviado some da página).
+    # O custo real (ler/encodar o fundo, montar o CSS) já está em _theme_css.
+    st.set_page_config(page_title="Ficha ORV — Multiusuário", layout="wide")
+    st.markdown(_theme_css(), unsafe_allow_html=True)
 
 
 apply_orv_theme()
@@ -194,8 +216,9 @@ CREATE TABLE IF NOT EXISTS user_images (
   owner_user_id INTEGER NOT NULL,
   filename TEXT NOT NULL,
   mime TEXT NOT NULL,
-  data BLOB NOT NULL,
+  data BLOB NOT NULL,              -- vazio quando a imagem está em disco (path)
   created_at TEXT NOT NULL,
+  path TEXT,
   FOREIGN KEY(owner_user_id) REFERENCES users(id) ON DELETE CASCADE
 );
 
@@ -205,6 +228,64 @@ CREATE TABLE IF NOT EXISTS character_appearances (
   FOREIGN KEY(character_id) REFERENCES characters(id) ON DELETE CASCADE,
   FOREIGN KEY(image_id) REFERENCES user_images(id) ON DELETE CASCADE
 );
+
+/* ===== índices das leituras frequentes ===== */
+CREATE INDEX IF NOT EXISTS ix_char_owner_updated ON characters(owner_user_id, updated_at DESC);
+CREATE INDEX IF NOT EXISTS ix_char_updated ON characters(updated_at DESC);
+CREATE INDEX IF NOT EXISTS ix_char_skills_cid_kind ON character_skills(character_id, kind);
+
+/* ===== updated_at da ficha acompanha as tabelas filhas ===== */
+CREATE TRIGGER IF NOT EXISTS trg_stats_touch AFTER UPDATE ON stats
+BEGIN
+  UPDATE characters SET updated_at=strftime('%Y-%m-%dT%H:%M:%f','now') WHERE id=NEW.character_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_combat_touch AFTER UPDATE ON combat
+BEGIN
+  UPDATE characters SET updated_at=strftime('%Y-%m-%dT%H:%M:%f','now') WHERE id=NEW.character_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_inventory_ins AFTER INSERT ON inventory
+BEGIN
+  UPDATE characters SET updated_at=strftime('%Y-%m-%dT%H:%M:%f','now') WHERE id=NEW.character_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_inventory_upd AFTER UPDATE ON inventory
+BEGIN
+  UPDATE characters SET updated_at=strftime('%Y-%m-%dT%H:%M:%f','now') WHERE id=NEW.character_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_inventory_del AFTER DELETE ON inventory
+BEGIN
+  UPDATE characters SET updated_at=strftime('%Y-%m-%dT%H:%M:%f','now') WHERE id=OLD.character_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_char_skills_ins AFTER INSERT ON character_skills
+BEGIN
+  UPDATE characters SET updated_at=strftime('%Y-%m-%dT%H:%M:%f','now') WHERE id=NEW.character_id;
+END;
+
+-- usos de habilidade também: gastar/restaurar invalida só o cache desta ficha
+CREATE TRIGGER IF NOT EXISTS trg_char_skills_upd
+AFTER UPDATE OF kind, uses_max, uses_current ON character_skills
+BEGIN
+  UPDATE characters SET updated_at=strftime('%Y-%m-%dT%H:%M:%f','now') WHERE id=NEW.character_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_char_skills_del AFTER DELETE ON character_skills
+BEGIN
+  UPDATE characters SET updated_at=strftime('%Y-%m-%dT%H:%M:%f','now') WHERE id=OLD.character_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_appearance_ins AFTER INSERT ON character_appearances
+BEGIN
+  UPDATE characters SET updated_at=strftime('%Y-%m-%dT%H:%M:%f','now') WHERE id=NEW.character_id;
+END;
+
+CREATE TRIGGER IF NOT EXISTS trg_appearance_upd AFTER UPDATE OF image_id ON character_appearances
+BEGIN
+  UPDATE characters SET updated_at=strftime('%Y-%m-%dT%H:%M:%f','now') WHERE id=NEW.character_id;
+END;
 """
 
 DEFAULT_DESCRIPTIONS = {
@@ -230,14 +311,7 @@ DEFAULT_DESCRIPTIONS = {
 }
 
 # ================== DB HELPERS ==================
-def get_conn():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    # garante que ON DELETE CASCADE funciona em TODAS as conexões
-    conn.execute("PRAGMA foreign_keys = ON")
-    return conn
-
-
+# conexão/leitores/writer vêm de db.py (compartilhados com os módulos de popup)
 def _column_exists(table: str, col: str) -> bool:
     with get_conn() as c:
         cols = [r["name"] for r in c.execute(f"PRAGMA table_info({table})").fetchall()]
@@ -252,52 +326,52 @@ def _table_sql(name: str) -> str:
         return row["sql"] if row and row["sql"] else ""
 
 
+# colunas adicionadas depois da primeira versão do schema (bancos antigos)
+SCHEMA_VERSION = 3
+# triggers trocados por versões mais abrangentes (o novo já foi criado pelo SCHEMA)
+DROPPED_TRIGGERS = ("trg_char_skills_kind",)
+COLUMN_MIGRATIONS = [
+    ("stats", "wis", "INTEGER NOT NULL DEFAULT 0"),
+    ("inventory", "coins", "INTEGER NOT NULL DEFAULT 0"),
+    ("characters", "notes", "TEXT NOT NULL DEFAULT ''"),
+    ("characters", "coins", "INTEGER NOT NULL DEFAULT 0"),
+    ("character_skills", "uses_max", "INTEGER NOT NULL DEFAULT 0"),
+    ("character_skills", "uses_current", "INTEGER NOT NULL DEFAULT 0"),
+    ("user_images", "path", "TEXT"),
+]
+
+
+def _cols(c, table: str) -> set:
+    return {r["name"] for r in c.execute(f"PRAGMA table_info({table})")}
+
+
 def bootstrap():
     conn = get_conn()
     with conn:
         conn.executescript(SCHEMA)
 
-        # garante coluna 'wis' em stats em bancos antigos
-        try:
-            cur_cols = [r["name"] for r in conn.execute("PRAGMA table_info(stats)").fetchall()]
-            if "wis" not in cur_cols:
-                conn.execute("ALTER TABLE stats ADD COLUMN wis INTEGER NOT NULL DEFAULT 0")
-        except Exception:
-            pass
-
-        # garante coluna 'coins' em inventory em bancos antigos
-        try:
-            inv_cols = [r["name"] for r in conn.execute("PRAGMA table_info(inventory)").fetchall()]
-            if "coins" not in inv_cols:
-                conn.execute("ALTER TABLE inventory ADD COLUMN coins INTEGER NOT NULL DEFAULT 0")
-        except Exception:
-            pass
-
-        # garante colunas 'notes' e 'coins' em characters em bancos antigos
-        try:
-            char_cols = [r["name"] for r in conn.execute("PRAGMA table_info(characters)").fetchall()]
-            if "notes" not in char_cols:
-                conn.execute("ALTER TABLE characters ADD COLUMN notes TEXT NOT NULL DEFAULT ''")
-            if "coins" not in char_cols:
-                conn.execute("ALTER TABLE characters ADD COLUMN coins INTEGER NOT NULL DEFAULT 0")
-        except Exception:
-            pass
-
-        # garante colunas de usos em character_skills em bancos antigos
-        try:
-            cs_cols = [r["name"] for r in conn.execute("PRAGMA table_info(character_skills)").fetchall()]
-            if "uses_max" not in cs_cols:
-                conn.execute("ALTER TABLE character_skills ADD COLUMN uses_max INTEGER NOT NULL DEFAULT 0")
-            if "uses_current" not in cs_cols:
-                conn.execute("ALTER TABLE character_skills ADD COLUMN uses_current INTEGER NOT NULL DEFAULT 0")
-        except Exception:
-            pass
+        # migrações de colunas: só escaneia o catálogo se o banco for de versão antiga
+        if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            cols = {}
+            for table, col, ddl in COLUMN_MIGRATIONS:
+                if table not in cols:
+                    cols[table] = _cols(conn, table)
+                if col not in cols[table]:
+                    try:
+                        conn.execute(f"ALTER TABLE {table} ADD COLUMN {col} {ddl}")
+                    except sqlite3.OperationalError:
+                        pass
+            for trg in DROPPED_TRIGGERS:
+                conn.execute(f"DROP TRIGGER IF EXISTS {trg}")
+            conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+            # schema novo/migrado: recoleta as estatísticas (índices novos)
+            conn.execute("ANALYZE")
 
         # --- admin inicial
         if conn.execute("SELECT COUNT(*) c FROM users").fetchone()["c"] == 0:
             conn.execute(
                 "INSERT INTO users (username,password_hash,is_admin) VALUES (?,?,1)",
-                ("admin", bcrypt.hashpw(b"admin", bcrypt.gensalt())),
+                ("admin", hash_password("admin")),
             )
         # descrições padrão
         for k, v in DEFAULT_DESCRIPTIONS.items():
@@ -307,9 +381,6 @@ def bootstrap():
 
 
 # ================== UTIL / COMPAT (safe modal) ==================
-from contextlib import contextmanager
-
-
 @contextmanager
 def safe_modal(title: str):
     """
@@ -327,38 +398,55 @@ def safe_modal(title: str):
 
 
 # ================== HELPERS da aplicação ==================
-def now():
-    return datetime.utcnow().isoformat()
+def request_rerun():
+    """Pede um rerun; ele acontece uma vez só, no fim da seção/página (flush_rerun)."""
+    st.session_state["_needs_rerun"] = True
+
+
+def flush_rerun():
+    # chamado no fim dos fragmentos (que podem rodar sozinhos) e do main()
+    if st.session_state.pop("_needs_rerun", False):
+        st.rerun()
+
+
+# bcrypt só é importado quando alguém loga/troca senha, não em todo rerun
+def hash_password(pw: str) -> bytes:
+    import bcrypt
+
+    return bcrypt.hashpw(pw.encode("utf-8"), bcrypt.gensalt(rounds=BCRYPT_ROUNDS))
 
 
 def verify_password(pw, hashed):
     try:
+        import bcrypt
+
         return bcrypt.checkpw(pw.encode("utf-8"), hashed)
     except Exception:
         return False
 
 
 def get_user(username):
-    with get_conn() as c:
+    with reader() as c:
         return c.execute("SELECT * FROM users WHERE username=?", (username,)).fetchone()
 
 
 def create_character(owner_id: int, name="Novo", title=None):
-    with get_conn() as c, c:
+    with writer() as c:
         cur = c.execute(
             """INSERT INTO characters
             (owner_user_id,name,title,age,sponsor,celestial_mark,innate_talent,created_at,updated_at)
-            VALUES (?,?,?,?,?,?,?, ?, ?)""",
-            (owner_id, name, title, None, None, None, None, now(), now()),
+            VALUES (?,?,?,?,?,?,?, strftime('%Y-%m-%dT%H:%M:%f','now'), strftime('%Y-%m-%dT%H:%M:%f','now'))""",
+            (owner_id, name, title, None, None, None, None),
         )
         cid = cur.lastrowid
         c.execute("INSERT INTO stats (character_id) VALUES (?)", (cid,))
         c.execute("INSERT INTO combat (character_id) VALUES (?)", (cid,))
-        return cid
+    _char_options.clear()
+    return cid
 
 
 def list_characters(user):
-    with get_conn() as c:
+    with reader() as c:
         if user["is_admin"]:
             return c.execute(
                 "SELECT * FROM characters ORDER BY updated_at DESC"
@@ -369,21 +457,113 @@ def list_characters(user):
         ).fetchall()
 
 
+@st.cache_data(ttl=30)
+def _char_options(owner_user_id):
+    """(id, rótulo) das fichas do seletor; owner_user_id=None lista todas (admin)."""
+    user = {"is_admin": owner_user_id is None, "id": owner_user_id}
+    return [
+        (r["id"], f'#{r["id"]} — {r["name"]} (atualizado {r["updated_at"][:19]}Z)')
+        for r in list_characters(user)
+    ]
+
+
+BASIC_COLS = ("name", "title", "age", "sponsor", "celestial_mark", "innate_talent")
+STAT_COLS = ("con", "dex", "cha", "str", "int", "wis")
+COMBAT_COLS = ("hp_max", "hp_current", "hp_temp", "ac")
+
+
+def _char_version(cid):
+    # updated_at muda a cada save (triggers), então serve de chave para os caches da ficha;
+    # versões antigas saem pelo max_entries/ttl (o ttl cobre edições feitas fora do app)
+    with reader() as c:
+        r = c.execute("SELECT updated_at FROM characters WHERE id=?", (cid,)).fetchone()
+        return r["updated_at"] if r else None
+
+
+def _clear_char_caches():
+    # para escritas que mudam o que a ficha mostra sem tocar characters.updated_at
+    # (catálogo de itens/skills — nome/descrição/categoria aparecem no inventário);
+    # usos de habilidade já tocam updated_at pelo trigger de character_skills
+    _load_character_cached.clear()
+    _list_skills_all_cached.clear()
+    _list_inventory_cached.clear()
+    st.session_state.pop("_char_snap", None)
+
+
+CHAR_SNAP_MAX = 4
+
+
 def load_character(cid):
-    with get_conn() as c:
-        ch = c.execute("SELECT * FROM characters WHERE id=?", (cid,)).fetchone()
-        stt = c.execute("SELECT * FROM stats WHERE character_id=?", (cid,)).fetchone()
-        cmb = c.execute(
-            "SELECT * FROM combat WHERE character_id=?", (cid,)
+    # memo por sessão em cima do cache_data: main + seções chamam isto várias vezes
+    # por rerun; com a mesma versão não pagam de novo o hash/cópia do cache_data
+    key = (cid, _char_version(cid))
+    snaps = st.session_state.setdefault("_char_snap", OrderedDict())
+    snap = snaps.get(key)
+    if snap is None:
+        snap = snaps[key] = _load_character_cached(*key)
+        while len(snaps) > CHAR_SNAP_MAX:
+            snaps.popitem(last=False)
+    else:
+        snaps.move_to_end(key)
+    return snap
+
+
+@st.cache_data(ttl=30, max_entries=128)
+def _load_character_cached(cid, updated_at):
+    with reader() as c:
+        # ficha + status + combate numa linha só; depois fatiamos em 3 dicts
+        row = c.execute(
+            """
+            SELECT c.*,
+                   s.character_id AS _stats_cid, s.con, s.dex, s.cha, s.str, s.int, s.wis,
+                   cm.character_id AS _combat_cid, cm.hp_max, cm.hp_current, cm.hp_temp, cm.ac
+            FROM characters c
+            LEFT JOIN stats s ON s.character_id = c.id
+            LEFT JOIN combat cm ON cm.character_id = c.id
+            WHERE c.id = ?
+        """,
+            (cid,),
         ).fetchone()
-        inv = c.execute(
+        ch = stt = cmb = None
+        if row:
+            d = dict(row)
+            stats_cid = d.pop("_stats_cid")
+            combat_cid = d.pop("_combat_cid")
+            stt = {k: d.pop(k) for k in STAT_COLS}
+            cmb = {k: d.pop(k) for k in COMBAT_COLS}
+            ch = d
+            if stats_cid is None:
+                stt = None
+            else:
+                stt["character_id"] = stats_cid
+            if combat_cid is None:
+                cmb = None
+            else:
+                cmb["character_id"] = combat_cid
+        return ch, stt, cmb
+
+
+INV_PAGE_SIZE = 25
+
+
+def list_inventory(cid, limit=None, offset=0):
+    """(linhas, total) do inventário; limit=None traz tudo."""
+    return _list_inventory_cached(cid, _char_version(cid), limit, offset)
+
+
+@st.cache_data(ttl=30, max_entries=256)
+def _list_inventory_cached(cid, updated_at, limit, offset):
+    with reader() as c:
+        # COUNT(*) OVER () traz o total junto com a página, sem segunda query
+        rows = c.execute(
             """
             SELECT inventory.qty,
                    inventory.coins,
                    items.id   AS item_id,
                    items.name AS name,
                    items.description AS description,
-                   items.category AS category
+                   items.category AS category,
+                   COUNT(*) OVER () AS _total
             FROM inventory
             JOIN items ON items.id = inventory.item_id
             WHERE inventory.character_id = ?
@@ -395,10 +575,15 @@ def load_character(cid):
                        ELSE 5
                      END,
                      items.name
+            LIMIT ? OFFSET ?
         """,
-            (cid,),
+            (cid, -1 if limit is None else limit, offset),
         ).fetchall()
-        return ch, stt, cmb, inv
+    inv = [dict(r) for r in rows]
+    total = inv[0].pop("_total") if inv else 0
+    for r in inv[1:]:
+        del r["_total"]
+    return inv, total
 
 
 def delete_character_if_allowed(cid: int, user: dict) -> bool:
@@ -410,7 +595,7 @@ def delete_character_if_allowed(cid: int, user: dict) -> bool:
     inventário, habilidades da ficha, aparências, etc.
     Retorna True se alguma linha foi apagada.
     """
-    with get_conn() as conn, conn:
+    with writer() as conn:
         if user.get("is_admin"):
             cur = conn.execute("DELETE FROM characters WHERE id=?", (cid,))
         else:
@@ -419,71 +604,138 @@ def delete_character_if_allowed(cid: int, user: dict) -> bool:
                 (cid, user["id"]),
             )
         # agora usamos rowcount do CURSOR, não da conexão
-        return cur.rowcount > 0
-
+        deleted = cur.rowcount > 0
+    if deleted:
+        _char_options.clear()
+    return deleted
+
+
+
+SQL_SAVE_BASIC = """UPDATE characters SET name=?, title=?, age=?, sponsor=?, celestial_mark=?, innate_talent=?, updated_at=strftime('%Y-%m-%dT%H:%M:%f','now') WHERE id=?"""
+SQL_SAVE_STATS = "UPDATE stats SET con=?, dex=?, cha=?, str=?, int=?, wis=? WHERE character_id=?"
+SQL_SAVE_COMBAT = "UPDATE combat SET hp_max=?, hp_current=?, hp_temp=?, ac=? WHERE character_id=?"
+SQL_SAVE_COINS = "UPDATE characters SET coins=?, updated_at=strftime('%Y-%m-%dT%H:%M:%f','now') WHERE id=?"
+SQL_SAVE_NOTES = "UPDATE characters SET notes=?, updated_at=strftime('%Y-%m-%dT%H:%M:%f','now') WHERE id=?"
+SQL_INV_DELETE = "DELETE FROM inventory WHERE character_id=? AND item_id=?"
+# linha nova nasce com coins=0; se já existe, o ON CONFLICT preserva as moedas
+SQL_INV_SET_QTY = """INSERT INTO inventory(character_id,item_id,qty,coins) VALUES(?,?,?,0)
+                     ON CONFLICT(character_id,item_id) DO UPDATE SET qty=excluded.qty"""
+SQL_INV_SET_COINS = """INSERT INTO inventory(character_id,item_id,qty,coins) VALUES(?,?,0,?)
+                     ON CONFLICT(character_id,item_id) DO UPDATE SET coins=excluded.coins"""
+SQL_SKILL_USES_GET = "SELECT uses_max, uses_current FROM character_skills WHERE character_id=? AND skill_id=?"
+SQL_SKILL_USES_SET = "UPDATE character_skills SET uses_max=?, uses_current=? WHERE character_id=? AND skill_id=?"
+SQL_SET_PASSWORD = "UPDATE users SET password_hash=? WHERE id=?"
+SQL_UPSERT_GLOBAL_ITEM = """INSERT INTO items(owner_user_id,name,description,category)
+                         VALUES(NULL,?,?,?)
+                         ON CONFLICT(owner_user_id,name) DO UPDATE SET
+                           description=excluded.description,
+                           category=excluded.category"""
+SQL_UPSERT_GLOBAL_SKILL = """INSERT INTO skills(owner_user_id,name,description) VALUES(NULL,?,?)
+                         ON CONFLICT(owner_user_id,name) DO UPDATE SET description=excluded.description"""
 
 
 def save_character_basic(cid, data):
-    with get_conn() as c, c:
+    with writer() as c:
         c.execute(
-            """UPDATE characters SET name=?, title=?, age=?, sponsor=?, celestial_mark=?, innate_talent=?, updated_at=? WHERE id=?""",
-            (
-                data["name"],
-                data["title"],
-                data["age"],
-                data["sponsor"],
-                data["celestial_mark"],
-                data["innate_talent"],
-                now(),
-                cid,
-            ),
+            SQL_SAVE_BASIC, (*(data[k] for k in BASIC_COLS), cid)
         )
+    _char_options.clear()
 
 
 def save_stats(cid, d):
-    with get_conn() as c, c:
+    with writer() as c:
+        # updated_at da ficha fica por conta do trg_stats_touch
         c.execute(
-            "UPDATE stats SET con=?, dex=?, cha=?, str=?, int=?, wis=? WHERE character_id=?",
-            (d["con"], d["dex"], d["cha"], d["str"], d["int"], d["wis"], cid),
+            SQL_SAVE_STATS, (*(d[k] for k in STAT_COLS), cid)
         )
-        c.execute("UPDATE characters SET updated_at=? WHERE id=?", (now(), cid))
 
 
 def save_combat(cid, d):
-    with get_conn() as c, c:
+    with writer() as c:
+        # updated_at da ficha fica por conta do trg_combat_touch
         c.execute(
-            "UPDATE combat SET hp_max=?, hp_current=?, hp_temp=?, ac=? WHERE character_id=?",
-            (d["hp_max"], d["hp_current"], d["hp_temp"], d["ac"], cid),
+            SQL_SAVE_COMBAT, (*(d[k] for k in COMBAT_COLS), cid)
         )
-        c.execute("UPDATE characters SET updated_at=? WHERE id=?", (now(), cid))
 
 
 # ================== APARÊNCIA (imagens) ==================
+@st.cache_data(max_entries=64)
+def _appearance_blob(image_id: int):
+    # BLOB de imagens antigas (antes do UPLOAD_DIR); upload novo = id novo, então o id basta como chave
+    with reader() as c:
+        r = c.execute("SELECT data FROM user_images WHERE id=?", (image_id,)).fetchone()
+        return r["data"] if r else None
+
+
+def _store_upload(raw: bytes, filename: str) -> str:
+    """
+    Grava a imagem em UPLOAD_DIR (nome = sha256 do conteúdo) e devolve o caminho
+    relativo a BASE_DIR. Levanta OSError se o arquivo não ficar com o conteúdo todo.
+    """
+    ext = os.path.splitext(filename)[1].lower() or ".bin"
+    path = os.path.join(UPLOAD_DIR, hashlib.sha256(raw).hexdigest() + ext)
+    if not os.path.exists(path):
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(raw)
+        os.replace(tmp, path)
+    if os.path.getsize(path) != len(raw):
+        raise OSError(f"upload incompleto: {path}")
+    return os.path.relpath(path, BASE_DIR)
+
+
 def get_current_appearance(cid):
-    with get_conn() as c:
+    with reader() as c:
         r = c.execute(
             """
-            SELECT ui.id, ui.mime, ui.data, ui.filename, ui.created_at
+            SELECT ui.id, ui.mime, ui.filename, ui.created_at, ui.path
             FROM character_appearances ca
             JOIN user_images ui ON ui.id = ca.image_id
             WHERE ca.character_id = ?
         """,
             (cid,),
         ).fetchone()
-        return r
+    if not r:
+        return None
+    cur = dict(r)
+    if cur["path"]:
+        # caminhos antigos também eram relativos ("uploads/..."), então valem aqui
+        path = os.path.join(BASE_DIR, cur["path"])
+        if os.path.exists(path):
+            # st.image aceita o caminho e o Streamlit serve o arquivo direto
+            cur["data"] = path
+            return cur
+    cur["data"] = _appearance_blob(cur["id"])
+    if not cur["data"]:
+        # arquivo sumiu (redeploy, outra pasta) e o BLOB já está vazio: sem imagem
+        return None
+    # imagem antiga ainda no banco: passa pro disco e só esvazia o BLOB
+    # depois que o arquivo foi gravado e conferido
+    try:
+        rel = _store_upload(cur["data"], cur["filename"])
+        with writer() as c:
+            c.execute(
+                "UPDATE user_images SET path=?, data=zeroblob(0) WHERE id=?",
+                (rel, cur["id"]),
+            )
+    except Exception:
+        pass
+    return cur
 
 
 def save_uploaded_appearance(user_id: int, cid: int, uploaded_file):
     raw = uploaded_file.getvalue()
     filename = getattr(uploaded_file, "name", f"upload_{cid}")
     mime = uploaded_file.type or "application/octet-stream"
-    with get_conn() as c, c:
+    path = _store_upload(raw, filename)
+    with writer() as c:
         cur = c.execute(
             """
-            INSERT INTO user_images(owner_user_id, filename, mime, data, created_at)
-            VALUES (?,?,?,?,?)
+            INSERT INTO user_images(owner_user_id, filename, mime, data, path, created_at)
+            VALUES (?,?,?,zeroblob(0),?,strftime('%Y-%m-%dT%H:%M:%f','now'))
         """,
-            (user_id, filename, mime, raw, now()),
+            (user_id, filename, mime, path),
         )
         img_id = cur.lastrowid
         c.execute(
@@ -493,133 +745,170 @@ def save_uploaded_appearance(user_id: int, cid: int, uploaded_file):
                   """,
             (cid, img_id),
         )
-        c.execute("UPDATE characters SET updated_at=? WHERE id=?", (now(), cid))
     return img_id
 
 
 # ================== ITENS por usuário (com categoria) ==================
 def upsert_user_item(user_id: int, name: str, description: str, category: str) -> int:
     name = name.strip()
-    category = category if category in CATEGORIES else "Utilitários"
-    with get_conn() as c, c:
-        c.execute(
+    category = category if category in CATEGORY_INDEX else "Utilitários"
+    with writer() as c:
+        rid = c.execute(
             """
             INSERT INTO items(owner_user_id,name,description,category)
             VALUES(?,?,?,?)
             ON CONFLICT(owner_user_id,name) DO UPDATE SET
-                description=COALESCE(NULLIF(?,''), description),
+                description=COALESCE(NULLIF(excluded.description,''), items.description),
                 category=excluded.category
+            RETURNING id
         """,
-            (user_id, name, description, category, description),
-        )
-    with get_conn() as c:
-        rid = c.execute(
-            "SELECT id FROM items WHERE owner_user_id=? AND name=?",
-            (user_id, name),
+            (user_id, name, description, category),
         ).fetchone()["id"]
+    _clear_char_caches()
     return rid
 
 
 def set_inv_qty(cid, item_id, qty):
-    with get_conn() as c, c:
+    with writer() as c:
         if qty <= 0:
-            c.execute(
-                "DELETE FROM inventory WHERE character_id=? AND item_id=?",
-                (cid, item_id),
-            )
+            c.execute(SQL_INV_DELETE, (cid, item_id))
         else:
+            c.execute(SQL_INV_SET_QTY, (cid, item_id, qty))
+    if item_popup and hasattr(item_popup, "clear_inventory_cache"):
+        item_popup.clear_inventory_cache()
+
+
+def set_inv_coins(cid, item_id, coins):
+    with writer() as c:
+        c.execute(SQL_INV_SET_COINS, (cid, item_id, coins))
+
+
+def set_inv_bulk(cid, rows):
+    """
+    Grava vários itens do inventário numa transação só (executemany + um DELETE).
+    rows: [(item_id, qty, coins)] — qty <= 0 remove o item; coins None mantém o valor atual.
+    """
+    keep = [(cid, iid, q, co) for iid, q, co in rows if q > 0]
+    drop = [iid for iid, q, _ in rows if q <= 0]
+    with writer() as c:
+        if keep:
+            c.executemany(
+                """INSERT INTO inventory(character_id,item_id,qty,coins) VALUES(?1,?2,?3,COALESCE(?4,0))
+                         ON CONFLICT(character_id,item_id) DO UPDATE SET
+                             qty=excluded.qty,
+                             coins=COALESCE(?4, inventory.coins)""",
+                keep,
+            )
+        if drop:
+            marks = ",".join("?" * len(drop))
             c.execute(
-                """INSERT INTO inventory(character_id,item_id,qty,coins) VALUES(?,?,?,COALESCE((SELECT coins FROM inventory WHERE character_id=? AND item_id=?),0))
-                         ON CONFLICT(character_id,item_id) DO UPDATE SET qty=excluded.qty""",
-                (cid, item_id, qty, cid, item_id),
+                f"DELETE FROM inventory WHERE character_id=? AND item_id IN ({marks})",
+                (cid, *drop),
             )
-        c.execute("UPDATE characters SET updated_at=? WHERE id=?", (now(), cid))
+    if item_popup and hasattr(item_popup, "clear_inventory_cache"):
+        item_popup.clear_inventory_cache()
 
 
-def set_inv_coins(cid, item_id, coins):
-    with get_conn() as c, c:
-        c.execute(
-            """INSERT INTO inventory(character_id,item_id,qty,coins) VALUES(?,?,0,?)
-                     ON CONFLICT(character_id,item_id) DO UPDATE SET coins=excluded.coins""",
-            (cid, item_id, coins),
-        )
-        c.execute("UPDATE characters SET updated_at=? WHERE id=?", (now(), cid))
+# persist="disk": sobrevive a restart do servidor (Streamlit ignora ttl aqui);
+# só set_desc escreve em descriptions, e ele limpa o cache
+@st.cache_data(persist="disk")
+def _all_descs():
+    # tabela pequena e quase estática: carrega inteira e serve da memória
+    with reader() as c:
+        return {r["key"]: r["text"] for r in c.execute("SELECT key,text FROM descriptions")}
 
 
 def get_desc(key):
-    with get_conn() as c:
-        r = c.execute("SELECT text FROM descriptions WHERE key=?", (key,)).fetchone()
-        return r["text"] if r else ""
+    return _all_descs().get(key, "")
 
 
 def set_desc(key, text):
-    with get_conn() as c, c:
+    with writer() as c:
         c.execute(
             """INSERT INTO descriptions(key,text) VALUES(?,?)
                      ON CONFLICT(key) DO UPDATE SET text=excluded.text""",
             (key, text),
         )
+    _all_descs.clear()
 
 
 # ================== HABILIDADES por usuário ==================
 def upsert_user_skill(user_id: int, name: str, description: str = "") -> int:
     name = name.strip()
-    with get_conn() as c, c:
-        c.execute(
-            """INSERT INTO skills(owner_user_id,name,description) VALUES(?,?,?)
-                     ON CONFLICT(owner_user_id,name) DO UPDATE SET description=COALESCE(NULLIF(?,''), description)""",
-            (user_id, name, description, description),
-        )
-    with get_conn() as c:
+    with writer() as c:
         rid = c.execute(
-            "SELECT id FROM skills WHERE owner_user_id=? AND name=?",
-            (user_id, name),
+            """INSERT INTO skills(owner_user_id,name,description) VALUES(?,?,?)
+                     ON CONFLICT(owner_user_id,name) DO UPDATE SET description=COALESCE(NULLIF(excluded.description,''), skills.description)
+                     RETURNING id""",
+            (user_id, name, description),
         ).fetchone()["id"]
+    _clear_char_caches()
     return rid
 
 
 def link_skill_to_char(cid: int, skill_id: int, kind: str):
-    with get_conn() as c, c:
+    with writer() as c:
         c.execute(
             """INSERT INTO character_skills(character_id,skill_id,kind) VALUES(?,?,?)
                      ON CONFLICT(character_id,skill_id) DO UPDATE SET kind=excluded.kind""",
             (cid, skill_id, kind),
         )
-        c.execute("UPDATE characters SET updated_at=? WHERE id=?", (now(), cid))
 
 
 def unlink_skill_from_char(cid: int, skill_id: int):
-    with get_conn() as c, c:
+    with writer() as c:
         c.execute(
             "DELETE FROM character_skills WHERE character_id=? AND skill_id=?",
             (cid, skill_id),
         )
-        c.execute("UPDATE characters SET updated_at=? WHERE id=?", (now(), cid))
+
+
+SKILL_KINDS = ("unique", "generic", "innate")
+# rótulo da UI -> kind gravado em character_skills
+_KIND_MAP = {"Única": "unique", "Genérica": "generic", "Talento Inato": "innate"}
+_KIND_LABELS = tuple(_KIND_MAP)
+
+
+def list_skills_for_char_all(cid: int) -> dict:
+    """Habilidades da ficha agrupadas por kind: {"unique": [...], "generic": [...], "innate": [...]}."""
+    return _list_skills_all_cached(cid, _char_version(cid))
 
 
 def list_skills_for_char(cid: int, kind: str):
-    with get_conn() as c:
-        return c.execute(
+    return list_skills_for_char_all(cid).get(kind, [])
+
+
+@st.cache_data(ttl=30, max_entries=128)
+def _list_skills_all_cached(cid: int, updated_at):
+    # uma query só para os 3 kinds; particiona em Python
+    buckets = {k: [] for k in SKILL_KINDS}
+    with reader() as c:
+        rows = c.execute(
             """SELECT s.id,
                           s.name,
                           s.description,
                           s.owner_user_id,
+                          cs.kind,
                           cs.uses_max,
                           cs.uses_current
                    FROM character_skills cs
                    JOIN skills s ON s.id = cs.skill_id
-                   WHERE cs.character_id = ? AND cs.kind = ?
+                   WHERE cs.character_id = ?
                    ORDER BY s.name""",
-            (cid, kind),
+            (cid,),
         ).fetchall()
+    for r in rows:
+        buckets.setdefault(r["kind"], []).append(dict(r))
+    return buckets
 
 
 def update_skill_description_if_owner(skill_id: int, owner_user_id: int, text: str):
-    with get_conn() as c, c:
+    with writer() as c:
         c.execute(
             "UPDATE skills SET description=? WHERE id=? AND owner_user_id=?",
             (text, skill_id, owner_user_id),
         )
+    _clear_char_caches()
 
 
 def delete_skill_if_owner_and_unreferenced(skill_id: int, owner_user_id: int) -> bool:
@@ -629,7 +918,7 @@ def delete_skill_if_owner_and_unreferenced(skill_id: int, owner_user_id: int) ->
       - e não houver mais linhas em character_skills referenciando essa skill
     Retorna True se o registro foi deletado, False caso não tenha sido (ou não tinha permissão).
     """
-    with get_conn() as c, c:
+    with writer() as c:
         row = c.execute(
             "SELECT owner_user_id FROM skills WHERE id=?", (skill_id,)
         ).fetchone()
@@ -649,11 +938,8 @@ def delete_skill_if_owner_and_unreferenced(skill_id: int, owner_user_id: int) ->
 
 def update_skill_uses(cid: int, skill_id: int, uses_max: int | None = None, uses_current: int | None = None):
     """Atualiza os campos de uso para uma habilidade específica da ficha."""
-    with get_conn() as c, c:
-        row = c.execute(
-            "SELECT uses_max, uses_current FROM character_skills WHERE character_id=? AND skill_id=?",
-            (cid, skill_id),
-        ).fetchone()
+    with writer() as c:
+        row = c.execute(SQL_SKILL_USES_GET, (cid, skill_id)).fetchone()
         if not row:
             return
         cur_max = row["uses_max"]
@@ -664,17 +950,32 @@ def update_skill_uses(cid: int, skill_id: int, uses_max: int | None = None, uses
             uses_current = cur_current
         uses_max = max(0, int(uses_max))
         uses_current = max(0, min(int(uses_current), uses_max))
+        c.execute(SQL_SKILL_USES_SET, (uses_max, uses_current, cid, skill_id))
+
+
+def update_skill_uses_many(cid: int, max_by_skill: dict):
+    """Grava o máximo de usos de várias habilidades num UPDATE só (uses_current é limitado ao novo máximo)."""
+    if not max_by_skill:
+        return
+    whens = " ".join("WHEN ? THEN ?" for _ in max_by_skill)
+    pairs = [v for sid, m in max_by_skill.items() for v in (sid, max(0, int(m)))]
+    marks = ",".join("?" * len(max_by_skill))
+    with writer() as c:
         c.execute(
-            "UPDATE character_skills SET uses_max=?, uses_current=? WHERE character_id=? AND skill_id=?",
-            (uses_max, uses_current, cid, skill_id),
+            f"""UPDATE character_skills
+                   SET uses_max = CASE skill_id {whens} END,
+                       uses_current = MIN(uses_current, CASE skill_id {whens} END)
+                 WHERE character_id=? AND skill_id IN ({marks})""",
+            (*pairs, *pairs, cid, *max_by_skill),
         )
 
 
 def reset_all_skill_uses(cid: int):
     """Restaura uses_current = uses_max para todas as habilidades da ficha."""
-    with get_conn() as c, c:
+    with writer() as c:
         c.execute(
-            "UPDATE character_skills SET uses_current = uses_max WHERE character_id=?",
+            # só as linhas que mudam: menos páginas sujas no WAL
+            "UPDATE character_skills SET uses_current = uses_max WHERE character_id=? AND uses_current <> uses_max",
             (cid,),
         )
 
@@ -725,12 +1026,13 @@ def login_box():
             st.warning("Preencha usuário e senha.")
         else:
             try:
-                hashed = bcrypt.hashpw(np.encode("utf-8"), bcrypt.gensalt())
-                with get_conn() as c, c:
+                hashed = hash_password(np)
+                with writer() as c:
                     c.execute(
                         "INSERT INTO users(username,password_hash) VALUES(?,?)",
                         (nu, hashed),
                     )
+                _admin_users_table.clear()
                 st.success("Usuário criado! Faça login.")
             except sqlite3.IntegrityError:
                 st.error("Usuário já existe.")
@@ -746,15 +1048,13 @@ def sidebar_char_selector(user):
         st.query_params = params
         st.rerun()
 
-    rows = list_characters(user)
+    rows = _char_options(None if user["is_admin"] else user["id"])
     if not rows:
         st.sidebar.info("Nenhuma ficha. Crie uma.")
         return
 
-    options = {
-        f'#{r["id"]} — {r["name"]} (atualizado {r["updated_at"][:19]}Z)': r["id"]
-        for r in rows
-    }
+    values = [cid for cid, _ in rows]
+    labels = [label for _, label in rows]
 
     params = st.query_params
     if "char" in params and "cid" not in st.session_state:
@@ -767,16 +1067,14 @@ def sidebar_char_selector(user):
         except Exception:
             pass
 
-    current_id = st.session_state.get("cid", list(options.values())[0])
-    labels = list(options.keys())
-    values = list(options.values())
+    current_id = st.session_state.get("cid", values[0])
     try:
         idx = values.index(current_id)
     except ValueError:
         idx = 0
 
     sel_label = st.sidebar.selectbox("Selecionar", labels, index=idx)
-    st.session_state.cid = options[sel_label]
+    st.session_state.cid = values[labels.index(sel_label)]
 
     params = dict(st.query_params)
     params["char"] = [str(st.session_state.cid)]
@@ -786,7 +1084,12 @@ def sidebar_char_selector(user):
 
 
 # =============== SESSÕES ===============
-def section_basic(ch, is_admin, cid, user_id):
+# Cada aba é um fragmento: um clique dentro dela só reexecuta a própria aba
+# (st.rerun() continua recarregando tudo). Cada uma lê sua parte da ficha com
+# load_character(cid), que vem do cache enquanto updated_at não mudar.
+@st.fragment
+def section_basic(cid, is_admin, user_id):
+    ch = load_character(cid)[0]
     st.subheader("Informações básicas")
     left, right = st.columns([3, 2], gap="large")
 
@@ -824,75 +1127,82 @@ def section_basic(ch, is_admin, cid, user_id):
 
     # --- Coluna Esquerda: Campos básicos (3 subcolunas) ---
     with left:
-        cols = st.columns(3)
-        with cols[0]:
-            name = st.text_input("Nome", ch["name"] or "")
-            title = st.text_input("Título", ch["title"] or "")
-        with cols[1]:
-            age = st.number_input("Idade", 0, 300, int(ch["age"] or 0))
-            sponsor = st.text_input("Patrocinador", ch["sponsor"] or "")
-        with cols[2]:
-            celestial_mark = st.text_input(
-                "Marca Celestial", ch["celestial_mark"] or ""
-            )
-            innate = st.text_input("Talento Inato", ch["innate_talent"] or "")
+        with st.form(f"basic_{cid}", border=False):
+            cols = st.columns(3)
+            with cols[0]:
+                name = st.text_input("Nome", ch["name"] or "")
+                title = st.text_input("Título", ch["title"] or "")
+            with cols[1]:
+                age = st.number_input("Idade", 0, 300, int(ch["age"] or 0))
+                sponsor = st.text_input("Patrocinador", ch["sponsor"] or "")
+            with cols[2]:
+                celestial_mark = st.text_input(
+                    "Marca Celestial", ch["celestial_mark"] or ""
+                )
+                innate = st.text_input("Talento Inato", ch["innate_talent"] or "")
+            submitted = st.form_submit_button("💾 Salvar básicos")
 
-        if st.button("💾 Salvar básicos"):
+        if submitted:
             save_character_basic(
                 ch["id"],
                 dict(
-                    name=name,
-                    title=title,
-                    age=age,
-                    sponsor=sponsor,
-                    celestial_mark=celestial_mark,
-                    innate_talent=innate,
+                    zip(
+                        BASIC_COLS,
+                        (name, title, age, sponsor, celestial_mark, innate),
+                    )
                 ),
             )
             st.success("Básicos salvos.")
 
 
-def section_status(stt, cid, is_admin):
+@st.fragment
+def section_status(cid, is_admin):
+    stt = load_character(cid)[1]
     st.subheader("Status")
-    cols = st.columns(6)
-    with cols[0]:
-        con = st.number_input("CON", 0, 999, int(stt["con"] or 0))
-    with cols[1]:
-        dex = st.number_input("DEX", 0, 999, int(stt["dex"] or 0))
-    with cols[2]:
-        cha = st.number_input("CHA", 0, 999, int(stt["cha"] or 0))
-    with cols[3]:
-        str_ = st.number_input("STR", 0, 999, int(stt["str"] or 0))
-    with cols[4]:
-        int_ = st.number_input("INT", 0, 999, int(stt["int"] or 0))
-    with cols[5]:
-        wis = st.number_input("SABEDORIA", 0, 999, int(stt["wis"] or 0))
-    if st.button("💾 Salvar status"):
-        save_stats(
-            cid, dict(con=con, dex=dex, cha=cha, str=str_, int=int_, wis=wis)
-        )
+    # form: editar os 6 atributos só reexecuta o script no "Salvar"
+    with st.form(f"status_{cid}", border=False):
+        cols = st.columns(6)
+        with cols[0]:
+            con = st.number_input("CON", 0, 999, int(stt["con"] or 0))
+        with cols[1]:
+            dex = st.number_input("DEX", 0, 999, int(stt["dex"] or 0))
+        with cols[2]:
+            cha = st.number_input("CHA", 0, 999, int(stt["cha"] or 0))
+        with cols[3]:
+            str_ = st.number_input("STR", 0, 999, int(stt["str"] or 0))
+        with cols[4]:
+            int_ = st.number_input("INT", 0, 999, int(stt["int"] or 0))
+        with cols[5]:
+            wis = st.number_input("SABEDORIA", 0, 999, int(stt["wis"] or 0))
+        submitted = st.form_submit_button("💾 Salvar status")
+    if submitted:
+        save_stats(cid, dict(zip(STAT_COLS, (con, dex, cha, str_, int_, wis))))
         st.success("Status salvos.")
 
 
-def section_combat(cmb, cid, is_admin):
+@st.fragment
+def section_combat(cid, is_admin):
+    cmb = load_character(cid)[2]
     st.subheader("Dados de combate")
-    c1, c2, c3, c4 = st.columns(4)
-    with c1:
-        hp_max = st.number_input(
-            "Vida Máxima", 0, 9999, int(cmb["hp_max"] or 0), key="hp_max"
-        )
-    with c2:
-        hp_current = st.number_input(
-            "Vida Atual", 0, 9999, int(cmb["hp_current"] or 0), key="hp_current"
-        )
-    with c3:
-        hp_temp = st.number_input(
-            "Vida Temporária", 0, 9999, int(cmb["hp_temp"] or 0), key="hp_temp"
-        )
-    with c4:
-        ac = st.number_input(
-            "Classe de Armadura", 0, 1000, int(cmb["ac"] or 0), key="ac"
-        )
+    with st.form(f"combat_{cid}", border=False):
+        c1, c2, c3, c4 = st.columns(4)
+        with c1:
+            hp_max = st.number_input(
+                "Vida Máxima", 0, 9999, int(cmb["hp_max"] or 0), key="hp_max"
+            )
+        with c2:
+            hp_current = st.number_input(
+                "Vida Atual", 0, 9999, int(cmb["hp_current"] or 0), key="hp_current"
+            )
+        with c3:
+            hp_temp = st.number_input(
+                "Vida Temporária", 0, 9999, int(cmb["hp_temp"] or 0), key="hp_temp"
+            )
+        with c4:
+            ac = st.number_input(
+                "Classe de Armadura", 0, 1000, int(cmb["ac"] or 0), key="ac"
+            )
+        submitted = st.form_submit_button("💾 Salvar combate")
 
     temp_nonneg = max(0, int(hp_temp))
     pv_efetivo = int(hp_current) + temp_nonneg
@@ -904,21 +1214,23 @@ def section_combat(cmb, cid, is_admin):
         "PV Efetivo = Vida Atual + Vida Temporária (pode exceder o máximo)."
     )
 
-    if st.button("💾 Salvar combate"):
+    if submitted:
         save_combat(
             cid,
             dict(
-                hp_max=int(hp_max),
-                hp_current=int(hp_current),
-                hp_temp=int(hp_temp),
-                ac=int(ac),
+                zip(
+                    COMBAT_COLS,
+                    (int(hp_max), int(hp_current), int(hp_temp), int(ac)),
+                )
             ),
         )
         st.success("Combate salvo.")
 
 
 # ================== INVENTÁRIO (por usuário, com categoria) ==================
-def section_inventory(ch, inv, cid, is_admin, user_id):
+@st.fragment
+def section_inventory(cid, is_admin, user_id):
+    ch = load_character(cid)[0]
     st.subheader("Inventário")
     st.caption(
         "Cada usuário tem seu próprio catálogo. Se o item não existir, será criado com a categoria escolhida."
@@ -941,19 +1253,43 @@ def section_inventory(ch, inv, cid, is_admin, user_id):
             )
             set_inv_qty(cid, item_id, qty_add)
             st.success("Inventário atualizado.")
-            st.rerun()
+            request_rerun()
         else:
             st.warning("Informe o nome do item.")
 
+    # paginação: só INV_PAGE_SIZE linhas (e seus widgets) por rerun
+    page_key, all_key = f"inv_page_{cid}", f"inv_all_{cid}"
+    show_all = st.session_state.get(all_key, False)
+    page = max(1, int(st.session_state.get(page_key, 1)))
+    if show_all:
+        inv, total = list_inventory(cid)
+    else:
+        inv, total = list_inventory(cid, INV_PAGE_SIZE, (page - 1) * INV_PAGE_SIZE)
+        if not inv and page > 1:
+            # a página sumiu (itens removidos): volta pra primeira
+            page = 1
+            inv, total = list_inventory(cid, INV_PAGE_SIZE, 0)
+    pages = max(1, -(-total // INV_PAGE_SIZE))
+
     if inv:
         st.write("### Itens desta ficha")
-        by_cat = {cat: [] for cat in CATEGORIES}
-        for r in inv:
-            by_cat.get(r["category"], []).append(r)
-
-        for cat in CATEGORIES:
-            rows = by_cat.get(cat, [])
-            if not rows:
+        if total > INV_PAGE_SIZE:
+            st.session_state[page_key] = min(page, pages)
+            p1, p2 = st.columns([1, 3])
+            with p1:
+                st.number_input(
+                    f"Página (de {pages})",
+                    min_value=1,
+                    max_value=pages,
+                    key=page_key,
+                    disabled=show_all,
+                )
+            with p2:
+                st.toggle("Ver tudo", key=all_key)
+        pending_qty = {}  # item_id -> qtd editada (ainda não salva)
+        # inv já vem ordenado por categoria (na ordem de CATEGORIES) e nome
+        for cat, rows in groupby(inv, key=itemgetter("category")):
+            if cat not in CATEGORY_INDEX:
                 continue
             st.markdown(f"**{cat}**")
             st.caption(f"Itens da categoria {cat}")
@@ -992,18 +1328,14 @@ def section_inventory(ch, inv, cid, is_admin, user_id):
                                 new_cat = st.selectbox(
                                     "Categoria do catálogo",
                                     CATEGORIES,
-                                    index=CATEGORIES.index(
-                                        row["category"]
-                                    )
-                                    if row["category"] in CATEGORIES
-                                    else 2,
+                                    index=CATEGORY_INDEX.get(row["category"], 2),
                                     key=f"inv-cat-{row['item_id']}",
                                 )
                                 if st.button(
                                     "Salvar no catálogo",
                                     key=f"inv-desc-save-{row['item_id']}",
                                 ):
-                                    with get_conn() as c, c:
+                                    with writer() as c:
                                         c.execute(
                                             """UPDATE items
                                                  SET description=COALESCE(?, description),
@@ -1018,6 +1350,7 @@ def section_inventory(ch, inv, cid, is_admin, user_id):
                                                 user_id,
                                             ),
                                         )
+                                    _clear_char_caches()
                                     st.success(
                                         "Catálogo atualizado (se o item for seu)."
                                     )
@@ -1029,6 +1362,8 @@ def section_inventory(ch, inv, cid, is_admin, user_id):
                         int(row["qty"]),
                         key=f"qty-{row['item_id']}",
                     )
+                    if newq != int(row["qty"]):
+                        pending_qty[row["item_id"]] = newq
                 with i3:
                     if st.button("💾", key=f"save-{row['item_id']}"):
                         set_inv_qty(
@@ -1039,9 +1374,17 @@ def section_inventory(ch, inv, cid, is_admin, user_id):
                     if st.button("🗑️", key=f"del-{row['item_id']}"):
                         set_inv_qty(cid, row["item_id"], 0)
                         st.warning("Item removido.")
-                        st.rerun()
+                        request_rerun()
                 with i5:
                     st.caption(row["category"])
+        if st.button(
+            "💾 Salvar todas as quantidades",
+            key=f"save-all-qty-{cid}",
+            disabled=not pending_qty,
+        ):
+            set_inv_bulk(cid, [(iid, q, None) for iid, q in pending_qty.items()])
+            st.success("Quantidades salvas.")
+            request_rerun()
     else:
         st.info("Nenhum item neste inventário ainda.")
     st.markdown("---")
@@ -1059,13 +1402,12 @@ def section_inventory(ch, inv, cid, is_admin, user_id):
         key=f"coins-char-{cid}",
     )
     if st.button("💾 Salvar moedas"):
-        with get_conn() as c, c:
-            c.execute(
-                "UPDATE characters SET coins=?, updated_at=? WHERE id=?",
-                (int(novas_moedas), now(), cid),
-            )
+        with writer() as c:
+            c.execute(SQL_SAVE_COINS, (int(novas_moedas), cid))
         st.success("Moedas salvas.")
 
+    flush_rerun()
+
 
 # ================== HABILIDADES ==================
 def _skill_field(r, key, default=""):
@@ -1081,6 +1423,7 @@ def _skill_field(r, key, default=""):
         return default
 
 
+@st.fragment
 def section_skills(cid: int, user_id: int):
     st.subheader("Habilidades")
 
@@ -1088,7 +1431,7 @@ def section_skills(cid: int, user_id: int):
     if st.button("🔄 Restaurar TODOS os usos de todas as habilidades", key=f"reset_all_uses_{cid}"):
         reset_all_skill_uses(cid)
         st.success("Todos os usos de habilidades desta ficha foram restaurados.")
-        st.rerun()
+        request_rerun()
 
     # unified add box (single input + category selector)
     st.markdown("### Adicionar / Reutilizar habilidade")
@@ -1096,13 +1439,8 @@ def section_skills(cid: int, user_id: int):
     with add_row[0]:
         add_name = st.text_input("Nome da habilidade", key=f"add_skill_name_{cid}")
     with add_row[1]:
-        kind_map = {
-            "Única": "unique",
-            "Genérica": "generic",
-            "Talento Inato": "innate",
-        }
         kind_label = st.selectbox(
-            "Categoria", list(kind_map.keys()), index=0, key=f"add_skill_kind_{cid}"
+            "Categoria", _KIND_LABELS, index=0, key=f"add_skill_kind_{cid}"
         )
     with add_row[2]:
         add_desc = st.text_input(
@@ -1115,12 +1453,12 @@ def section_skills(cid: int, user_id: int):
                     user_id, add_name.strip(), (add_desc or "").strip()
                 )
                 link_skill_to_char(
-                    cid, sid, kind_map.get(kind_label, "unique")
+                    cid, sid, _KIND_MAP.get(kind_label, "unique")
                 )
                 st.success(
                     f"Habilidade '{add_name.strip()}' adicionada à ficha como {kind_label}."
                 )
-                st.rerun()
+                request_rerun()
             except Exception as e:
                 st.error(f"Erro ao adicionar habilidade: {e}")
         else:
@@ -1128,6 +1466,8 @@ def section_skills(cid: int, user_id: int):
 
     st.markdown("---")
 
+    pending_uses = {}  # skill_id -> "Usos" editado (ainda não salvo)
+
     def render_skill_row(s, kind_label_internal: str):
         # columns: popup, usos, delete
         col_popup, col_uses, col_del = st.columns([5, 4, 1])
@@ -1170,6 +1510,8 @@ def section_skills(cid: int, user_id: int):
                 max_db,
                 key=f"uses_max_{cid}_{skill_id}_{kind_label_internal}",
             )
+            if usos_max != max_db:
+                pending_uses[skill_id] = usos_max
             st.markdown(f"Usos restantes: **{cur_db}**")
 
             cols_btn = st.columns(2)
@@ -1180,14 +1522,14 @@ def section_skills(cid: int, user_id: int):
                 ):
                     novo_atual = max(0, cur_db - 1)
                     update_skill_uses(cid, skill_id, usos_max, novo_atual)
-                    st.rerun()
+                    request_rerun()
             with cols_btn[1]:
                 if st.button(
                     "Restaurar",
                     key=f"reset_use_{cid}_{skill_id}_{kind_label_internal}",
                 ):
                     update_skill_uses(cid, skill_id, usos_max, usos_max)
-                    st.rerun()
+                    request_rerun()
 
         # --- coluna deletar ---
         with col_del:
@@ -1207,33 +1549,43 @@ def section_skills(cid: int, user_id: int):
                         )
                 except Exception as e:
                     st.error(f"Erro ao remover habilidade: {e}")
-                st.rerun()
+                request_rerun()
+
+    skills_by_kind = list_skills_for_char_all(cid)
 
     # Únicas
     st.markdown("##### Únicas")
-    uniques = list_skills_for_char(cid, "unique")
-    for s in uniques:
+    for s in skills_by_kind["unique"]:
         render_skill_row(s, "unique")
 
     st.markdown("---")
 
     # Genéricas
     st.markdown("##### Genéricas")
-    generics = list_skills_for_char(cid, "generic")
-    for s in generics:
+    for s in skills_by_kind["generic"]:
         render_skill_row(s, "generic")
 
     st.markdown("---")
 
     # Talento Inato
     st.markdown("##### Talento Inato")
-    innate = list_skills_for_char(cid, "innate")
-    for s in innate:
+    for s in skills_by_kind["innate"]:
         render_skill_row(s, "innate")
 
+    if st.button(
+        "💾 Salvar usos", key=f"save_all_uses_{cid}", disabled=not pending_uses
+    ):
+        update_skill_uses_many(cid, pending_uses)
+        st.success("Usos salvos.")
+        request_rerun()
+
+    flush_rerun()
+
 
 # ================== ANOTAÇÕES ==================
-def section_notes(ch, cid):
+@st.fragment
+def section_notes(cid):
+    ch = load_character(cid)[0]
     st.subheader("Anotações")
     try:
         current = ch["notes"] if "notes" in ch.keys() and ch["notes"] is not None else ""
@@ -1245,36 +1597,38 @@ def section_notes(ch, cid):
             current = ""
     notas = st.text_area("Anotações da ficha", current, height=220)
     if st.button("💾 Salvar anotações"):
-        with get_conn() as c, c:
-            c.execute(
-                "UPDATE characters SET notes=?, updated_at=? WHERE id=?",
-                (notas, now(), cid),
-            )
+        with writer() as c:
+            c.execute(SQL_SAVE_NOTES, (notas, cid))
         st.success("Anotações salvas.")
 
 
 # ================== ADMIN HUB ==================
+@st.cache_data(ttl=60)
+def _admin_users_table():
+    with reader() as c:
+        return [
+            dict(u)
+            for u in c.execute(
+                "SELECT id, username, is_admin FROM users ORDER BY username"
+            )
+        ]
+
+
 def admin_hub(user):
     st.header("Hub do Administrador")
     st.info(
         "Edite fichas, descrições e catálogos globais. Altere sua senha aqui."
     )
-    with get_conn() as c:
-        users = c.execute(
-            "SELECT id, username, is_admin FROM users ORDER BY username"
-        ).fetchall()
-    st.table([dict(u) for u in users])
+    st.table(_admin_users_table())
 
     st.subheader("Alterar senha (admin logado)")
     np = st.text_input("Nova senha", type="password")
     if st.button("Salvar senha"):
         if np:
-            hashed = bcrypt.hashpw(np.encode("utf-8"), bcrypt.gensalt())
-            with get_conn() as c, c:
-                c.execute(
-                    "UPDATE users SET password_hash=? WHERE id=?",
-                    (hashed, user["id"]),
-                )
+            hashed = hash_password(np)
+            with writer() as c:
+                c.execute(SQL_SET_PASSWORD, (hashed, user["id"]))
+            _admin_users_table.clear()
             st.success("Senha alterada.")
         else:
             st.warning("Senha não pode ser vazia.")
@@ -1300,28 +1654,16 @@ def admin_hub(user):
     icat = st.selectbox("Categoria do item global", CATEGORIES, index=2)
     idesc = st.text_area("Descrição do item global", height=120)
     if st.button("Salvar item global"):
-        with get_conn() as c, c:
-            c.execute(
-                """INSERT INTO items(owner_user_id,name,description,category)
-                         VALUES(NULL,?,?,?)
-                         ON CONFLICT(owner_user_id,name) DO UPDATE SET
-                           description=excluded.description,
-                           category=excluded.category
-                      """,
-                (iname, idesc, icat),
-            )
+        with writer() as c:
+            c.execute(SQL_UPSERT_GLOBAL_ITEM, (iname, idesc, icat))
         st.success("Item global salvo.")
 
     st.subheader("Habilidades globais (opcional)")
     sname = st.text_input("Nome da habilidade global")
     sdesc = st.text_area("Descrição da habilidade global", height=120)
     if st.button("Salvar habilidade global"):
-        with get_conn() as c, c:
-            c.execute(
-                """INSERT INTO skills(owner_user_id,name,description) VALUES(NULL,?,?)
-                         ON CONFLICT(owner_user_id,name) DO UPDATE SET description=excluded.description""",
-                (sname, sdesc),
-            )
+        with writer() as c:
+            c.execute(SQL_UPSERT_GLOBAL_SKILL, (sname, sdesc))
         st.success("Habilidade global salva.")
 
 
@@ -1341,6 +1683,30 @@ def header_and_login():
     return user
 
 
+# fragment: mexer nos editores reexecuta só a sidebar, não a ficha inteira.
+# Dentro de fragment não dá pra usar st.sidebar.*; por isso os editores escrevem
+# no container atual e são chamados dentro de `with st.sidebar:`.
+@st.fragment
+def sidebar_popup_editors(user):
+    # editor de skill popups
+    try:
+        if hasattr(skill_popup, "sidebar_skill_popup_editor"):
+            skill_popup.sidebar_skill_popup_editor(user)
+    except Exception:
+        st.error(
+            "Erro ao inicializar editor de popups de habilidade (verifique skill_popup.py)."
+        )
+
+    # editor de item popups (modular)
+    if item_popup and hasattr(item_popup, "sidebar_item_popup_editor"):
+        try:
+            item_popup.sidebar_item_popup_editor(user)
+        except Exception:
+            st.error(
+                "Erro ao inicializar editor de popups de item (verifique item_popup.py)."
+            )
+
+
 def main():
     # bootstrap geral do app (cria tabelas principais)
     bootstrap()
@@ -1350,6 +1716,8 @@ def main():
         if hasattr(skill_popup, "bootstrap"):
             skill_popup.bootstrap()
     except Exception:
+        import traceback
+
         traceback.print_exc()
 
     if item_popup:
@@ -1357,6 +1725,8 @@ def main():
             if hasattr(item_popup, "bootstrap"):
                 item_popup.bootstrap()
         except Exception:
+            import traceback
+
             traceback.print_exc()
 
     # login / usuário logado
@@ -1371,25 +1741,10 @@ def main():
 
     # editores na sidebar (após cid definido, para filtragem correta por ficha)
     if user.get("is_admin"):
-        # editor de skill popups
-        try:
-            if hasattr(skill_popup, "sidebar_skill_popup_editor"):
-                skill_popup.sidebar_skill_popup_editor(user)
-        except Exception:
-            st.sidebar.error(
-                "Erro ao inicializar editor de popups de habilidade (verifique skill_popup.py)."
-            )
-
-        # editor de item popups (modular)
-        if item_popup and hasattr(item_popup, "sidebar_item_popup_editor"):
-            try:
-                item_popup.sidebar_item_popup_editor(user)
-            except Exception:
-                st.sidebar.error(
-                    "Erro ao inicializar editor de popups de item (verifique item_popup.py)."
-                )
+        with st.sidebar:
+            sidebar_popup_editors(user)
 
-    ch, stt, cmb, inv = load_character(cid)
+    ch = load_character(cid)[0]
 
     # --- (opcional) refresh para estados de popup de skill, se skill_popup usar essa flag ---
     refresh_key = f"skill_popup_needs_refresh_{cid}"
@@ -1425,17 +1780,17 @@ def main():
         ["Básico", "Status", "Habilidades", "Combate", "Inventário", "Anotações"]
     )
     with tab1:
-        section_basic(ch, bool(user["is_admin"]), cid, user_id=user["id"])
+        section_basic(cid, bool(user["is_admin"]), user_id=user["id"])
     with tab2:
-        section_status(stt, cid, bool(user["is_admin"]))
+        section_status(cid, bool(user["is_admin"]))
     with tabSkills:
         section_skills(cid, user_id=user["id"])
     with tab3:
-        section_combat(cmb, cid, bool(user["is_admin"]))
+        section_combat(cid, bool(user["is_admin"]))
     with tab4:
-        section_inventory(ch, inv, cid, bool(user["is_admin"]), user_id=user["id"])
+        section_inventory(cid, bool(user["is_admin"]), user_id=user["id"])
     with tabNotes:
-        section_notes(ch, cid)
+        section_notes(cid)
 
     # ===== BLOCO PARA DELETAR A FICHA ATUAL =====
     # Só mostra se o usuário é admin ou dono da ficha
@@ -1479,6 +1834,8 @@ def main():
     if user["is_admin"]:
         admin_hub(user)
 
+    flush_rerun()
+
 
 if __name__ == "__main__":
     main()
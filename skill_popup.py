@@ -10,31 +10,37 @@ Skill Popup feature (modular)
     - image_border_* controla a moldura da imagem/ícone
 """
 
-import sqlite3
 import os
 import base64
+import hashlib
+import threading
+import re
 from datetime import datetime
 from contextlib import contextmanager
+from dataclasses import dataclass, astuple
+from functools import lru_cache
 import traceback
 
 import streamlit as st
+import streamlit.components.v1 as components
+from streamlit import runtime
 
-DB_PATH = os.path.join(os.path.dirname(__file__), "rpg.db")
+from db import BASE_DIR, get_conn, reader, writer
+
+# ícones ficam em disco (nome = hash do conteúdo); o banco guarda só o caminho relativo
+ICON_DIR = os.path.join("uploads", "skill_icons")
+# acima disso o ícone vai por URL /media (binário) em vez de data URI base64
+ICON_URL_MIN_BYTES = 64 * 1024
 
 
 # ================== DB HELPERS ==================
+# conexão/leitores/writer vêm de db.py (compartilhados com main.py e item_popup.py)
 
 
 def _now_iso() -> str:
     return datetime.utcnow().isoformat()
 
 
-def get_conn():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-
 SCHEMA_POPUP_BASE = """
 CREATE TABLE IF NOT EXISTS skill_popup (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -44,6 +50,7 @@ CREATE TABLE IF NOT EXISTS skill_popup (
   title TEXT DEFAULT '',
   icon_filename TEXT DEFAULT '',
   icon_blob BLOB,
+  icon_path TEXT DEFAULT '',
   alcance TEXT DEFAULT '',
   duracao TEXT DEFAULT '',
   tempo_uso TEXT DEFAULT '',
@@ -68,68 +75,83 @@ CREATE TABLE IF NOT EXISTS skill_popup (
 );
 """
 
-# flag de bootstrap preguiçoso (lazy)
-_BOOTSTRAPPED = False
+# popups da ficha já em ordem (o UNIQUE da tabela cobre skill+ficha);
+# criado depois dos ALTERs porque tabelas antigas podem não ter updated_at
+SQL_INDEX_USER_UPDATED = """CREATE INDEX IF NOT EXISTS idx_skill_popup_user_updated
+  ON skill_popup(target_user_id, updated_at DESC)"""
 
 
 def bootstrap():
-    """Cria/atualiza a tabela skill_popup."""
+    """Cria/atualiza a tabela skill_popup (uma vez por processo)."""
+    _bootstrap_once()
+
+
+@st.cache_resource
+def _bootstrap_once():
+    # cache_resource: o DDL + PRAGMA table_info roda uma vez só, não a cada rerun
+    _bootstrap_schema()
+    return True
+
+
+DESIRED_COLS = (
+    "icon_filename",
+    "icon_blob",
+    "icon_path",
+    "alcance",
+    "duracao",
+    "tempo_uso",
+    "acao",
+    "area",
+    "usos",
+    "tipo",
+    "rank",
+    "descricao",
+    "efeito_bonus",
+    "card_border_type",
+    "card_border_color1",
+    "card_border_color2",
+    "card_border_speed",
+    "image_border_type",
+    "image_border_color1",
+    "image_border_color2",
+    "image_border_speed",
+    "created_at",
+    "updated_at",
+)
+
+
+def _col_ddl(col):
+    if col == "icon_blob":
+        return f"ALTER TABLE skill_popup ADD COLUMN {col} BLOB"
+    if col.endswith("_speed"):
+        return f"ALTER TABLE skill_popup ADD COLUMN {col} REAL DEFAULT 1.0"
+    return f"ALTER TABLE skill_popup ADD COLUMN {col} TEXT DEFAULT ''"
+
+
+def _bootstrap_schema():
     conn = get_conn()
-    with conn:
+    # executescript faz COMMIT do que estiver pendente: segura o lock de transação
+    with conn._tx_lock:
         conn.executescript(SCHEMA_POPUP_BASE)
-        try:
-            existing_cols = {r["name"] for r in conn.execute("PRAGMA table_info(skill_popup)").fetchall()}
-        except Exception:
-            existing_cols = set()
-
-        desired_cols = {
-            "icon_filename",
-            "icon_blob",
-            "alcance",
-            "duracao",
-            "tempo_uso",
-            "acao",
-            "area",
-            "usos",
-            "tipo",
-            "rank",
-            "descricao",
-            "efeito_bonus",
-            "card_border_type",
-            "card_border_color1",
-            "card_border_color2",
-            "card_border_speed",
-            "image_border_type",
-            "image_border_color1",
-            "image_border_color2",
-            "image_border_speed",
-            "created_at",
-            "updated_at",
-        }
-
-        for col in desired_cols:
+    # diff lido dentro do BEGIN IMMEDIATE: outro processo não altera a tabela no meio,
+    # e todos os ALTERs saem num commit só (schema em dia = nenhum statement)
+    with writer() as conn:
+        existing_cols = {r["name"] for r in conn.execute("PRAGMA table_info(skill_popup)")}
+        for col in DESIRED_COLS:
             if col not in existing_cols:
-                try:
-                    if col == "icon_blob":
-                        conn.execute(f"ALTER TABLE skill_popup ADD COLUMN {col} BLOB")
-                    elif col.endswith("_speed"):
-                        conn.execute(f"ALTER TABLE skill_popup ADD COLUMN {col} REAL DEFAULT 1.0")
-                    else:
-                        conn.execute(f"ALTER TABLE skill_popup ADD COLUMN {col} TEXT DEFAULT ''")
-                except Exception:
-                    # em caso de corrida / erros, ignorar
-                    pass
+                conn.execute(_col_ddl(col))
+        conn.execute(SQL_INDEX_USER_UPDATED)
 
 
+# Pontos de entrada: main() chama bootstrap() a cada run e o editor chama
+# _ensure_bootstrap(); as funções de CRUD/render assumem a tabela pronta.
 def _ensure_bootstrap():
     """Garante que bootstrap() foi rodado pelo menos uma vez."""
-    global _BOOTSTRAPPED
-    if not _BOOTSTRAPPED:
-        try:
-            bootstrap()
-        except Exception:
-            traceback.print_exc()
-        _BOOTSTRAPPED = True
+    try:
+        _bootstrap_once()
+    except Exception:
+        # exceção não fica no cache_resource: a próxima chamada tenta de novo
+        traceback.print_exc()
 
 
 # ================== HELPERS DE UI ==================
@@ -151,155 +173,131 @@ def safe_modal(title: str):
 
 def row_field(row, key, default=""):
     """Acessa sqlite3.Row ou dict de forma segura."""
+    if row is None:
+        return default
+    # indexação direta (em C no sqlite3.Row); coluna ausente cai no except
     try:
-        if row is None:
-            return default
-        if hasattr(row, "keys"):
-            return row[key] if key in row.keys() and row[key] is not None else default
-        return row.get(key, default)
-    except Exception:
+        v = row[key]
+    except (IndexError, KeyError, TypeError):
         return default
+    return default if v is None else v
 
 
 # ================== CRUD POPUPS ==================
 
 
-def upsert_popup(
-    owner_user_id,
-    target_skill_id,
-    target_user_id,
-    title,
-    icon_filename,
-    icon_blob,
-    alcance,
-    duracao,
-    tempo_uso,
-    acao,
-    area,
-    usos,
-    tipo,
-    rank,
-    descricao,
-    efeito_bonus,
-    card_border_type="none",
-    card_border_color1="#ffffff",
-    card_border_color2="#000000",
-    card_border_speed=1.0,
-    image_border_type="none",
-    image_border_color1="#ffffff",
-    image_border_color2="#000000",
-    image_border_speed=1.0,
-):
-    """
-    Cria ou atualiza popup para (target_skill_id, target_user_id).
-    Total de 26 colunas (sem o id) => 26 valores.
-    """
-    _ensure_bootstrap()
+@dataclass(slots=True)
+class PopupRecord:
+    """Uma linha de skill_popup (sem id/created_at/updated_at), na ordem das colunas."""
+
+    owner_user_id: int
+    target_skill_id: int
+    target_user_id: int
+    title: str = ""
+    icon_filename: str = ""
+    icon_blob: bytes | None = None
+    icon_path: str = ""
+    alcance: str = ""
+    duracao: str = ""
+    tempo_uso: str = ""
+    acao: str = ""
+    area: str = ""
+    usos: str = ""
+    tipo: str = ""
+    rank: str = ""
+    descricao: str = ""
+    efeito_bonus: str = ""
+    card_border_type: str = "none"
+    card_border_color1: str = "#ffffff"
+    card_border_color2: str = "#000000"
+    card_border_speed: float = 1.0
+    image_border_type: str = "none"
+    image_border_color1: str = "#ffffff"
+    image_border_color2: str = "#000000"
+    image_border_speed: float = 1.0
+
+    def __post_init__(self):
+        self.card_border_speed = float(self.card_border_speed)
+        self.image_border_speed = float(self.image_border_speed)
+
+
+# skill e ficha nunca são NULL aqui, então o UNIQUE(target_skill_id, target_user_id)
+# resolve o upsert numa ida só; created_at fica o da primeira gravação
+_SQL_UPSERT = """
+INSERT INTO skill_popup(
+  owner_user_id, target_skill_id, target_user_id,
+  title, icon_filename, icon_blob, icon_path,
+  alcance, duracao, tempo_uso, acao, area,
+  usos, tipo, rank, descricao, efeito_bonus,
+  card_border_type, card_border_color1, card_border_color2, card_border_speed,
+  image_border_type, image_border_color1, image_border_color2, image_border_speed,
+  created_at, updated_at
+) VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+ON CONFLICT(target_skill_id, target_user_id) DO UPDATE SET
+    owner_user_id=excluded.owner_user_id, title=excluded.title,
+    icon_filename=excluded.icon_filename, icon_blob=excluded.icon_blob,
+    icon_path=excluded.icon_path,
+    alcance=excluded.alcance, duracao=excluded.duracao,
+    tempo_uso=excluded.tempo_uso, acao=excluded.acao, area=excluded.area,
+    usos=excluded.usos, tipo=excluded.tipo, rank=excluded.rank,
+    descricao=excluded.descricao, efeito_bonus=excluded.efeito_bonus,
+    card_border_type=excluded.card_border_type,
+    card_border_color1=excluded.card_border_color1,
+    card_border_color2=excluded.card_border_color2,
+    card_border_speed=excluded.card_border_speed,
+    image_border_type=excluded.image_border_type,
+    image_border_color1=excluded.image_border_color1,
+    image_border_color2=excluded.image_border_color2,
+    image_border_speed=excluded.image_border_speed,
+    updated_at=excluded.updated_at
+RETURNING id
+"""
+
+
+# tudo menos icon_blob: listagens não precisam copiar o ícone (pode ter centenas de KB)
+_META_COLS = (
+    "id, owner_user_id, target_skill_id, target_user_id, title, icon_filename, icon_path, "
+    "alcance, duracao, tempo_uso, acao, area, usos, tipo, rank, descricao, efeito_bonus, "
+    "card_border_type, card_border_color1, card_border_color2, card_border_speed, "
+    "image_border_type, image_border_color1, image_border_color2, image_border_speed, "
+    "created_at, updated_at"
+)
+
+
+_SQL_DELETE = "DELETE FROM skill_popup WHERE id=?"
+_SQL_LIST = f"SELECT {_META_COLS} FROM skill_popup ORDER BY updated_at DESC"
+_SQL_LIST_FOR_CHAR = (
+    f"SELECT {_META_COLS} FROM skill_popup WHERE target_user_id=? ORDER BY updated_at DESC"
+)
+_SQL_GET_POPUP = "SELECT * FROM skill_popup WHERE target_skill_id=? AND target_user_id=?"
+_SQL_CHAR_SKILLS = """
+SELECT s.id, s.name
+FROM character_skills cs
+JOIN skills s ON s.id = cs.skill_id
+WHERE cs.character_id = ?
+ORDER BY s.name
+"""
+_SQL_ICON_TO_DISK = "UPDATE skill_popup SET icon_path=?, icon_blob=NULL WHERE id=?"
+
+
+def upsert_popup(rec: PopupRecord) -> int:
+    """Cria ou atualiza o popup de (rec.target_skill_id, rec.target_user_id); devolve o id."""
     now = _now_iso()
-    conn = get_conn()
-    with conn:
-        cur = conn.execute(
-            "SELECT id FROM skill_popup WHERE target_skill_id IS ? AND target_user_id IS ?",
-            (target_skill_id, target_user_id),
-        )
-        row = cur.fetchone()
-        if row:
-            conn.execute(
-                """
-                UPDATE skill_popup SET
-                    owner_user_id=?, title=?, icon_filename=?, icon_blob=?,
-                    alcance=?, duracao=?, tempo_uso=?, acao=?, area=?,
-                    usos=?, tipo=?, rank=?, descricao=?, efeito_bonus=?,
-                    card_border_type=?, card_border_color1=?, card_border_color2=?, card_border_speed=?,
-                    image_border_type=?, image_border_color1=?, image_border_color2=?, image_border_speed=?,
-                    updated_at=?
-                WHERE id=?
-                """,
-                (
-                    owner_user_id,
-                    title,
-                    icon_filename,
-                    icon_blob,
-                    alcance,
-                    duracao,
-                    tempo_uso,
-                    acao,
-                    area,
-                    usos,
-                    tipo,
-                    rank,
-                    descricao,
-                    efeito_bonus,
-                    card_border_type,
-                    card_border_color1,
-                    card_border_color2,
-                    float(card_border_speed),
-                    image_border_type,
-                    image_border_color1,
-                    image_border_color2,
-                    float(image_border_speed),
-                    now,
-                    row["id"],
-                ),
-            )
-            return row["id"]
-        else:
-            # 26 colunas (sem o id) => 26 placeholders
-            cur = conn.execute(
-                """
-                INSERT INTO skill_popup(
-                  owner_user_id, target_skill_id, target_user_id,
-                  title, icon_filename, icon_blob,
-                  alcance, duracao, tempo_uso, acao, area,
-                  usos, tipo, rank, descricao, efeito_bonus,
-                  card_border_type, card_border_color1, card_border_color2, card_border_speed,
-                  image_border_type, image_border_color1, image_border_color2, image_border_speed,
-                  created_at, updated_at
-                ) VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-                """,
-                (
-                    owner_user_id,
-                    target_skill_id,
-                    target_user_id,
-                    title,
-                    icon_filename,
-                    icon_blob,
-                    alcance,
-                    duracao,
-                    tempo_uso,
-                    acao,
-                    area,
-                    usos,
-                    tipo,
-                    rank,
-                    descricao,
-                    efeito_bonus,
-                    card_border_type,
-                    card_border_color1,
-                    card_border_color2,
-                    float(card_border_speed),
-                    image_border_type,
-                    image_border_color1,
-                    image_border_color2,
-                    float(image_border_speed),
-                    now,
-                    now,
-                ),
-            )
-            return cur.lastrowid
+    with writer() as conn:
+        popup_id = conn.execute(_SQL_UPSERT, (*astuple(rec), now, now)).fetchone()[0]
+    _clear_popup_caches()
+    return popup_id
 
 
 def delete_popup(popup_id):
-    _ensure_bootstrap()
-    conn = get_conn()
-    with conn:
-        conn.execute("DELETE FROM skill_popup WHERE id=?", (popup_id,))
+    with writer() as conn:
+        conn.execute(_SQL_DELETE, (popup_id,))
+    _clear_popup_caches()
 
 
 def list_popups():
-    _ensure_bootstrap()
-    with get_conn() as conn:
-        return conn.execute("SELECT * FROM skill_popup ORDER BY updated_at DESC").fetchall()
+    with reader() as conn:
+        return conn.execute(_SQL_LIST).fetchall()
 
 
 def get_popup_for(skill_id=None, user_id=None):
@@ -307,24 +305,63 @@ def get_popup_for(skill_id=None, user_id=None):
     Busca SOMENTE popup específico daquela skill + personagem.
     Nada de fallback global (evita reaproveitar popup de outra skill).
     """
-    _ensure_bootstrap()
     if skill_id is None or user_id is None:
         return None
 
-    with get_conn() as conn:
-        return conn.execute(
-            "SELECT * FROM skill_popup WHERE target_skill_id=? AND target_user_id=? LIMIT 1",
-            (skill_id, user_id),
-        ).fetchone()
+    return _get_popup_for_cached(skill_id, user_id)
+
+
+def _clear_popup_caches():
+    _get_popup_for_cached.clear()
+    _get_popups_for_character_cached.clear()
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _get_popup_for_cached(skill_id, user_id):
+    # dict (picklável); upsert_popup/delete_popup limpam o cache
+    with reader() as conn:
+        r = conn.execute(_SQL_GET_POPUP, (skill_id, user_id)).fetchone()
+    return _with_escaped(dict(r)) if r else None
+
+
+# campos de texto do card: escapados uma vez no load, não a cada abertura
+_ESCAPED_FIELDS = (
+    "title", "usos", "tipo", "rank", "alcance", "duracao", "tempo_uso", "acao", "area"
+)
+_ESCAPED_LINE_FIELDS = ("descricao", "efeito_bonus")
+
+
+def _with_escaped(d):
+    """Acrescenta <campo>_esc (e <campo>_lines nos multilinha) ao dict do popup."""
+    for k in _ESCAPED_FIELDS:
+        d[f"{k}_esc"] = _fast_escape(d.get(k) or "")
+    for k in _ESCAPED_LINE_FIELDS:
+        d[f"{k}_esc"], d[f"{k}_lines"] = _escape_lines(d.get(k) or "")
+    return d
 
 
 # ================== BORDAS (CSS) ==================
 
+_BORDER_TYPES = ("none", "solid", "gradient", "flow", "pulse", "changing")
+_BORDER_TYPE_INDEX = {t: i for i, t in enumerate(_BORDER_TYPES)}
+
+# CSS fixo dos previews do editor (as bordas entram por cima, por classe)
+_PREVIEW_CSS = (
+    ".preview_card_box { width:320px; max-width:100%; height:120px; border-radius:12px;"
+    " background:linear-gradient(180deg,#0f66b3,#0a3d8a); position:relative;"
+    " color:#eaf6ff; padding:10px; box-shadow:0 8px 20px rgba(0,0,0,0.25);"
+    " box-sizing:border-box; }"
+    " .preview_card_box .inner { padding:6px; }"
+    " .preview_img_box { width:96px; height:96px; border-radius:8px; background:#1b6de0;"
+    " display:inline-block; vertical-align:middle; box-sizing:border-box; }"
+)
 
+
+@lru_cache(maxsize=512)
 def _css_for_border(prefix, btype, c1, c2, speed, uid):
     """
     Produz CSS para borda que *não* cobre o interior (usa pseudo-elemento quando precisa).
-    Retorna (inline_css, extra_css, class_name)
+    Retorna (inline_css, extra_css, class_name). Função pura: memoizada pelos argumentos.
     """
     safe = lambda s: s.replace('"', "'")
     cls = f"{prefix}_border_{uid}"
@@ -404,7 +441,7 @@ def _css_for_border(prefix, btype, c1, c2, speed, uid):
 
 
 def sidebar_skill_popup_editor(current_user):
-    """Editor na sidebar (apenas admin)."""
+    """Editor na sidebar (apenas admin). Chamar dentro de `with st.sidebar:`."""
     try:
         _ensure_bootstrap()
 
@@ -413,290 +450,334 @@ def sidebar_skill_popup_editor(current_user):
 
         cid = st.session_state.get("cid")
         if not cid:
-            st.sidebar.info("Selecione uma ficha antes de editar popups (use o seletor à esquerda).")
+            st.info("Selecione uma ficha antes de editar popups (use o seletor à esquerda).")
             return
 
-        with st.sidebar.expander("🛠 Editor de Skill Popups (Admin)", expanded=True):
-            st.markdown(f"**Editando popups para a ficha #{cid}**")
+        with st.expander("🛠 Editor de Skill Popups (Admin)", expanded=True):
+            _popup_editor_fragment(cid, current_user)
+    except Exception:
+        tb = traceback.format_exc()
+        try:
+            st.error("Erro ao inicializar/mostrar editor de popups (veja traceback).")
+            st.code(tb)
+        except Exception:
+            print("skill_popup sidebar error:\n", tb)
+
 
-            # skills APENAS da ficha atual (character_skills + skills)
+@st.fragment
+def _popup_editor_fragment(cid, current_user):
+    """
+    Corpo do editor: mexer num widget daqui (cores, sliders, textos) reexecuta
+    só este fragmento, não a ficha nem o resto da sidebar.
+    """
+    try:
+        st.markdown(f"**Editando popups para a ficha #{cid}**")
+
+        # skills APENAS da ficha atual (character_skills + skills)
+        try:
+            with reader() as conn:
+                skills = conn.execute(_SQL_CHAR_SKILLS, (cid,)).fetchall()
+        except Exception:
             skills = []
-            with get_conn() as conn:
-                try:
-                    skills = conn.execute(
-                        """
-                        SELECT s.id, s.name
-                        FROM character_skills cs
-                        JOIN skills s ON s.id = cs.skill_id
-                        WHERE cs.character_id = ?
-                        ORDER BY s.name
-                        """,
-                        (cid,),
-                    ).fetchall()
-                except Exception:
-                    skills = []
 
-            if not skills:
-                st.warning("Nenhuma skill vinculada a esta ficha ainda.")
-                return
+        if not skills:
+            st.warning("Nenhuma skill vinculada a esta ficha ainda.")
+            return
 
-            options = [(s["name"], s["id"]) for s in skills]
-            labels = [o[0] for o in options]
+        options = [(s["name"], s["id"]) for s in skills]
+        labels = [o[0] for o in options]
 
-            # key depende do cid -> quando troca de ficha, o widget é recriado
-            sel_label = st.selectbox(
-                "Escolha a habilidade (alvo do popup)",
-                labels,
-                index=0,
-                key=f"skill_popup_skill_select_{cid}",
-            )
-            sel_skill_id = next((o[1] for o in options if o[0] == sel_label), None)
-
-            if sel_skill_id is None:
-                st.warning("Selecione uma habilidade válida para editar o popup.")
-                return
-
-            # carrega popup existente (se houver) para (skill, ficha)
-            with get_conn() as conn:
-                existing = conn.execute(
-                    "SELECT * FROM skill_popup WHERE target_skill_id IS ? AND target_user_id IS ?",
-                    (sel_skill_id, cid),
-                ).fetchone()
-
-            title = st.text_input(
-                "Título (ex: <BRAÇO OFERECIDO>)",
-                value=row_field(existing, "title", ""),
-            )
+        # key depende do cid -> quando troca de ficha, o widget é recriado
+        sel_label = st.selectbox(
+            "Escolha a habilidade (alvo do popup)",
+            labels,
+            index=0,
+            key=f"skill_popup_skill_select_{cid}",
+        )
+        sel_skill_id = next((o[1] for o in options if o[0] == sel_label), None)
 
-            st.caption("Ícone (opcional)")
-            uploaded = st.file_uploader(
-                "Upload do ícone",
-                type=["png", "jpg", "jpeg", "webp", "gif"],
-                key=f"popup_icon_upload_{sel_skill_id}_{cid}",
-            )
-            icon_blob = row_field(existing, "icon_blob", None)
-            icon_filename = row_field(existing, "icon_filename", "")
-            if uploaded:
-                try:
-                    icon_blob = uploaded.getvalue()
-                    icon_filename = getattr(uploaded, "name", icon_filename or "icon.png")
-                    st.success("Ícone carregado (salvar para persistir).")
-                except Exception as e:
-                    st.error(f"Erro ao ler ícone: {e}")
-
-            st.markdown("**Metadados (canto superior direito)**")
-            ca, cb = st.columns(2)
-            with ca:
-                alcance = st.text_input(
-                    "Alcance",
-                    value=row_field(existing, "alcance", "PESSOAL"),
-                )
-                tempo_uso = st.text_input(
-                    "Tempo de uso",
-                    value=row_field(existing, "tempo_uso", "INST"),
-                )
-                usos = st.text_input(
-                    "Usos (ex: USOS 5p/D)",
-                    value=row_field(existing, "usos", "USOS 5p/D"),
-                )
-            with cb:
-                duracao = st.text_input(
-                    "Duração",
-                    value=row_field(existing, "duracao", "5 TURNOS"),
-                )
-                acao = st.text_input(
-                    "Ação",
-                    value=row_field(existing, "acao", "5 BONUS"),
-                )
-                area = st.text_input(
-                    "Área",
-                    value=row_field(existing, "area", "PESSOAL"),
-                )
+        if sel_skill_id is None:
+            st.warning("Selecione uma habilidade válida para editar o popup.")
+            return
 
-            st.markdown("**Canto esquerdo (info rápida)**")
-            tipo = st.text_input("Tipo", value=row_field(existing, "tipo", "FISICO"))
-            rank = st.text_input("Rank", value=row_field(existing, "rank", "E"))
+        # carrega popup existente (se houver) para (skill, ficha)
+        with reader() as conn:
+            existing = conn.execute(_SQL_GET_POPUP, (sel_skill_id, cid)).fetchone()
 
-            st.markdown("**Descrição e Efeito**")
-            descricao = st.text_area(
-                "Descrição (Markdown permitido)",
-                value=row_field(existing, "descricao", ""),
-                height=160,
-            )
-            efeito_bonus = st.text_input(
-                "Efeito/Bonus",
-                value=row_field(existing, "efeito_bonus", ""),
-            )
+        title = st.text_input(
+            "Título (ex: <BRAÇO OFERECIDO>)",
+            value=row_field(existing, "title", ""),
+        )
 
-            st.markdown("---")
-            st.markdown("### Bordas / Aparência")
-            CARD_TYPES = ["none", "solid", "gradient", "flow", "pulse", "changing"]
-            cur_card_type = row_field(existing, "card_border_type", "none")
-            card_border_type = st.selectbox(
-                "Tipo (card)",
-                CARD_TYPES,
-                index=CARD_TYPES.index(cur_card_type) if cur_card_type in CARD_TYPES else 0,
-            )
-            card_color1 = st.color_picker(
-                "Cor primária (card)",
-                value=row_field(existing, "card_border_color1", "#ffffff"),
-            )
-            card_color2 = st.color_picker(
-                "Cor secundária (card)",
-                value=row_field(existing, "card_border_color2", "#000000"),
+        st.caption("Ícone (opcional)")
+        uploaded = st.file_uploader(
+            "Upload do ícone",
+            type=["png", "jpg", "jpeg", "webp", "gif"],
+            key=f"popup_icon_upload_{sel_skill_id}_{cid}",
+        )
+        icon_blob = row_field(existing, "icon_blob", None)
+        icon_filename = row_field(existing, "icon_filename", "")
+        if uploaded:
+            try:
+                icon_blob = uploaded.getvalue()
+                icon_filename = getattr(uploaded, "name", icon_filename or "icon.png")
+                st.success("Ícone carregado (salvar para persistir).")
+            except Exception as e:
+                st.error(f"Erro ao ler ícone: {e}")
+
+        st.markdown("**Metadados (canto superior direito)**")
+        ca, cb = st.columns(2)
+        with ca:
+            alcance = st.text_input(
+                "Alcance",
+                value=row_field(existing, "alcance", "PESSOAL"),
             )
-            card_speed = st.slider(
-                "Velocidade / intensidade (card)",
-                0.2,
-                5.0,
-                float(row_field(existing, "card_border_speed", 1.0)),
-                0.1,
+            tempo_uso = st.text_input(
+                "Tempo de uso",
+                value=row_field(existing, "tempo_uso", "INST"),
             )
-
-            IMG_TYPES = ["none", "solid", "gradient", "flow", "pulse", "changing"]
-            cur_img_type = row_field(existing, "image_border_type", "none")
-            image_border_type = st.selectbox(
-                "Tipo (imagem)",
-                IMG_TYPES,
-                index=IMG_TYPES.index(cur_img_type) if cur_img_type in IMG_TYPES else 0,
+            usos = st.text_input(
+                "Usos (ex: USOS 5p/D)",
+                value=row_field(existing, "usos", "USOS 5p/D"),
             )
-            image_color1 = st.color_picker(
-                "Cor primária (imagem)",
-                value=row_field(existing, "image_border_color1", "#ffffff"),
+        with cb:
+            duracao = st.text_input(
+                "Duração",
+                value=row_field(existing, "duracao", "5 TURNOS"),
             )
-            image_color2 = st.color_picker(
-                "Cor secundária (imagem)",
-                value=row_field(existing, "image_border_color2", "#000000"),
+            acao = st.text_input(
+                "Ação",
+                value=row_field(existing, "acao", "5 BONUS"),
             )
-            image_speed = st.slider(
-                "Velocidade / intensidade (imagem)",
-                0.2,
-                5.0,
-                float(row_field(existing, "image_border_speed", 1.0)),
-                0.1,
+            area = st.text_input(
+                "Área",
+                value=row_field(existing, "area", "PESSOAL"),
             )
 
-            # Previews via components.html
-            import streamlit.components.v1 as components
+        st.markdown("**Canto esquerdo (info rápida)**")
+        tipo = st.text_input("Tipo", value=row_field(existing, "tipo", "FISICO"))
+        rank = st.text_input("Rank", value=row_field(existing, "rank", "E"))
 
-            preview_card_css, preview_card_extra, preview_card_cls = _css_for_border(
-                "preview_card",
-                card_border_type,
-                card_color1,
-                card_color2,
-                card_speed,
-                f"cv{cid}",
-            )
-            preview_card_html = f"""
-            <html><head><meta charset="utf-8"><style>
-              .preview_card_box {{
-                width: 320px; height: 120px; border-radius:12px;
-                background: linear-gradient(180deg,#0f66b3,#0a3d8a);
-                position:relative; color:#eaf6ff; padding:10px;
-                box-shadow:0 8px 20px rgba(0,0,0,0.25); box-sizing:border-box;
-              }}
-              .preview_card_box .inner {{ padding:6px; }}
-              .{preview_card_cls} {{ {preview_card_css} }}
-              {preview_card_extra}
-            </style></head>
-            <body>
-              <div class="preview_card_box {preview_card_cls}">
-                <div class="inner">Preview Card</div>
-              </div>
-            </body></html>
-            """
-            components.html(preview_card_html, height=140, scrolling=False)
-
-            preview_img_css, preview_img_extra, preview_img_cls = _css_for_border(
-                "preview_img",
-                image_border_type,
-                image_color1,
-                image_color2,
-                image_speed,
-                f"iv{cid}",
-            )
-            preview_img_html = f"""
-            <html><head><meta charset="utf-8"><style>
-              .preview_img_box {{
-                width: 96px; height:96px; border-radius:8px;
-                background:#1b6de0; display:inline-block;
-                vertical-align:middle; box-sizing:border-box;
-              }}
-              .{preview_img_cls} {{ {preview_img_css} }}
-              {preview_img_extra}
-            </style></head>
-            <body>
-              <div class="{preview_img_cls}" style="display:inline-block;padding:6px;border-radius:10px;">
-                <div class="preview_img_box"></div>
-              </div>
-            </body></html>
-            """
-            components.html(preview_img_html, height=120, scrolling=False)
+        st.markdown("**Descrição e Efeito**")
+        descricao = st.text_area(
+            "Descrição (Markdown permitido)",
+            value=row_field(existing, "descricao", ""),
+            height=160,
+        )
+        efeito_bonus = st.text_input(
+            "Efeito/Bonus",
+            value=row_field(existing, "efeito_bonus", ""),
+        )
 
-            st.markdown("---")
-            c1, c2 = st.columns([1, 1])
-            if c1.button("Salvar Popup"):
-                try:
-                    upsert_popup(
-                        current_user["id"],
-                        sel_skill_id,
-                        cid,
-                        title,
-                        icon_filename,
-                        icon_blob,
-                        alcance or "",
-                        duracao or "",
-                        tempo_uso or "",
-                        acao or "",
-                        area or "",
-                        usos or "",
-                        tipo or "",
-                        rank or "",
-                        descricao or "",
-                        efeito_bonus or "",
+        st.markdown("---")
+        st.markdown("### Bordas / Aparência")
+        card_border_type = st.selectbox(
+            "Tipo (card)",
+            _BORDER_TYPES,
+            index=_BORDER_TYPE_INDEX.get(row_field(existing, "card_border_type", "none"), 0),
+        )
+        card_color1 = st.color_picker(
+            "Cor primária (card)",
+            value=row_field(existing, "card_border_color1", "#ffffff"),
+        )
+        card_color2 = st.color_picker(
+            "Cor secundária (card)",
+            value=row_field(existing, "card_border_color2", "#000000"),
+        )
+        card_speed = st.slider(
+            "Velocidade / intensidade (card)",
+            0.2,
+            5.0,
+            float(row_field(existing, "card_border_speed", 1.0)),
+            0.1,
+        )
+
+        image_border_type = st.selectbox(
+            "Tipo (imagem)",
+            _BORDER_TYPES,
+            index=_BORDER_TYPE_INDEX.get(row_field(existing, "image_border_type", "none"), 0),
+        )
+        image_color1 = st.color_picker(
+            "Cor primária (imagem)",
+            value=row_field(existing, "image_border_color1", "#ffffff"),
+        )
+        image_color2 = st.color_picker(
+            "Cor secundária (imagem)",
+            value=row_field(existing, "image_border_color2", "#000000"),
+        )
+        image_speed = st.slider(
+            "Velocidade / intensidade (imagem)",
+            0.2,
+            5.0,
+            float(row_field(existing, "image_border_speed", 1.0)),
+            0.1,
+        )
+
+        # Previews inline (st.markdown): só CSS, não precisa de iframe por rerun
+        preview_card_css, preview_card_extra, preview_card_cls = _css_for_border(
+            "preview_card",
+            card_border_type,
+            card_color1,
+            card_color2,
+            card_speed,
+            f"cv{cid}",
+        )
+        preview_img_css, preview_img_extra, preview_img_cls = _css_for_border(
+            "preview_img",
+            image_border_type,
+            image_color1,
+            image_color2,
+            image_speed,
+            f"iv{cid}",
+        )
+        # tudo numa linha após </style>: linha indentada/vazia viraria markdown
+        st.markdown(
+            f"<style>{_PREVIEW_CSS}"
+            f".{preview_card_cls} {{ {preview_card_css} }} {preview_card_extra}"
+            f".{preview_img_cls} {{ {preview_img_css} }} {preview_img_extra}</style>"
+            f'<div class="preview_card_box {preview_card_cls}"><div class="inner">Preview Card</div></div>'
+            f'<div class="{preview_img_cls}" style="display:inline-block;padding:6px;border-radius:10px;margin-top:14px;">'
+            '<div class="preview_img_box"></div></div>',
+            unsafe_allow_html=True,
+        )
+
+        st.markdown("---")
+        c1, c2 = st.columns([1, 1])
+        if c1.button("Salvar Popup"):
+            try:
+                icon_path = row_field(existing, "icon_path", "")
+                if icon_blob:
+                    # upload novo (ou BLOB antigo ainda no banco) vai pro disco
+                    icon_path = _store_icon(icon_blob, icon_filename)
+                upsert_popup(
+                    PopupRecord(
+                        owner_user_id=current_user["id"],
+                        target_skill_id=sel_skill_id,
+                        target_user_id=cid,
+                        title=title,
+                        icon_filename=icon_filename,
+                        icon_path=icon_path,
+                        alcance=alcance or "",
+                        duracao=duracao or "",
+                        tempo_uso=tempo_uso or "",
+                        acao=acao or "",
+                        area=area or "",
+                        usos=usos or "",
+                        tipo=tipo or "",
+                        rank=rank or "",
+                        descricao=descricao or "",
+                        efeito_bonus=efeito_bonus or "",
                         card_border_type=card_border_type,
                         card_border_color1=card_color1,
                         card_border_color2=card_color2,
-                        card_border_speed=float(card_speed),
+                        card_border_speed=card_speed,
                         image_border_type=image_border_type,
                         image_border_color1=image_color1,
                         image_border_color2=image_color2,
-                        image_border_speed=float(image_speed),
+                        image_border_speed=image_speed,
                     )
-                    st.success("Popup salvo para esta ficha e habilidade.")
+                )
+                st.success("Popup salvo para esta ficha e habilidade.")
+            except Exception:
+                st.error("Erro ao salvar popup (veja traceback abaixo).")
+                st.code(traceback.format_exc())
+
+        if c2.button("Excluir Popup"):
+            if existing and "id" in getattr(existing, "keys", lambda: [])():
+                try:
+                    delete_popup(existing["id"])
+                    st.success("Popup excluído.")
                 except Exception:
-                    st.error("Erro ao salvar popup (veja traceback abaixo).")
+                    st.error("Erro ao excluir popup (veja traceback abaixo).")
                     st.code(traceback.format_exc())
-
-            if c2.button("Excluir Popup"):
-                if existing and "id" in getattr(existing, "keys", lambda: [])():
-                    try:
-                        delete_popup(existing["id"])
-                        st.success("Popup excluído.")
-                    except Exception:
-                        st.error("Erro ao excluir popup (veja traceback abaixo).")
-                        st.code(traceback.format_exc())
-                else:
-                    st.warning("Nenhum popup existente para excluir nesta combinação.")
+            else:
+                st.warning("Nenhum popup existente para excluir nesta combinação.")
     except Exception:
-        tb = traceback.format_exc()
-        try:
-            st.sidebar.error("Erro ao inicializar/mostrar editor de popups (veja traceback).")
-            st.sidebar.code(tb)
-        except Exception:
-            print("skill_popup sidebar error:\n", tb)
+        # em rerun só do fragmento, o try do sidebar_skill_popup_editor não está na pilha
+        st.error("Erro ao mostrar editor de popups (veja traceback).")
+        st.code(traceback.format_exc())
 
 
 # ================== RENDER NO CLICAR DA LUPA ==================
 
 
+def _store_icon(raw, filename):
+    """Grava o ícone em ICON_DIR (deduplicado pelo sha256) e devolve o caminho relativo."""
+    ext = os.path.splitext(filename or "")[1].lower() or ".png"
+    rel = os.path.join(ICON_DIR, hashlib.sha256(raw).hexdigest()[:16] + ext)
+    path = os.path.join(BASE_DIR, rel)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(raw)
+        os.replace(tmp, path)
+    return rel
+
+
+def _icon_file(popup_row):
+    """
+    Caminho absoluto do ícone do popup (None se não houver). Popup antigo com
+    o ícone em icon_blob é migrado para o disco aqui, na primeira abertura.
+    """
+    rel = row_field(popup_row, "icon_path", "")
+    if rel and os.path.exists(os.path.join(BASE_DIR, rel)):
+        return os.path.join(BASE_DIR, rel)
+    blob = row_field(popup_row, "icon_blob", None)
+    if not blob:
+        return None
+    rel = _store_icon(blob, row_field(popup_row, "icon_filename", ""))
+    try:
+        with writer() as conn:
+            conn.execute(_SQL_ICON_TO_DISK, (rel, row_field(popup_row, "id", None)))
+        _clear_popup_caches()
+    except Exception:
+        traceback.print_exc()
+    return os.path.join(BASE_DIR, rel)
+
+
+def _icon_mime(icon_filename):
+    name = icon_filename.lower()
+    if name.endswith((".jpg", ".jpeg")):
+        return "image/jpeg"
+    if name.endswith(".gif"):
+        return "image/gif"
+    if name.endswith(".webp"):
+        return "image/webp"
+    return "image/png"
+
+
+@lru_cache(maxsize=128)
+def _icon_data_uri(path, icon_filename):
+    # o nome do arquivo é o hash do conteúdo, então o caminho já é uma boa chave;
+    # lru_cache devolve sempre o mesmo objeto (sem pickle a cada leitura, hash já calculado)
+    with open(path, "rb") as f:
+        raw = f.read()
+    return f"data:{_icon_mime(icon_filename)};base64,{base64.b64encode(raw).decode()}"
+
+
+def _icon_media_url(icon_path, mime, coordinates):
+    """
+    Registra o blob no media file manager do Streamlit e devolve a URL /media/...
+    (None fora de um runtime). A URL vale enquanto o popup for redesenhado a cada rerun.
+    """
+    if not runtime.exists():
+        return None
+    url = runtime.get_instance().media_file_mgr.add(icon_path, mime, coordinates)
+    # o iframe (srcdoc) resolve a URL relativa ao host; respeita baseUrlPath
+    base = (st.get_option("server.baseUrlPath") or "").strip("/")
+    return f"/{base}{url}" if base else url
+
+
 def get_popups_for_character(character_id):
-    _ensure_bootstrap()
-    with get_conn() as conn:
-        return conn.execute(
-            "SELECT * FROM skill_popup WHERE target_user_id=? ORDER BY updated_at DESC",
-            (character_id,),
-        ).fetchall()
+    return _get_popups_for_character_cached(character_id)
+
+
+@st.cache_data(ttl=30, show_spinner=False)
+def _get_popups_for_character_cached(character_id):
+    with reader() as conn:
+        rows = conn.execute(_SQL_LIST_FOR_CHAR, (character_id,)).fetchall()
+    return [dict(r) for r in rows]
 
 
 def render_skill_button(skill_row, character_id, current_user):
@@ -704,21 +785,9 @@ def render_skill_button(skill_row, character_id, current_user):
     Desenha o botão de lupa para uma habilidade.
     skill_row deve ter colunas: id, name, description
     """
-
-    def _get(r, k, default=""):
-        try:
-            return r[k] if r and hasattr(r, "keys") and k in r.keys() else default
-        except Exception:
-            try:
-                return r.get(k, default)
-            except Exception:
-                return default
-
-    _ensure_bootstrap()
-
-    skill_id = _get(skill_row, "id", "")
-    skill_name = _get(skill_row, "name", "Habilidade")
-    skill_desc = _get(skill_row, "description", "")
+    skill_id = row_field(skill_row, "id", "")
+    skill_name = row_field(skill_row, "name", "Habilidade")
+    skill_desc = row_field(skill_row, "description", "")
 
     btn_key = f"skill_popup_btn_{skill_id}_{character_id}"
     open_key = f"skill_popup_open_{skill_id}_{character_id}"
@@ -738,261 +807,228 @@ def render_skill_button(skill_row, character_id, current_user):
                 st.write(skill_desc or "_(sem descrição)_")
 
 
-def _render_skill_template_popup(popup_row, skill_name, skill_desc, character_id, current_user):
-    import html as _html
-    import textwrap
-    import streamlit.components.v1 as components
+# cabeçalho + CSS fixo do card: constante pronta, não passa por substituição
+_SKILL_POPUP_HEAD = """\
+<!doctype html>
+<html>
+<head>
+  <meta charset="utf-8">
+  <meta name="viewport" content="width=device-width,initial-scale=1">
+  <style>
+    :root {
+      --bg1: #0f66b3;
+      --bg2: #0a3d8a;
+      --accent: #f7d9d9;
+      --desc-bg: rgba(0,0,0,0.12);
+      --effect-green: #39ff7a;
+      font-family: "Segoe UI", Roboto, Arial, sans-serif;
+    }
+    body {
+      margin:0;
+      background: transparent;
+      -webkit-font-smoothing:antialiased;
+    }
+    .outer {
+      width:100%;
+      display:flex;
+      justify-content:center;
+      padding:8px 14px;
+    }
+    .card {
+      width:920px;
+      border-radius:18px;
+      padding:18px;
+      color:#eaf6ff;
+      position:relative;
+      overflow:visible;
+      box-sizing:border-box;
+    }
+    .card-inner {
+      background: linear-gradient(180deg, var(--bg1) 0%, var(--bg2) 100%);
+      border-radius:14px;
+      padding:12px;
+      box-sizing:border-box;
+    }
+    .row { display:flex; gap:18px; align-items:flex-start; }
+    .icon-col {
+      width:128px;
+      flex:0 0 128px;
+      text-align:center;
+    }
+    .meta-col { flex:1; position:relative; min-width:0; }
+    .title {
+      font-size:22px;
+      font-weight:800;
+      margin-bottom:6px;
+      color:#eaf6ff;
+    }
+    .top-meta {
+      position:absolute;
+      right:0;
+      top:0;
+      text-align:right;
+      font-size:13px;
+      color:#e6f6ff;
+    }
+    .meta-line { margin-bottom:6px; }
+    .desc-box {
+      margin-top:64px;
+      background: var(--desc-bg);
+      padding:16px 20px;
+      border-radius:12px;
+      width:72%;
+      box-sizing: border-box;
+    }
+    .desc-label {
+      font-weight:800;
+      margin-bottom:6px;
+      font-size:14px;
+    }
+    .desc-text {
+      color:#e8f9ff;
+      line-height:1.4;
+      font-size:13px;
+      padding-right:4px;
+      word-break: break-word;
+    }
+    .type-rank {
+      margin-top:6px;
+      font-size:13px;
+      color:#eaf6ff;
+    }
+    .effect {
+      margin-top:10px;
+      color: var(--effect-green);
+      font-weight:800;
+    }
+    @media (max-width:980px) {
+      .card { width:100%; padding:14px; }
+      .desc-box { width:100%; margin-top:12px; }
+      .top-meta {
+        position:static;
+        text-align:left;
+        margin-top:6px;
+      }
+    }
+"""
 
-    def _g(k):
-        return row_field(popup_row, k, "")
+# parte dinâmica: só as regras de borda e o corpo com os campos (%-format, sem chaves dobradas)
+_SKILL_POPUP_BORDER_CSS = """\
+    .card-inner.%(card_cls)s { %(card_css_inline)s }
+    .%(img_cls)s { %(img_css_inline)s }
+    %(card_extra)s
+    %(img_extra)s
+"""
 
-    title = _g("title") or skill_name
-    icon_blob = _g("icon_blob")
-    icon_filename = (_g("icon_filename") or "").strip()
-    alcance = _g("alcance") or ""
-    duracao = _g("duracao") or ""
-    tempo_uso = _g("tempo_uso") or ""
-    acao = _g("acao") or ""
-    area = _g("area") or ""
-    usos = _g("usos") or ""
-    tipo = _g("tipo") or ""
-    rank = _g("rank") or ""
-    descricao = _g("descricao") or ""
-    efeito = _g("efeito_bonus") or ""
+_SKILL_POPUP_BODY = """\
+  </style>
+</head>
+<body>
+  <div class="outer">
+    <div class="card">
+      <div class="card-inner %(card_cls)s">
+        <div class="row">
+          <div class="icon-col" style="display:flex;flex-direction:column;align-items:center;">
+            <div class="%(img_cls)s" style="display:inline-block;padding:6px;border-radius:10px; box-sizing:border-box;">
+              <div style="width:96px;height:96px;display:flex;align-items:center;justify-content:center;">
+                %(icon_html_inner)s
+              </div>
+            </div>
 
-    card_border_type = _g("card_border_type") or "none"
-    card_border_color1 = _g("card_border_color1") or "#ffffff"
-    card_border_color2 = _g("card_border_color2") or "#000000"
-    try:
-        card_border_speed = float(_g("card_border_speed") or 1.0)
-    except Exception:
-        card_border_speed = 1.0
+            <div style="height:8px;"></div>
+            <div style="font-weight:700; font-size:13px;color:#eaf6ff;margin-top:8px">
+              %(usos_esc)s
+            </div>
+            <div class="type-rank">%(tipo_esc)s</div>
+            <div class="type-rank">[RANK %(rank_esc)s]</div>
+          </div>
 
-    image_border_type = _g("image_border_type") or "none"
-    image_border_color1 = _g("image_border_color1") or "#ffffff"
-    image_border_color2 = _g("image_border_color2") or "#000000"
-    try:
-        image_border_speed = float(_g("image_border_speed") or 1.0)
-    except Exception:
-        image_border_speed = 1.0
+          <div class="meta-col">
+            <div class="title">&lt;%(title_esc)s&gt;</div>
 
-    uid = f"{row_field(popup_row, 'id', 'x')}_{character_id}"
+            <div class="top-meta">
+              <div class="meta-line">[ALCANCE: <strong>%(alcance_esc)s</strong>]</div>
+              <div class="meta-line">[DURAÇÃO: <strong>%(duracao_esc)s</strong>]</div>
+              <div class="meta-line">[TEMPO DE USO: <strong>%(tempo_uso_esc)s</strong>]</div>
+              <div class="meta-line">[AÇÃO: <strong>%(acao_esc)s</strong>]</div>
+              <div class="meta-line">[ÁREA: <strong>%(area_esc)s</strong>]</div>
+            </div>
 
-    # monta data URI do ícone, se houver blob
-    if icon_blob:
-        try:
-            b64 = base64.b64encode(icon_blob).decode()
-            mime = "image/png"
-            if icon_filename.lower().endswith((".jpg", ".jpeg")):
-                mime = "image/jpeg"
-            elif icon_filename.lower().endswith(".gif"):
-                mime = "image/gif"
-            elif icon_filename.lower().endswith(".webp"):
-                mime = "image/webp"
-            data_uri = f"data:{mime};base64,{b64}"
-            icon_html_inner = (
-                f'<img src="{data_uri}" '
-                'style="width:96px;height:96px;object-fit:cover;'
-                'border-radius:6px;display:block" />'
-            )
-        except Exception:
-            icon_html_inner = (
-                '<div style="width:96px;height:96px;border-radius:6px;'
-                "background:rgba(0,0,0,0.2);display:flex;align-items:center;"
-                'justify-content:center;color:#dff4ff;">ICON</div>'
-            )
-    else:
-        icon_html_inner = (
-            '<div style="width:96px;height:96px;border-radius:6px;'
-            "background:rgba(0,0,0,0.2);display:flex;align-items:center;"
-            'justify-content:center;color:#dff4ff;">ICON</div>'
-        )
+            <div class="desc-box">
+              <div class="desc-label">DESCRIÇÃO:</div>
+              <div class="desc-text">%(descricao_esc)s</div>
+            </div>
 
-    # CSS de bordas
-    card_css_inline, card_extra, card_cls = _css_for_border(
-        "card",
-        card_border_type,
-        card_border_color1,
-        card_border_color2,
-        card_border_speed,
-        uid,
-    )
-    img_css_inline, img_extra, img_cls = _css_for_border(
-        "img",
-        image_border_type,
-        image_border_color1,
-        image_border_color2,
-        image_border_speed,
-        uid,
+            <div class="effect">%(efeito_esc)s</div>
+          </div>
+        </div>
+      </div>
+    </div>
+  </div>
+  <script>
+    // ajusta o iframe ao conteúdo real (a altura do Python é só a estimativa inicial)
+    (function () {
+      var fit = function () {
+        var frame = window.frameElement;
+        if (frame) frame.style.height = document.body.scrollHeight + "px";
+      };
+      window.addEventListener("load", fit);
+      if (window.ResizeObserver) new ResizeObserver(fit).observe(document.body);
+    })();
+  </script>
+</body>
+    </html>
+"""
+
+_SKILL_POPUP_TPL = _SKILL_POPUP_BORDER_CSS + _SKILL_POPUP_BODY
+
+# caso comum (sem borda animada em nenhum dos dois): regras fixas, sem slots de CSS
+_NO_BORDER_CSS = _css_for_border("card", "none", "", "", 1.0, "none")[0]
+_SKILL_POPUP_TPL_PLAIN = (
+    f"    .card-inner.card_border_none {{ {_NO_BORDER_CSS} }}\n"
+    f"    .img_border_none {{ {_NO_BORDER_CSS} }}\n"
+    + _SKILL_POPUP_BODY.replace("%(card_cls)s", "card_border_none").replace(
+        "%(img_cls)s", "img_border_none"
     )
+)
 
-    descricao_esc = _html.escape(descricao).replace("\n", "<br>") if descricao else ""
-    efeito_esc = _html.escape(efeito).replace("\n", "<br>") if efeito else ""
-    if not descricao_esc and skill_desc:
-        descricao_esc = _html.escape(skill_desc).replace("\n", "<br>")
-
-    html = textwrap.dedent(
-        f"""
-    <!doctype html>
-    <html>
-    <head>
-      <meta charset="utf-8">
-      <meta name="viewport" content="width=device-width,initial-scale=1">
-      <style>
-        :root {{
-          --bg1: #0f66b3;
-          --bg2: #0a3d8a;
-          --accent: #f7d9d9;
-          --desc-bg: rgba(0,0,0,0.12);
-          --effect-green: #39ff7a;
-          font-family: "Segoe UI", Roboto, Arial, sans-serif;
-        }}
-        body {{
-          margin:0;
-          background: transparent;
-          -webkit-font-smoothing:antialiased;
-        }}
-        .outer {{
-          width:100%;
-          display:flex;
-          justify-content:center;
-          padding:8px 14px;
-        }}
-        .card {{
-          width:920px;
-          border-radius:18px;
-          padding:18px;
-          color:#eaf6ff;
-          position:relative;
-          overflow:visible;
-          box-sizing:border-box;
-        }}
-        .card-inner {{
-          background: linear-gradient(180deg, var(--bg1) 0%, var(--bg2) 100%);
-          border-radius:14px;
-          padding:12px;
-          box-sizing:border-box;
-        }}
-        .row {{ display:flex; gap:18px; align-items:flex-start; }}
-        .icon-col {{
-          width:128px;
-          flex:0 0 128px;
-          text-align:center;
-        }}
-        .meta-col {{ flex:1; position:relative; min-width:0; }}
-        .title {{
-          font-size:22px;
-          font-weight:800;
-          margin-bottom:6px;
-          color:#eaf6ff;
-        }}
-        .top-meta {{
-          position:absolute;
-          right:0;
-          top:0;
-          text-align:right;
-          font-size:13px;
-          color:#e6f6ff;
-        }}
-        .meta-line {{ margin-bottom:6px; }}
-        .desc-box {{
-          margin-top:64px;
-          background: var(--desc-bg);
-          padding:16px 20px;
-          border-radius:12px;
-          width:72%;
-          box-sizing: border-box;
-        }}
-        .desc-label {{
-          font-weight:800;
-          margin-bottom:6px;
-          font-size:14px;
-        }}
-        .desc-text {{
-          color:#e8f9ff;
-          line-height:1.4;
-          font-size:13px;
-          padding-right:4px;
-          word-break: break-word;
-        }}
-        .type-rank {{
-          margin-top:6px;
-          font-size:13px;
-          color:#eaf6ff;
-        }}
-        .effect {{
-          margin-top:10px;
-          color: var(--effect-green);
-          font-weight:800;
-        }}
-        @media (max-width:980px) {{
-          .card {{ width:100%; padding:14px; }}
-          .desc-box {{ width:100%; margin-top:12px; }}
-          .top-meta {{
-            position:static;
-            text-align:left;
-            margin-top:6px;
-          }}
-        }}
-        .card-inner.{card_cls} {{ {card_css_inline} }}
-        .{img_cls} {{ {img_css_inline} }}
-        {card_extra}
-        {img_extra}
-      </style>
-    </head>
-    <body>
-      <div class="outer">
-        <div class="card">
-          <div class="card-inner {card_cls}">
-            <div class="row">
-              <div class="icon-col" style="display:flex;flex-direction:column;align-items:center;">
-                <div class="{img_cls}" style="display:inline-block;padding:6px;border-radius:10px; box-sizing:border-box;">
-                  <div style="width:96px;height:96px;display:flex;align-items:center;justify-content:center;">
-                    {icon_html_inner}
-                  </div>
-                </div>
-
-                <div style="height:8px;"></div>
-                <div style="font-weight:700; font-size:13px;color:#eaf6ff;margin-top:8px">
-                  {_html.escape(usos)}
-                </div>
-                <div class="type-rank">{_html.escape(tipo)}</div>
-                <div class="type-rank">[RANK {_html.escape(rank)}]</div>
-              </div>
 
-              <div class="meta-col">
-                <div class="title">&lt;{_html.escape(title)}&gt;</div>
+# mesmo resultado de html.escape (quote=True), numa única passada em C
+_ESC_TABLE = str.maketrans(
+    {"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#x27;"}
+)
+# escape + quebra de linha -> <br>
+_ESC_LINES_TABLE = {**_ESC_TABLE, ord("\n"): "<br>"}
 
-                <div class="top-meta">
-                  <div class="meta-line">[ALCANCE: <strong>{_html.escape(alcance)}</strong>]</div>
-                  <div class="meta-line">[DURAÇÃO: <strong>{_html.escape(duracao)}</strong>]</div>
-                  <div class="meta-line">[TEMPO DE USO: <strong>{_html.escape(tempo_uso)}</strong>]</div>
-                  <div class="meta-line">[AÇÃO: <strong>{_html.escape(acao)}</strong>]</div>
-                  <div class="meta-line">[ÁREA: <strong>{_html.escape(area)}</strong>]</div>
-                </div>
 
-                <div class="desc-box">
-                  <div class="desc-label">DESCRIÇÃO:</div>
-                  <div class="desc-text">{descricao_esc}</div>
-                </div>
+# a maioria dos campos não tem nada a escapar: devolve a própria string
+_HTML_UNSAFE = re.compile(r"[&<>\"']")
+_HTML_UNSAFE_LINES = re.compile(r"[&<>\"'\n]")
+
+
+# campos de skill se repetem muito (tipo, rank, alcance...): memoiza o escape
+@lru_cache(maxsize=4096)
+def _escape_cached(text):
+    return text.translate(_ESC_TABLE)
 
-                <div class="effect">{efeito_esc}</div>
-              </div>
-            </div>
-          </div>
-        </div>
-      </div>
-    </body>
-        </html>
-    """
-    ).lstrip()
 
-    # altura dinâmica aproximada (agora considera descrição + efeito)
-        # ===== ALTURA DINÂMICA MAIS PRECISA =====
+def _fast_escape(text):
+    s = text if isinstance(text, str) else str(text)
+    return _escape_cached(s) if _HTML_UNSAFE.search(s) else s
 
-    desc_lines = descricao.count("\n") + 1 if descricao else 1
-    effect_lines = efeito.count("\n") + 1 if efeito else 0
 
+@lru_cache(maxsize=512)
+def _escape_lines(text):
+    """Devolve (texto escapado com <br>, nº de linhas); 0 linhas para texto vazio."""
+    if not text:
+        return "", 0
+    if not _HTML_UNSAFE_LINES.search(text):
+        return text, 1
+    return text.translate(_ESC_LINES_TABLE), text.count("\n") + 1
+
+
+@lru_cache(maxsize=512)
+def _popup_height(desc_lines, effect_lines, bordered, has_icon):
     # altura aproximada por linha
     line_height = 20
 
@@ -1002,15 +1038,180 @@ def _render_skill_template_popup(popup_row, skill_name, skill_desc, character_id
     approx_height = base_height + (desc_lines * line_height) + (effect_lines * line_height)
 
     # se tiver borda animada, acrescenta mais espaço no iframe
-    if card_border_type != "none" or image_border_type != "none":
+    if bordered:
         approx_height += 70
 
     # margem extra se houver ícone
-    if icon_blob:
+    if has_icon:
         approx_height += 40
 
     # limite mínimo e máximo
-    approx_height = min(max(approx_height, 500), 2000)
+    return 500 if approx_height < 500 else 2000 if approx_height > 2000 else approx_height
+
+
+_ICON_PLACEHOLDER = (
+    '<div style="width:96px;height:96px;border-radius:6px;'
+    "background:rgba(0,0,0,0.2);display:flex;align-items:center;"
+    'justify-content:center;color:#dff4ff;">ICON</div>'
+)
+
+
+# cada popup vive no próprio iframe: classes/keyframes não colidem, então o CSS de
+# borda não precisa do id do popup e é reaproveitado entre skills com a mesma borda
+_POPUP_CSS_UID = "popup"
+
+
+@lru_cache(maxsize=256)
+def _build_popup_html(
+    title_esc,
+    usos_esc,
+    tipo_esc,
+    rank_esc,
+    alcance_esc,
+    duracao_esc,
+    tempo_uso_esc,
+    acao_esc,
+    area_esc,
+    descricao_esc,
+    desc_lines,
+    efeito_esc,
+    effect_lines,
+    icon_src,
+    card_border,
+    image_border,
+):
+    """
+    Monta (html, altura) do card a partir dos campos já escapados. Função pura:
+    reabrir o mesmo popup vira uma consulta ao cache.
+    icon_src=None -> sem ícone; "" -> placeholder.
+    """
+    if icon_src:
+        icon_html_inner = (
+            f'<img src="{icon_src}" '
+            'style="width:96px;height:96px;object-fit:cover;'
+            'border-radius:6px;display:block" />'
+        )
+    else:
+        icon_html_inner = _ICON_PLACEHOLDER
+
+    fields = {
+        "title_esc": title_esc,
+        "usos_esc": usos_esc,
+        "tipo_esc": tipo_esc,
+        "rank_esc": rank_esc,
+        "alcance_esc": alcance_esc,
+        "duracao_esc": duracao_esc,
+        "tempo_uso_esc": tempo_uso_esc,
+        "acao_esc": acao_esc,
+        "area_esc": area_esc,
+        "descricao_esc": descricao_esc,
+        "efeito_esc": efeito_esc,
+        "icon_html_inner": icon_html_inner,
+    }
+    bordered = card_border[0] != "none" or image_border[0] != "none"
+    if bordered:
+        # CSS de bordas
+        card_css_inline, card_extra, card_cls = _css_for_border(
+            "card", *card_border, _POPUP_CSS_UID
+        )
+        img_css_inline, img_extra, img_cls = _css_for_border(
+            "img", *image_border, _POPUP_CSS_UID
+        )
+        fields.update(
+            card_cls=card_cls,
+            card_css_inline=card_css_inline,
+            card_extra=card_extra,
+            img_cls=img_cls,
+            img_css_inline=img_css_inline,
+            img_extra=img_extra,
+        )
+        html = _SKILL_POPUP_HEAD + _SKILL_POPUP_TPL % fields
+    else:
+        html = _SKILL_POPUP_HEAD + _SKILL_POPUP_TPL_PLAIN % fields
+
+    # altura dinâmica aproximada (considera descrição + efeito)
+    approx_height = _popup_height(
+        desc_lines,
+        effect_lines,
+        bordered,
+        icon_src is not None,
+    )
+    return html, approx_height
+
+
+def _render_skill_template_popup(popup_row, skill_name, skill_desc, character_id, current_user):
+
+    def _g(k):
+        return row_field(popup_row, k, "")
+
+    # campos de texto já vêm escapados do loader; linha crua (sem *_esc) escapa aqui
+    if isinstance(popup_row, dict) and "title_esc" in popup_row:
+        esc = popup_row
+    else:
+        esc = _with_escaped(dict(popup_row))
+
+    icon_filename = (_g("icon_filename") or "").strip()
+    descricao_esc = esc["descricao_esc"]
+    # sem descrição própria (catálogo ou vazio) conta como uma linha
+    desc_lines = esc["descricao_lines"] or 1
+    if not descricao_esc and skill_desc:
+        descricao_esc = _escape_lines(skill_desc)[0]
+
+    card_border_type = _g("card_border_type") or "none"
+    card_border_color1 = _g("card_border_color1") or "#ffffff"
+    card_border_color2 = _g("card_border_color2") or "#000000"
+    try:
+        card_border_speed = float(_g("card_border_speed") or 1.0)
+    except Exception:
+        card_border_speed = 1.0
+
+    image_border_type = _g("image_border_type") or "none"
+    image_border_color1 = _g("image_border_color1") or "#ffffff"
+    image_border_color2 = _g("image_border_color2") or "#000000"
+    try:
+        image_border_speed = float(_g("image_border_speed") or 1.0)
+    except Exception:
+        image_border_speed = 1.0
+
+    uid = f"{row_field(popup_row, 'id', 'x')}_{character_id}"
+
+    # ícone: URL /media (grandes) ou data URI (pequenos), sempre a partir do arquivo
+    try:
+        icon_path = _icon_file(popup_row)
+    except Exception:
+        traceback.print_exc()
+        icon_path = None
+    icon_src = None
+    if icon_path:
+        try:
+            if os.path.getsize(icon_path) > ICON_URL_MIN_BYTES:
+                icon_src = _icon_media_url(
+                    icon_path, _icon_mime(icon_filename), f"skill_popup_icon.{uid}"
+                )
+            if not icon_src:
+                icon_src = _icon_data_uri(icon_path, icon_filename)
+        except Exception:
+            # arquivo ilegível: mostra o placeholder, mas mantém a margem do ícone
+            icon_src = ""
+
+    html, approx_height = _build_popup_html(
+        esc["title_esc"] or _fast_escape(skill_name),
+        esc["usos_esc"],
+        esc["tipo_esc"],
+        esc["rank_esc"],
+        esc["alcance_esc"],
+        esc["duracao_esc"],
+        esc["tempo_uso_esc"],
+        esc["acao_esc"],
+        esc["area_esc"],
+        descricao_esc,
+        desc_lines,
+        esc["efeito_bonus_esc"],
+        esc["efeito_bonus_lines"],
+        icon_src,
+        (card_border_type, card_border_color1, card_border_color2, card_border_speed),
+        (image_border_type, image_border_color1, image_border_color2, image_border_speed),
+    )
 
     components.html(html, height=approx_height, scrolling=False)
 